@@ -0,0 +1,363 @@
+import asyncio, fnmatch, glob, os, struct, zlib
+from app import protocol as P
+from app.fileops import ChunkWriter, io_pool, map_file, write_files, WRITE_BEHIND_LIMIT
+
+# -----------------
+# A bundle is many files sent as one byte stream: an index of
+# (name, size, offset, crc32) per file, then the contents back to back,
+# carried by ordinary DATA frames whose offsets are bundle offsets. A DATA
+# frame may span several small files, so a directory of tiny files costs
+# one request and full frames instead of a round trip per file.
+INDEX_HEADER = struct.Struct("!I")      # number of entries
+INDEX_ENTRY = struct.Struct("!QQIH")    # size, offset in the bundle, crc32, name length; then name
+BUNDLE_FILES = 4096       # files per bundle; larger batches go as several bundles
+MAP_THRESHOLD = 64*1024   # smaller files are read rather than mmapped (an mmap holds an fd)
+SMALL_FILE = 256*1024     # received files up to this size are collected in memory...
+GROUP_FILES = 256         # ...and written and fsynced in groups of this many files
+GROUP_BYTES = 1 << 20     # or bytes, whichever comes first
+MAX_COMMITS = 64          # large files waiting for fsync + rename before the sender is paused
+
+def encode_index(entries):
+    parts = [INDEX_HEADER.pack(len(entries))]
+    for name, size, offset, crc in entries:
+        raw = name.encode()
+        parts.append(INDEX_ENTRY.pack(size, offset, crc, len(raw)))
+        parts.append(raw)
+    return b"".join(parts)
+
+def decode_index(body):
+    """[(name, size, offset, crc)]; offsets must follow each other without gaps"""
+    try:
+        n, = INDEX_HEADER.unpack_from(body)
+        pos, expect, entries = INDEX_HEADER.size, 0, []
+        for _ in range(n):
+            size, offset, crc, length = INDEX_ENTRY.unpack_from(body, pos)
+            pos += INDEX_ENTRY.size
+            name = bytes(body[pos:pos + length]).decode()
+            pos += length
+            if offset != expect or len(name.encode()) != length:
+                raise P.ProtocolError("malformed bundle index")
+            expect += size
+            entries.append((name, size, offset, crc))
+    except (struct.error, UnicodeDecodeError):
+        raise P.ProtocolError("malformed bundle index")
+    return entries
+
+def bundle_size(entries):
+    return entries[-1][2] + entries[-1][1] if entries else 0
+
+def encode_results(results):
+    return "\n".join(f"{name}\t{status}" for name, status in results.items()).encode()
+
+def decode_results(body):
+    results = {}
+    for line in body.decode(errors="replace").split("\n"):
+        name, _, status = line.partition("\t")
+        if name:
+            results[name] = status
+    return results
+
+# -----------------
+# Picking files
+def has_magic(pattern):
+    return any(c in pattern for c in "*?[")
+
+def match_names(patterns, names):
+    """Names matching any of the patterns (plain names match themselves), in names order"""
+    return [n for n in names if any(fnmatch.fnmatchcase(n, p) for p in patterns)]
+
+def expand_local(sources):
+    """[(name, path)] for local paths, glob patterns and directories (their
+    files, not recursive). Names are base names; the first file of a name
+    wins and hidden files are left out unless named explicitly."""
+    files, seen = [], set()
+    for src in sources:
+        if os.path.isdir(src):
+            paths = [os.path.join(src, n) for n in sorted(os.listdir(src)) if not n.startswith(".")]
+            paths = [p for p in paths if os.path.isfile(p)]
+        elif has_magic(src):
+            paths = [p for p in sorted(glob.glob(src)) if os.path.isfile(p)]
+        else:
+            paths = [src]       # a missing file is reported by build_index
+        for path in paths:
+            name = os.path.basename(path)
+            if name not in seen:
+                seen.add(name)
+                files.append((name, path))
+    return files
+
+def build_index(files):
+    """Index a batch of (name, path) files. Returns (entries, paths, errors)
+    where errors maps the names of unreadable files to the reason."""
+    entries, paths, errors = [], [], {}
+    offset = 0
+    for name, path in files:
+        crc, size = 0, 0
+        try:
+            with open(path, "rb") as f:
+                while True:
+                    data = f.read(1 << 20)
+                    if not data:
+                        break
+                    crc = zlib.crc32(data, crc)
+                    size += len(data)
+        except OSError as e:
+            errors[name] = e.strerror or str(e)
+            continue
+        entries.append((name, size, offset, crc))
+        paths.append(path)
+        offset += size
+    return entries, paths, errors
+
+def _load(path, size):
+    if size > MAP_THRESHOLD:
+        return map_file(path)
+    with open(path, "rb") as f:
+        return memoryview(f.read(size))
+
+# -----------------
+class BundleProducer:
+    """Pull-based source for Session.add_producer sending the files of an
+    index as DATA frames of up to DATA_FRAME_SIZE bundle bytes, then with
+    eof the EOF frame carrying the bundle size. A file that changed size
+    since it was indexed is cut or zero-padded to the indexed size; its
+    CRC then fails on the receiving side."""
+    def __init__(self, req_id, entries, paths, on_done=None, eof=True):
+        self.req_id = req_id
+        self.entries = entries
+        self.paths = paths
+        self.size = bundle_size(entries)
+        self.on_done = on_done
+        self.eof = eof
+        self.pos = 0
+        self.index = 0            # entry holding pos
+        self.view = None          # contents of entries[index]
+        self.finished = False
+
+    def _read(self, end):
+        """Views of the bundle bytes [pos, end)"""
+        parts = []
+        while self.pos < end:
+            name, size, offset, _ = self.entries[self.index]
+            if self.pos >= offset + size:
+                self.index += 1
+                self.view = None
+                continue
+            if self.view is None:
+                try:
+                    self.view = _load(self.paths[self.index], size)
+                except OSError:
+                    self.view = memoryview(b"")
+            stop = min(end, offset + size)
+            lo, hi = self.pos - offset, stop - offset
+            piece = self.view[lo:hi]
+            parts.append(piece)
+            if len(piece) < hi - lo:
+                parts.append(bytes(hi - lo - len(piece)))
+            self.pos = stop
+        return parts
+
+    def pull(self, budget):
+        if self.finished:
+            return None
+        bufs = []
+        while budget > 0 and self.pos < self.size:
+            start = self.pos
+            end = min(self.size, start + P.DATA_FRAME_SIZE)
+            bufs.append(P.DATA_HEADER.pack(P.OFFSET.size + end - start, P.DATA, self.req_id, start))
+            bufs.extend(self._read(end))
+            budget -= P.DATA_HEADER.size + end - start
+        if self.pos >= self.size and budget > 0:
+            if self.eof:
+                bufs.append(P.encode_frame(P.EOF, self.req_id, P.OFFSET.pack(self.size)))
+            self.finished = True
+            self.view = None
+            if self.on_done:
+                self.on_done()
+        return bufs
+
+
+class BundleUnpacker:
+    """Writes the files of a bundle as its bytes arrive, in order.
+
+    target(name) gives the path for a file or raises OSError/ValueError to
+    skip it. Files up to SMALL_FILE are collected in memory and committed
+    in groups by write_files(), so their fsyncs are batched; larger ones
+    stream through a ChunkWriter. Either way a file is checked against its
+    CRC and committed in the background while later files keep arriving;
+    on_stored(path) then runs on the executor as well. feed() returns
+    False when the disk falls behind (more than limit bytes of small files
+    or MAX_COMMITS large ones waiting), and on_drain is called once it
+    caught up. finish() waits for the commits and returns
+    {name: "ok" or the reason it failed}.
+    """
+    def __init__(self, entries, target, on_stored=None, limit=WRITE_BEHIND_LIMIT):
+        self.entries = entries
+        self.target = target
+        self.on_stored = on_stored
+        self.limit = limit
+        self.size = bundle_size(entries)
+        self.loop = asyncio.get_event_loop()
+        self.results = {}
+        self.pos = 0
+        self.index = 0
+        self.path = None          # of the current file, None when it is skipped
+        self.buffer = None        # contents of a small current file
+        self.writer = None        # or the ChunkWriter of a large one
+        self.crc = 0
+        self.blocked = set()      # writers over their write-behind limit
+        self.commits = set()
+        self.group = []           # small files waiting to be written: (name, path, data)
+        self.group_bytes = 0
+        self.pending_bytes = 0    # bytes of small files being written
+        self.on_drain = None
+        self._paused = False
+        self._open()
+
+    def _open(self):
+        """Start the entry at index, completing empty files on the way"""
+        while self.index < len(self.entries):
+            name, size, _, _ = self.entries[self.index]
+            self.crc = 0
+            try:
+                self.path = self.target(name)
+                if size > SMALL_FILE:
+                    self.writer = ChunkWriter(self.path, self.limit)
+                    self.writer.on_drain = lambda w=self.writer: self._unblock(w)
+                else:
+                    self.buffer = bytearray()
+            except (OSError, ValueError) as e:
+                self.path = None
+                self.results[name] = getattr(e, "strerror", None) or str(e)
+            if size:
+                return
+            self._close()
+
+    def _close(self):
+        name, size, _, crc = self.entries[self.index]
+        self.index += 1
+        path, writer, buffer = self.path, self.writer, self.buffer
+        self.path = self.writer = self.buffer = None
+        if path is None:
+            return
+        if writer is not None:
+            self.blocked.discard(writer)
+        if self.crc != crc:
+            self.results[name] = "checksum mismatch"
+            if writer is not None:
+                self._track(writer.abort())
+        elif writer is not None:
+            self._track(self._commit(name, writer, size))
+        else:
+            self.group.append((name, path, buffer))
+            self.group_bytes += len(buffer)
+            if len(self.group) >= GROUP_FILES or self.group_bytes >= GROUP_BYTES:
+                self._flush_group()
+
+    def _flush_group(self):
+        group, nbytes = self.group, self.group_bytes
+        self.group, self.group_bytes = [], 0
+        self.pending_bytes += nbytes
+        self._track(self._store(group, nbytes))
+
+    def _skip(self, name, error):
+        """The current file failed halfway: drop it and ignore the rest of its bytes"""
+        self.results[name] = error
+        if self.writer is not None:
+            self.blocked.discard(self.writer)
+            self._track(self.writer.abort())
+        self.path = self.writer = self.buffer = None
+
+    def _track(self, coro):
+        task = self.loop.create_task(coro)
+        self.commits.add(task)
+        task.add_done_callback(self._committed)
+
+    def _stored(self, path):
+        if self.on_stored:
+            self.on_stored(path)
+
+    async def _commit(self, name, writer, size):
+        try:
+            await writer.commit(size)
+            await self.loop.run_in_executor(io_pool(), self._stored, writer.fpath)
+            self.results[name] = "ok"
+        except OSError as e:
+            self.results[name] = e.strerror or str(e)
+
+    async def _store(self, group, nbytes):
+        def store():
+            errors = write_files([(path, data) for _, path, data in group])
+            for _, path, _ in group:
+                if path not in errors:
+                    try:
+                        self._stored(path)
+                    except OSError as e:
+                        errors[path] = e
+            return errors
+        try:
+            errors = await self.loop.run_in_executor(io_pool(), store)
+        except OSError as e:
+            errors = {path: e for _, path, _ in group}
+        finally:
+            self.pending_bytes -= nbytes
+        for name, path, _ in group:
+            e = errors.get(path)
+            self.results[name] = "ok" if e is None else e.strerror or str(e)
+
+    def _committed(self, task):
+        self.commits.discard(task)
+        self._maybe_drain()
+
+    def _unblock(self, writer):
+        self.blocked.discard(writer)
+        self._maybe_drain()
+
+    def _maybe_drain(self):
+        if self._paused and not self.blocked and len(self.commits) <= MAX_COMMITS // 2 \
+           and self.pending_bytes <= self.limit // 2:
+            self._paused = False
+            if self.on_drain:
+                self.on_drain()
+
+    def feed(self, offset, data):
+        if offset != self.pos:
+            raise ValueError("bundle data out of order")
+        if offset + len(data) > self.size:
+            raise ValueError("bundle data beyond its index")
+        view = memoryview(data)
+        while view:
+            name, size, start, _ = self.entries[self.index]
+            piece = view[:start + size - self.pos]
+            if self.path is not None:
+                self.crc = zlib.crc32(piece, self.crc)
+                if self.buffer is not None:
+                    self.buffer += piece
+                else:
+                    try:
+                        if not self.writer.write(self.pos - start, piece):
+                            self.blocked.add(self.writer)
+                    except OSError as e:        # an earlier write of this file failed
+                        self._skip(name, e.strerror or str(e))
+            self.pos += len(piece)
+            view = view[len(piece):]
+            if self.pos == start + size:
+                self._close()
+                self._open()
+        if self.blocked or len(self.commits) > MAX_COMMITS or self.pending_bytes > self.limit:
+            self._paused = True
+        return not self._paused
+
+    async def finish(self):
+        """Wait for every file; files the bundle stopped short of are reported incomplete"""
+        while self.index < len(self.entries):
+            name = self.entries[self.index][0]
+            if self.path is not None:
+                self._skip(name, "incomplete")
+            self.results.setdefault(name, "incomplete")
+            self.index += 1
+        if self.group:
+            self._flush_group()
+        while self.commits:
+            await asyncio.wait(list(self.commits))
+        return {name: self.results.get(name, "incomplete") for name, _, _, _ in self.entries}
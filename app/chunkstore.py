@@ -0,0 +1,300 @@
+import os, hashlib, threading, time, itertools, contextlib
+from collections import OrderedDict
+try:
+    import fcntl
+except ImportError:     # Windows: no pre-fork workers, so one process owns the store
+    fcntl = None
+from app.fileops import CHUNK_SIZE, pwrite_all, clone_range
+
+INDEX_SIZE = 1 << 16    # recently seen chunk hashes kept in memory
+GC_GRACE = 3600.0       # unreferenced chunks younger than this survive GC (interrupted uploads)
+HASH_SIZE = 32          # sha256
+
+def chunk_hash(data):
+    return hashlib.sha256(data).digest()
+
+def hash_file(fpath, chunk_size=CHUNK_SIZE):
+    """sha256 digest of every chunk of the file"""
+    hashes = []
+    with open(fpath, "rb") as f:
+        for data in iter(lambda: f.read(chunk_size), b""):
+            hashes.append(chunk_hash(data))
+    return hashes
+
+class ChunkStore:
+    """Content-addressed chunk files under root, reference-counted per file.
+
+    Chunks live at root/objects/<2 hex>/<64 hex>. Each stored file has a
+    recipe (its chunk hashes in order) under root/recipes; reference counts
+    are rebuilt from the recipes at startup, so the recipes are the only
+    bookkeeping on disk. Uploads in progress pin the chunks they rely on
+    with a file under root/pins that their process keeps flock()ed, so GC
+    in any server process sees every pin and can tell a crashed owner's
+    leftovers from a live pin. An LRU index of recently seen hashes answers most
+    "do we have it" lookups without touching the filesystem. Methods are
+    safe to call from the I/O executor.
+
+    Files assembled from the store reflink its chunks where the filesystem
+    supports it (btrfs, XFS), so a file and its chunks share blocks. On
+    others (ext4, tmpfs) chunks are copied: every deduplicated file then
+    costs its size again under objects/ (shared between files with the
+    same chunks) for as long as its recipe exists.
+    """
+    def __init__(self, root, index_size=INDEX_SIZE):
+        self.root = root
+        self.objects = os.path.join(root, "objects")
+        self.recipes = os.path.join(root, "recipes")
+        self.pins = os.path.join(root, "pins")
+        for d in (self.objects, self.recipes, self.pins):
+            os.makedirs(d, exist_ok=True)
+        self.lock_path = os.path.join(root, "lock")
+        self._pin_ids = itertools.count()
+        self.index_size = index_size
+        self.index = OrderedDict()   # hash -> None, most recently used last
+        self.refs = {}               # hash -> number of recipes referencing it
+        self.lock = threading.Lock()
+        self.refs = self._count_refs()
+
+    def _count_refs(self):
+        refs = {}
+        for name in os.listdir(self.recipes):
+            if name.endswith(".tmp"):
+                continue
+            for h in self._read_recipe(name):
+                refs[h] = refs.get(h, 0) + 1
+        return refs
+
+    def _path(self, h):
+        hx = h.hex()
+        return os.path.join(self.objects, hx[:2], hx)
+
+    def _remember(self, h):
+        index = self.index
+        index[h] = None
+        index.move_to_end(h)
+        if len(index) > self.index_size:
+            index.popitem(last=False)
+
+    # -----------------
+    def has(self, h):
+        with self.lock:
+            if h in self.index:
+                self.index.move_to_end(h)
+                return True
+        if os.path.exists(self._path(h)):
+            with self.lock:
+                self._remember(h)
+            return True
+        return False
+
+    def missing(self, hashes):
+        """Indices of hashes the store lacks (duplicates within hashes count once)"""
+        seen, out = set(), []
+        for i, h in enumerate(hashes):
+            if h not in seen and not self.has(h):
+                out.append(i)
+            seen.add(h)
+        return out
+
+    def put(self, h, data):
+        """Store data under h; it must already have been checked against h"""
+        path = self._path(h)
+        with self.lock:
+            try:
+                os.utime(path)    # already stored: fresh again for the GC grace period
+                self._remember(h)
+                return
+            except FileNotFoundError:
+                pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self.lock:
+            self._remember(h)
+
+    def get(self, h):
+        with open(self._path(h), "rb") as f:
+            return f.read()
+
+    def put_into(self, h, data, fd, offsets):
+        """put(), then place the chunk at offsets in fd like fill()"""
+        self.put(h, data)
+        self._place(h, fd, offsets, data)
+
+    def fill(self, fd, hashes, skip=(), chunk_size=CHUNK_SIZE):
+        """Place the stored chunks of a file at their offsets in fd, except hashes in skip.
+
+        Returns the indices of chunks that are gone after all: the index
+        can still list a chunk another process's GC has since deleted."""
+        gone = []
+        for i, h in enumerate(hashes):
+            if h in skip:
+                continue
+            try:
+                self._place(h, fd, (i * chunk_size,))
+            except FileNotFoundError:
+                with self.lock:
+                    self.index.pop(h, None)
+                gone.append(i)
+        return gone
+
+    def _place(self, h, fd, offsets, data=None):
+        """Reflink chunk h into fd at offsets, copying where that fails"""
+        with open(self._path(h), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            for offset in offsets:
+                if not clone_range(f.fileno(), fd, offset, size):
+                    if data is None:
+                        data = f.read()
+                    pwrite_all(fd, data, offset)
+
+    # -----------------
+    # Recipes and reference counts
+    def _read_recipe(self, name):
+        try:
+            with open(os.path.join(self.recipes, name), "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return []
+        return [raw[i:i + HASH_SIZE] for i in range(0, len(raw), HASH_SIZE)]
+
+    def link(self, name, hashes):
+        """Record that file name now consists of hashes, replacing its old recipe"""
+        old = self._read_recipe(name)
+        path = os.path.join(self.recipes, name)
+        with open(path + ".tmp", "wb") as f:
+            f.write(b"".join(hashes))
+        os.replace(path + ".tmp", path)
+        with self.lock:
+            for h in hashes:
+                self.refs[h] = self.refs.get(h, 0) + 1
+            self._release(old)
+
+    def unlink(self, name):
+        """Forget file name's recipe, e.g. after it was overwritten without dedup"""
+        old = self._read_recipe(name)
+        if not old:
+            return
+        os.remove(os.path.join(self.recipes, name))
+        with self.lock:
+            self._release(old)
+
+    def _release(self, hashes):
+        for h in hashes:
+            n = self.refs.get(h, 0) - 1
+            if n > 0:
+                self.refs[h] = n
+            else:
+                self.refs.pop(h, None)
+
+    # -----------------
+    # Pins, shared by every process using the store. Writing a pin holds
+    # the store lock shared, GC holds it exclusively while it reads the
+    # pins and deletes, so a chunk pinned before its upload checks the
+    # store is never deleted under it.
+    @contextlib.contextmanager
+    def _store_lock(self, exclusive):
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+        finally:
+            os.close(fd)        # releases the lock
+
+    def pin(self, hashes):
+        """Keep hashes out of GC while an upload that counts on them runs;
+        returns the handle to pass to unpin()"""
+        path = os.path.join(self.pins, f"{os.getpid()}-{next(self._pin_ids)}")
+        with self._store_lock(False):
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX)     # held for as long as the pin
+                pwrite_all(fd, b"".join(hashes), 0)
+            except BaseException:
+                os.close(fd)
+                os.remove(path)
+                raise
+        return path, fd
+
+    def unpin(self, pin):
+        path, fd = pin
+        try:
+            os.remove(path)
+        finally:
+            os.close(fd)
+
+    def _pinned(self):
+        """Hashes of every live pin; drops pins whose process is gone.
+        Call with the store lock held exclusively."""
+        pinned = set()
+        for name in os.listdir(self.pins):
+            path = os.path.join(self.pins, name)
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                if fcntl:
+                    try:
+                        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                        os.remove(path)    # nobody holds it: its owner exited
+                        continue
+                    except BlockingIOError:
+                        pass
+                with os.fdopen(os.dup(fd), "rb") as f:
+                    raw = f.read()
+            finally:
+                os.close(fd)
+            pinned.update(raw[i:i + HASH_SIZE] for i in range(0, len(raw), HASH_SIZE))
+        return pinned
+
+    def gc(self, grace=GC_GRACE):
+        """Delete unreferenced chunks older than grace seconds; returns (chunks, bytes) freed.
+
+        Reference counts are recounted from the recipes first, since other
+        server processes may have linked files since this one started. The
+        store is only locked for the final pass over the candidates; a file
+        linked after the recount was pinned through its upload.
+        """
+        refs = self._count_refs()
+        with self.lock:
+            self.refs = refs
+        cutoff = time.time() - grace
+        candidates = []
+        for sub in os.listdir(self.objects):
+            subdir = os.path.join(self.objects, sub)
+            for hx in os.listdir(subdir):
+                try:
+                    h = bytes.fromhex(hx)
+                except ValueError:
+                    continue        # leftover .tmp
+                if h not in refs:
+                    candidates.append((h, os.path.join(subdir, hx)))
+        freed = freed_bytes = 0
+        with self._store_lock(True):
+            pinned = self._pinned()
+            for h, path in candidates:
+                with self.lock:
+                    if h in self.refs or h in pinned:
+                        continue
+                    try:
+                        st = os.stat(path)
+                        if st.st_mtime > cutoff:
+                            continue
+                        os.remove(path)
+                    except FileNotFoundError:
+                        continue
+                    self.index.pop(h, None)
+                freed += 1
+                freed_bytes += st.st_size
+        return freed, freed_bytes
+
+    def stats(self):
+        with self.lock:
+            return {"referenced_chunks": len(self.refs), "index_entries": len(self.index)}
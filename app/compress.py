@@ -0,0 +1,129 @@
+import os, time, zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from app import protocol as P
+
+LEVEL = 3               # zlib level for DATA chunks
+PROBE_SIZE = 1024       # bytes compressed at level 1 to judge a chunk
+PROBE_RATIO = 0.9       # skip chunks whose probe shrinks less than this
+KEEP_RATIO = 0.95       # send compressed only when it saves at least 5%
+MIN_SIZE = 256
+LOOKAHEAD = 8           # chunks compressed ahead of the send window, per producer
+
+_cpu_pool = None
+
+def cpu_pool():
+    """Executor for compression; zlib releases the GIL, so this runs in parallel"""
+    global _cpu_pool
+    if _cpu_pool is None:
+        _cpu_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 2, thread_name_prefix="zlib")
+    return _cpu_pool
+
+def worth_compressing(chunk):
+    """Fast sample probe: already compressed or random data barely shrinks"""
+    if len(chunk) < MIN_SIZE:
+        return False
+    sample = chunk[:PROBE_SIZE]
+    return len(zlib.compress(sample, 1)) < len(sample) * PROBE_RATIO
+
+def _compress(chunk, level):
+    start = time.thread_time()
+    data = zlib.compress(chunk, level)
+    return data, time.thread_time() - start
+
+
+class CompressionStats:
+    def __init__(self):
+        self.raw_bytes = 0        # payload bytes before compression
+        self.wire_bytes = 0       # payload bytes actually sent
+        self.compressed = 0       # chunks sent as ZDATA
+        self.skipped = 0          # chunks the probe or the result ruled out
+        self.cpu_time = 0.0       # seconds spent in zlib, summed over threads
+
+    def record(self, raw, wire, cpu=0.0):
+        self.raw_bytes += raw
+        self.wire_bytes += wire
+        self.cpu_time += cpu
+        if wire < raw:
+            self.compressed += 1
+        else:
+            self.skipped += 1
+
+    @property
+    def ratio(self):
+        return self.raw_bytes / self.wire_bytes if self.wire_bytes else 1.0
+
+    def report(self):
+        return {"raw_bytes": self.raw_bytes, "wire_bytes": self.wire_bytes,
+                "ratio": round(self.ratio, 3), "chunks_compressed": self.compressed,
+                "chunks_skipped": self.skipped, "cpu_ms": round(self.cpu_time * 1000, 1)}
+
+
+class CompressingProducer(P.FileProducer):
+    """FileProducer that sends chunks which compress well as ZDATA.
+
+    Up to LOOKAHEAD chunks are compressed on the CPU pool ahead of the
+    window, so compression overlaps with transmission; when the window
+    opens before the next chunk is ready, pull() returns nothing and the
+    finished compression wakes the session up again.
+    """
+    def __init__(self, session, req_id, view, ranges=None, on_done=None, eof=True,
+                 stats=None, level=LEVEL):
+        super().__init__(req_id, view, ranges, on_done, eof)
+        self.session = session
+        self.stats = stats if stats is not None else CompressionStats()
+        self.level = level
+        self.ahead = deque()      # (pos, end, future or None), in send order
+
+    def _fill(self):
+        loop = None
+        while len(self.ahead) < LOOKAHEAD:
+            piece = self.queue.take(P.DATA_FRAME_SIZE)
+            if piece is None:
+                break
+            pos, end = piece
+            chunk = self.view[pos:end]
+            fut = None
+            if worth_compressing(chunk):
+                loop = loop or self.session.endpoint.loop
+                fut = loop.run_in_executor(cpu_pool(), _compress, chunk, self.level)
+                fut.add_done_callback(self._ready)
+            self.ahead.append((pos, end, fut))
+
+    def _ready(self, fut):
+        if not self.finished and self.ahead and self.ahead[0][2] is fut:
+            self.session.try_send()
+
+    def pull(self, budget):
+        if self.finished:
+            return None
+        self._fill()
+        bufs = []
+        ahead = self.ahead
+        while budget > 0 and ahead:
+            pos, end, fut = ahead[0]
+            if fut is not None and not fut.done():
+                break
+            ahead.popleft()
+            raw = self.view[pos:end]
+            data, cpu = fut.result() if fut is not None and not fut.exception() else (None, 0.0)
+            if data is not None and len(data) < len(raw) * KEEP_RATIO:
+                bufs.append(P.FRAME_HEADER.pack(P.ZDATA_HEADER.size + len(data), P.ZDATA, self.req_id))
+                bufs.append(P.ZDATA_HEADER.pack(pos, len(raw)))
+                bufs.append(data)
+                budget -= P.FRAME_HEADER_SIZE + P.ZDATA_HEADER.size + len(data)
+                self.stats.record(len(raw), len(data), cpu)
+            else:
+                bufs.append(P.DATA_HEADER.pack(P.OFFSET.size + len(raw), P.DATA, self.req_id, pos))
+                bufs.append(raw)
+                budget -= P.DATA_HEADER.size + len(raw)
+                self.stats.record(len(raw), len(raw), cpu)
+            self._fill()
+        if not ahead and not self.queue and budget > 0:
+            if self.eof:
+                bufs.append(P.encode_frame(P.EOF, self.req_id, P.OFFSET.pack(self.size)))
+            self.finished = True
+            self.view = None
+            if self.on_done:
+                self.on_done()
+        return bufs
@@ -1,12 +1,30 @@
-import zlib, os
+import zlib, os, sys, asyncio, tempfile, threading, mmap, struct, shutil, errno
+try:
+    import fcntl
+except ImportError:     # Windows
+    fcntl = None
+from concurrent.futures import ThreadPoolExecutor
 
 CHUNK_SIZE = 16*1024
+WRITE_BEHIND_LIMIT = 4 << 20   # bytes queued for disk per upload before it is paused
+IO_THREADS = 4
 
-def iter_chunks(fpath):
+_io_pool = None
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def io_pool():
+    """Shared executor for blocking file I/O"""
+    global _io_pool
+    if _io_pool is None:
+        _io_pool = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="fileio")
+    return _io_pool
+
+def iter_chunks(fpath, chunk_size=CHUNK_SIZE):
     """Yield (data, crc) for each chunk of the file"""
     with open(fpath, "rb") as f:
         while True:
-            data = f.read(CHUNK_SIZE)
+            data = f.read(chunk_size)
             if not data:
                 break
             yield data, zlib.crc32(data) & 0xffffffff
@@ -17,3 +35,264 @@ def save_chunks(fpath, chunks):
     with open(fpath, "wb") as f:
         for data, _ in chunks:
             f.write(data)
+
+# -----------------
+# Chunk manifests: one CRC32 per chunk, cached under a meta directory and
+# invalidated when the file's size or mtime changes
+MANIFEST_HEADER = struct.Struct("!QQII")   # size, mtime_ns, chunk size, chunk count
+
+def compute_manifest(fpath, chunk_size=CHUNK_SIZE):
+    if not os.path.exists(fpath):
+        return []
+    return [crc for _, crc in iter_chunks(fpath, chunk_size)]
+
+def _manifest_path(fpath, meta_dir):
+    return os.path.join(meta_dir, os.path.basename(fpath) + ".crc")
+
+def store_manifest(fpath, meta_dir, crcs, chunk_size=CHUNK_SIZE):
+    st = os.stat(fpath)
+    os.makedirs(meta_dir, exist_ok=True)
+    path = _manifest_path(fpath, meta_dir)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MANIFEST_HEADER.pack(st.st_size, st.st_mtime_ns, chunk_size, len(crcs)))
+        f.write(struct.pack(f"!{len(crcs)}I", *crcs))
+    os.replace(tmp, path)
+
+def load_manifest(fpath, meta_dir, chunk_size=CHUNK_SIZE):
+    """CRCs of fpath, from the cache when it is still valid, else recomputed and cached"""
+    st = os.stat(fpath)
+    try:
+        with open(_manifest_path(fpath, meta_dir), "rb") as f:
+            raw = f.read()
+        size, mtime_ns, cached_chunk, n = MANIFEST_HEADER.unpack_from(raw)
+        if (size, mtime_ns, cached_chunk) == (st.st_size, st.st_mtime_ns, chunk_size):
+            return list(struct.unpack_from(f"!{n}I", raw, MANIFEST_HEADER.size))
+    except (OSError, struct.error):
+        pass
+    crcs = compute_manifest(fpath, chunk_size)
+    store_manifest(fpath, meta_dir, crcs, chunk_size)
+    return crcs
+
+def missing_chunks(want, have):
+    """Indices of chunks in want that have lacks or holds with a different CRC"""
+    return [i for i, crc in enumerate(want) if i >= len(have) or have[i] != crc]
+
+def chunk_ranges(indices, chunk_size, size):
+    """Merge sorted chunk indices into [start, end) byte ranges within size"""
+    ranges = []
+    for i in indices:
+        start, end = i * chunk_size, min((i + 1) * chunk_size, size)
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
+
+def prepare_part(fpath, part_path, meta_dir):
+    """Working copy for a delta upload: an interrupted upload's .part file
+    if there is one, else a copy of the current file. Returns its CRCs."""
+    if os.path.exists(part_path):
+        return compute_manifest(part_path)
+    if os.path.exists(fpath):
+        crcs = load_manifest(fpath, meta_dir)
+        shutil.copyfile(fpath, part_path)
+        return crcs
+    return []
+
+# -----------------
+def map_file(fpath):
+    """Read-only memoryview of the whole file backed by mmap.
+
+    The mapping is released once the last view into it is dropped, so
+    segments still waiting for an ACK keep it alive.
+    """
+    with open(fpath, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return memoryview(b"")
+        return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+# -----------------
+# Streaming writes
+if hasattr(os, "pwrite"):
+    def pwrite_all(fd, data, offset):
+        view = memoryview(data)
+        while view:
+            n = os.pwrite(fd, view, offset)
+            view, offset = view[n:], offset + n
+else:
+    _seek_lock = threading.Lock()
+
+    def pwrite_all(fd, data, offset):
+        with _seek_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+
+# -----------------
+# Reflinks: FICLONERANGE makes a range of one file share another file's
+# blocks instead of copying them (btrfs, XFS, bcachefs). Other
+# filesystems refuse it and the caller copies.
+FICLONERANGE = 0x4020940d
+_CLONE_RANGE = struct.Struct("=qQQQ")   # src_fd, src_offset, src_length, dest_offset
+_reflinks = fcntl is not None and sys.platform.startswith("linux")
+
+def clone_range(src_fd, dst_fd, offset, length):
+    """Make dst_fd's [offset, offset + length) share the first length bytes
+    of src_fd on disk; False when that cannot be done here"""
+    global _reflinks
+    if not _reflinks:
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONERANGE, _CLONE_RANGE.pack(src_fd, 0, length, offset))
+        return True
+    except OSError as e:
+        # EINVAL is per call (a partial block in mid-file); the rest mean never
+        if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.ENOSYS):
+            _reflinks = False
+        return False
+
+def _commit(fd, tmp_path, fpath, size):
+    try:
+        if size is not None:
+            os.ftruncate(fd, size)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.chmod(tmp_path, 0o666 & ~_UMASK)    # mkstemp creates files as 0600
+    os.replace(tmp_path, fpath)
+
+def write_files(files):
+    """Blocking: write each (path, data) to a temporary file next to path,
+    then fsync and rename them all into place. Issuing every write before
+    the first fsync lets the file system commit them together, which for
+    small files is several times cheaper than syncing them one by one.
+    Returns {path: OSError} for the files that failed."""
+    errors, staged = {}, []
+    for path, data in files:
+        dirname, name = os.path.split(path)
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix="." + name + ".", suffix=".part", dir=dirname or ".")
+        except OSError as e:
+            errors[path] = e
+            continue
+        staged.append((path, fd, tmp_path))
+        try:
+            pwrite_all(fd, data, 0)
+        except OSError as e:
+            errors[path] = e
+    for path, fd, tmp_path in staged:
+        if path not in errors:
+            try:
+                _commit(fd, tmp_path, path, None)
+                continue
+            except OSError as e:
+                errors[path] = e
+        else:
+            os.close(fd)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+    return errors
+
+class ChunkWriter:
+    """Offset-addressed writes into a temporary file next to fpath.
+
+    Writes run on the shared I/O executor so disk latency never blocks the
+    event loop. write() returns False once more than `limit` bytes are
+    queued; on_drain is then called when the backlog falls to half of that.
+    commit() waits for every write, fsyncs and atomically renames the file
+    into place, so readers never see a partial upload. With part_path the
+    temporary file is that fixed path and survives abort(), so an
+    interrupted upload can be resumed.
+    """
+    def __init__(self, fpath, limit=WRITE_BEHIND_LIMIT, part_path=None):
+        self.fpath = fpath
+        self.limit = limit
+        self.loop = asyncio.get_event_loop()
+        dirname, name = os.path.split(fpath)
+        os.makedirs(dirname or ".", exist_ok=True)
+        self.persistent = part_path is not None
+        if self.persistent:
+            self.tmp_path = part_path
+            self.fd = os.open(part_path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o666)
+            if fcntl:
+                # Another server process may be assembling the same file
+                try:
+                    fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    os.close(self.fd)
+                    raise OSError(errno.EBUSY, "upload already in progress", part_path)
+        else:
+            self.fd, self.tmp_path = tempfile.mkstemp(prefix="." + name + ".", suffix=".part",
+                                                      dir=dirname or ".")
+        self.pending = 0           # bytes submitted but not yet written
+        self.written = 0
+        self.futures = set()
+        self.error = None
+        self.on_drain = None
+        self._congested = False
+
+    def write(self, offset, data):
+        return self.submit(len(data), pwrite_all, self.fd, data, offset)
+
+    def submit(self, size, fn, *args, written=None):
+        """Run fn(*args) on the I/O executor as part of this upload: it counts
+        size bytes against the write-behind limit and commit() waits for it.
+        written is how many bytes of the file it writes (size for pwrite_all)."""
+        if self.error:
+            raise self.error
+        fut = self.loop.run_in_executor(io_pool(), fn, *args)
+        self.futures.add(fut)
+        self.pending += size
+        if written is None:
+            written = size if fn is pwrite_all else 0
+        fut.add_done_callback(lambda f: self._written(f, size, written))
+        if self.pending > self.limit:
+            self._congested = True
+        return not self._congested
+
+    def _written(self, fut, size, written):
+        self.futures.discard(fut)
+        self.pending -= size
+        if fut.cancelled():
+            return
+        if fut.exception() is not None:
+            self.error = self.error or fut.exception()
+        else:
+            self.written += written
+        if self._congested and self.pending <= self.limit // 2:
+            self._congested = False
+            if self.on_drain:
+                self.on_drain()
+
+    async def _flush(self):
+        while self.futures:
+            await asyncio.wait(list(self.futures))
+        if self.error:
+            raise self.error
+
+    async def commit(self, size=None):
+        """Make the upload visible as fpath, truncated to size if given"""
+        try:
+            await self._flush()
+        except BaseException:
+            await self.abort()
+            raise
+        await self.loop.run_in_executor(io_pool(), _commit, self.fd, self.tmp_path, self.fpath, size)
+        self.fd = None
+
+    async def abort(self):
+        """Stop the upload, keeping a persistent part file; safe to call more than once"""
+        while self.futures:
+            await asyncio.wait(list(self.futures))
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            if not self.persistent:
+                try:
+                    os.remove(self.tmp_path)
+                except FileNotFoundError:
+                    pass
@@ -1,73 +1,495 @@
-import asyncio, zlib, os, time
+import asyncio, contextlib, os, time
 from transport.transport import GBNTransport
 from transport.lossy_shim import LossySocket
+from transport.netem import NetemSocket
+from transport.batchio import create_batched_endpoint
+from app import protocol as P
+from app.fileops import io_pool, compute_manifest, missing_chunks, chunk_ranges, map_file, ChunkWriter, \
+    CHUNK_SIZE
+from app.chunkstore import hash_file
+from app.compress import CompressingProducer, CompressionStats
+from app import bundle as B
 from tools.metrics import Metrics
 
-CHUNK_SIZE = 16*1024
+STRIPE_SIZE = 1 << 20     # bytes per GET request of a striped download
+STRIPE_DEPTH = 2          # GET requests kept outstanding per stream
+MAX_STREAMS = 16
+PROBE_INTERVAL = 0.25     # auto mode: seconds between goodput checks
+PROBE_GAIN = 1.1          # auto mode: keep adding streams while goodput grows this much
+PROGRESS_INTERVAL = 0.1   # seconds between on_progress calls during a transfer
+
+class FTPError(Exception):
+    pass
+
+class _Pending:
+    """An outstanding request: the reply future plus an optional DATA sink.
+    early holds replies that came after READY/BUNDLE but before expect()."""
+    __slots__ = ("future", "on_data", "early")
+
+    def __init__(self, future, on_data=None):
+        self.future = future
+        self.on_data = on_data
+        self.early = None
+
+class _Progress:
+    """Context manager calling cb(name, done, total, bytes_per_s) every
+    PROGRESS_INTERVAL while a transfer runs, polling done(), and once more
+    with the average rate when it ends"""
+    def __init__(self, loop, cb, name, total, done):
+        self.loop = loop
+        self.cb = cb
+        self.name = name
+        self.total = total
+        self.done = done
+        self.start = self.last = loop.time()
+        self.last_done = 0
+        self.rate = 0.0
+        self.handle = loop.call_later(PROGRESS_INTERVAL, self._tick)
+
+    def _tick(self):
+        now, n = self.loop.time(), self.done()
+        rate = (n - self.last_done) / (now - self.last)
+        self.rate = rate if not self.rate else (self.rate + rate) / 2
+        self.last, self.last_done = now, n
+        self.cb(self.name, n, self.total, self.rate)
+        self.handle = self.loop.call_later(PROGRESS_INTERVAL, self._tick)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.handle.cancel()
+        n, elapsed = self.done(), self.loop.time() - self.start
+        self.cb(self.name, n, self.total, n / elapsed if elapsed > 0 else 0.0)
 
 class FTPClient:
-    def __init__(self, server_addr=('127.0.0.1',9000), loss_rate=0.05):
+    """streams is the default number of transport sessions a transfer is
+    striped over, or "auto" to add sessions while goodput keeps rising.
+    compress offers per-chunk zlib compression for GET and PUT (off by
+    default). netem replaces the loss_rate shim with an emulated path: a
+    netem Profile (or dict) for the upstream direction, or {"up": ..., "down": ...};
+    seed makes its random decisions reproducible. window_size caps each
+    session's window (segments). fec adds XOR parity to what the client
+    sends, so the server rebuilds single losses without a retransmission.
+
+    on_progress, when set, is called as on_progress(name, done, total,
+    bytes_per_s) about every PROGRESS_INTERVAL during put_file/get_file
+    and once at the end; it runs on the client's event loop."""
+    def __init__(self, server_addr=('127.0.0.1',9000), loss_rate=0.05, streams=1, compress=False,
+                 netem=None, seed=None, window_size=None, fec=False):
         import socket
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.lossy = LossySocket(sock, loss_rate)
-        self.t = GBNTransport(local_port=0, remote_addr=server_addr, loss_wrapper=self.lossy)
+        if netem is None:
+            self.lossy = LossySocket(sock, loss_rate, seed=seed)
+        elif isinstance(netem, dict) and ("up" in netem or "down" in netem):
+            self.lossy = NetemSocket(sock, netem.get("up"), netem.get("down"), seed)
+        else:
+            self.lossy = NetemSocket(sock, netem, seed=seed)
+        self.t = GBNTransport(local_port=0, remote_addr=server_addr, loss_wrapper=self.lossy,
+                              window_size=window_size, fec=fec)
         self.t.on_receive_cb = self.on_receive
         self.loop = asyncio.get_event_loop()
-        self.recv_data = bytearray()
+        self.server_addr = server_addr
+        self.streams = streams
+        self.compress = compress
+        self.compression = CompressionStats()   # what our PUTs compressed
+        self.sessions = [self.t.default_session]   # stream i is sessions[i]
+        self.decoder = P.FrameDecoder()
+        self.pending = {}          # req_id -> _Pending
+        self._next_req_id = 1
         self.metrics = Metrics()
-        self.put_state = None
-        self.get_state = None
+        self.metrics.attach(self.t)
+        self.on_progress = None
 
     async def start(self):
-        await self.loop.create_datagram_endpoint(lambda: self.t, local_addr=('0.0.0.0',0))
+        transport, _ = await create_batched_endpoint(self.loop, lambda: self.lossy.wrap(self.t),
+                                                     ('0.0.0.0',0))
+        # Send through the endpoint's own socket so replies come back to it
+        self.lossy.sock.close()
+        self.lossy.sock = transport
+
+    def _progress(self, name, total, done):
+        if self.on_progress is None:
+            return contextlib.nullcontext()
+        return _Progress(self.loop, self.on_progress, name, total, done)
+
+    def close(self):
+        for pending in self.pending.values():
+            if not pending.future.done():
+                pending.future.cancel()
+        self.pending.clear()
+        if self.t.transport:
+            self.t.transport.close()
 
-    def send_command(self, cmd: str):
-        self.t.send(cmd.encode())
+    # -----------------
+    # Request/response plumbing
+    def stream(self, i):
+        """The i-th transport session to the server (each has its own
+        conn_id, window and ACK clock), opened on first use"""
+        while len(self.sessions) <= i:
+            session = self.t.open_session(self.t.remote_addr)
+            decoder = P.FrameDecoder()
+            session.on_receive_cb = lambda data, decoder=decoder: self._feed(decoder, data)
+            self.sessions.append(session)
+        return self.sessions[i]
+
+    def request(self, mtype, body=b"", on_data=None, session=None):
+        """Send a request; returns (req_id, future resolving to the first reply).
+        Request ids are unique across streams, so replies may come back on any."""
+        req_id = self._next_req_id
+        self._next_req_id = req_id % 0xffffffff + 1
+        self.pending[req_id] = _Pending(self.loop.create_future(), on_data)
+        P.send_frame(session or self.t, mtype, req_id, body)
+        return req_id, self.pending[req_id].future
+
+    def expect(self, req_id):
+        """Arm a fresh future for the next reply to an ongoing request"""
+        pending = self.pending[req_id]
+        pending.future = self.loop.create_future()
+        early, pending.early = pending.early, None
+        if early:
+            self._resolve(req_id, pending, *early[0])
+        return pending.future
 
     def on_receive(self, data):
-        self.recv_data.extend(data)
-        print("[Client] Received:", data.decode())
-
-    async def put_file(self, local_path, remote_name, resume=False):
-        offset = 0
-        if resume and os.path.exists(local_path + ".resume"):
-            offset = int(open(local_path + ".resume").read())
-        self.send_command(f"PUT {remote_name}\n")
-        await asyncio.sleep(0.5)
-        with open(local_path, "rb") as f:
-            f.seek(offset)
-            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
-                self.send_command(b"DATA " + chunk)
-                self.metrics.record_bytes(len(chunk))
-                offset += len(chunk)
-                if resume:
-                    with open(local_path + ".resume", "w") as rf:
-                        rf.write(str(offset))
-        self.send_command("END")
-        if os.path.exists(local_path + ".resume"):
-            os.remove(local_path + ".resume")
-        print("[Client] PUT complete")
-
-    async def get_file(self, remote_name, local_path, resume=False):
-        offset = 0
-        if resume and os.path.exists(local_path):
-            offset = os.path.getsize(local_path)
+        self._feed(self.decoder, data)
+
+    def _feed(self, decoder, data):
+        try:
+            frames = decoder.feed(data)
+        except P.ProtocolError as e:
+            decoder.reset()     # what it buffered is out of sync with the frames
+            for pending in self.pending.values():
+                if not pending.future.done():
+                    pending.future.set_exception(FTPError(str(e)))
+            self.pending.clear()
+            return
+        for mtype, req_id, body in frames:
+            pending = self.pending.get(req_id)
+            if pending is None:
+                print(f"[Client] Reply for unknown request {req_id}")
+                continue
+            if mtype == P.DATA or mtype == P.ZDATA:
+                if pending.on_data:
+                    try:
+                        pending.on_data(*P.decode_data(mtype, body))
+                    except P.ProtocolError as e:
+                        pending.on_data = None
+                        self._reply(req_id, pending, P.ERROR, str(e).encode())
+                continue
+            self._reply(req_id, pending, mtype, body)
+
+    def _reply(self, req_id, pending, mtype, body):
+        if pending.early is not None:
+            pending.early.append((mtype, body))
+        else:
+            self._resolve(req_id, pending, mtype, body)
+
+    def _resolve(self, req_id, pending, mtype, body):
+        if mtype == P.READY or mtype == P.BUNDLE:     # followed by more replies
+            pending.early = []
+        else:
+            del self.pending[req_id]
+        if pending.future.done():
+            return
+        if mtype == P.ERROR:
+            pending.future.set_exception(FTPError(body.decode(errors="replace")))
+        else:
+            pending.future.set_result((mtype, body))
+
+    # -----------------
+    async def list_files(self):
+        _, fut = self.request(P.LIST)
+        _, body = await fut
+        return [name for name in body.decode().split("\n") if name]
+
+    async def manifest(self, remote_name):
+        """(size, chunk_size, [crc32 per chunk]) of a file on the server"""
+        _, fut = self.request(P.MANIFEST, remote_name.encode())
+        _, body = await fut
+        return P.decode_manifest(body)
+
+    async def _local_manifest(self, path, chunk_size):
+        return await self.loop.run_in_executor(io_pool(), compute_manifest, path, chunk_size)
+
+    async def _run_streams(self, streams, worker, progress):
+        """Run worker(session) on `streams` sessions. In "auto" mode start
+        with one and add another every PROBE_INTERVAL for as long as the
+        goodput measured by progress() keeps rising."""
+        if streams != "auto":
+            await asyncio.gather(*(worker(self.stream(i)) for i in range(streams)))
+            return
+        tasks = [asyncio.ensure_future(worker(self.stream(0)))]
+        best, last, growing = 0.0, progress(), True
+        try:
+            while True:
+                done, _ = await asyncio.wait(tasks, timeout=PROBE_INTERVAL,
+                                             return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    task.result()          # re-raise a failed stream
+                if len(done) == len(tasks):
+                    break
+                now = progress()
+                rate, last = (now - last) / PROBE_INTERVAL, now
+                if growing and not done and rate > best * PROBE_GAIN and len(tasks) < MAX_STREAMS:
+                    best = rate
+                    tasks.append(asyncio.ensure_future(worker(self.stream(len(tasks)))))
+                else:
+                    growing = False
+        finally:
+            for task in tasks:
+                task.cancel()
+        print(f"[Client] Auto striping settled on {len(tasks)} streams")
+
+    async def put_file(self, local_path, remote_name, resume=False, dedup=False, streams=None):
+        """Upload a file.
+
+        With dedup (opt-in: the whole file is hashed before anything is
+        sent) the chunk hashes go first and only chunks the server's
+        store lacks are sent, which also resumes interrupted uploads.
+        Without it, resume makes the server offer what it already holds (an
+        interrupted upload or an older version) and only chunks whose CRC
+        differs are sent. The chunks are pulled by one producer per stream
+        from a shared queue, so a stream whose window collapses simply
+        takes less of the file.
+        """
+        streams = streams or self.streams
+        size = os.path.getsize(local_path)
+        start_time = time.time()
+        offer = P.COMPRESS if self.compress else 0
+        if dedup:
+            hashes = await self.loop.run_in_executor(io_pool(), hash_file, local_path)
+            body = P.encode_name(remote_name, P.DEDUP | offer, P.encode_hashes(hashes))
+        else:
+            body = P.encode_name(remote_name, (P.DELTA if resume else 0) | offer)
+        req_id, ready = self.request(P.PUT, body)
+        _, body = await ready
+        done = self.expect(req_id)
+        accepted, = P.READY_INFO.unpack_from(body)
+        body = body[P.READY_INFO.size:]
+        if dedup:
+            chunk_size, chunks = CHUNK_SIZE, P.decode_indices(body)
+        elif resume:
+            _, chunk_size, remote_crcs = P.decode_manifest(body)
+            local_crcs = await self._local_manifest(local_path, chunk_size)
+            chunks = missing_chunks(local_crcs, remote_crcs)
+        else:
+            chunk_size = CHUNK_SIZE
+            chunks = range(-(-size // chunk_size))
+
+        queue = P.RangeQueue(chunk_ranges(chunks, chunk_size, size))
+        sent = len(queue)
+        view = map_file(local_path)
+        producers = []
+        try:
+            async def worker(session):
+                finished = self.loop.create_future()
+                on_done = lambda: finished.done() or finished.set_result(None)
+                if accepted & P.COMPRESS:
+                    producer = CompressingProducer(session, req_id, view, queue, on_done, eof=False,
+                                                   stats=self.compression)
+                else:
+                    producer = P.FileProducer(req_id, view, queue, on_done, eof=False)
+                producers.append(producer)
+                session.add_producer(producer)
+                await finished
+
+            with self._progress(remote_name, sent, lambda: sent - len(queue)):
+                await self._run_streams(streams, worker, lambda: sent - len(queue))
+                # END may overtake DATA on other streams; the server waits for `sent` bytes
+                P.send_frame(self.t, P.END, req_id, P.END_INFO.pack(size, sent))
+                await done
+        finally:
+            for producer in producers:      # still registered if the upload failed
+                producer.cancel()
+            # Segments still waiting for an ACK keep their own views of the mapping
+            view.release()
+        self.metrics.record_bytes(sent)
+        self.metrics.record_delay((time.time()-start_time)*1000)
+        print(f"[Client] PUT complete, {sent} of {size} bytes sent")
+        if accepted & P.COMPRESS:
+            print(f"[Client] Compression so far: {self.compression.report()}")
+
+    async def get_file(self, remote_name, local_path, resume=False, streams=None):
+        """Download a file. With resume an existing local copy is compared
+        chunk by chunk against the server's manifest and only the chunks
+        that are missing or differ are fetched. With more than one stream
+        the wanted ranges are cut into STRIPE_SIZE requests that the
+        streams take from a shared queue."""
+        streams = streams or self.streams
         start_time = time.time()
-        self.send_command(f"GET {remote_name}\n")
-        await asyncio.sleep(2)
-        mode = "r+b" if os.path.exists(local_path) else "wb"
-        with open(local_path, mode) as f:
-            f.seek(offset)
-            f.write(self.recv_data)
+        ranges = total = None
+        if (resume and os.path.exists(local_path)) or streams != 1:
+            size, chunk_size, remote_crcs = await self.manifest(remote_name)
+            if resume and os.path.exists(local_path):
+                local_crcs = await self._local_manifest(local_path, chunk_size)
+                ranges = chunk_ranges(missing_chunks(remote_crcs, local_crcs), chunk_size, size)
+            else:
+                ranges = [(0, size)]
+            total = sum(end - start for start, end in ranges)
+        elif self.on_progress:
+            total = (await self.manifest(remote_name))[0]   # progress needs the size up front
+        received = 0
+        last = time.monotonic()
+        keep = resume and os.path.exists(local_path)
+        # Chunks are written by the I/O executor, straight into local_path
+        # (kept if the transfer fails, for a later resume); a stream whose
+        # writes fall behind stops reading until they drain
+        writer = ChunkWriter(local_path, part_path=local_path)
+        paused = set()
+        def resume_streams():
+            while paused:
+                paused.pop().resume_reading()
+        writer.on_drain = resume_streams
+        try:
+            if not keep:
+                os.ftruncate(writer.fd, 0)
+            with self._progress(remote_name, total, lambda: received):
+                def receiver(session):
+                    def on_data(pos, chunk):
+                        nonlocal received, last
+                        try:
+                            ok = writer.write(pos, chunk)
+                        except OSError as e:
+                            raise P.ProtocolError(f"writing {local_path}: {e}")
+                        if not ok:
+                            paused.add(session)
+                            session.pause_reading()
+                        received += len(chunk)
+                        now = time.monotonic()
+                        self.metrics.record_bytes(len(chunk))
+                        self.metrics.record_chunk_delay((now - last) * 1000)
+                        last = now
+                    return on_data
+
+                async def fetch(session, ranges):
+                    flags = (P.RANGES if ranges is not None else 0) | (P.COMPRESS if self.compress else 0)
+                    body = P.encode_name(remote_name, flags, P.encode_ranges(ranges or ()))
+                    _, eof = self.request(P.GET, body, receiver(session), session)
+                    _, reply = await eof
+                    return P.OFFSET.unpack_from(reply)[0]
+
+                if streams == 1:
+                    size = await fetch(self.stream(0), ranges)
+                else:
+                    queue = P.RangeQueue(ranges)
+
+                    async def lane(session):
+                        while queue:
+                            await fetch(session, [queue.take(STRIPE_SIZE)])
+
+                    async def worker(session):
+                        await asyncio.gather(*(lane(session) for _ in range(STRIPE_DEPTH)))
+
+                    await self._run_streams(streams, worker, lambda: received)
+                await writer.commit(size)
+        finally:
+            resume_streams()
+            await writer.abort()
+        self.metrics.record_delay((time.time()-start_time)*1000)
+        print(f"[Client] GET complete, {received} of {size} bytes received")
+
+    # -----------------
+    # Bundles: many small files in one request (see app/bundle.py)
+    async def put_files(self, sources):
+        """Upload files named by local paths, glob patterns or directories
+        as MPUT bundles. Returns {name: "ok" or why that file failed}."""
+        files = await self.loop.run_in_executor(io_pool(), B.expand_local, sources)
+        results = {}
+        for i in range(0, len(files), B.BUNDLE_FILES):
+            start_time = time.time()
+            entries, paths, errors = await self.loop.run_in_executor(
+                io_pool(), B.build_index, files[i:i + B.BUNDLE_FILES])
+            results.update(errors)
+            if not entries:
+                continue
+            req_id, ready = self.request(P.MPUT, B.encode_index(entries))
+            await ready
+            done = self.expect(req_id)
+            finished = self.loop.create_future()
+            on_done = lambda: finished.done() or finished.set_result(None)
+            self.stream(0).add_producer(B.BundleProducer(req_id, entries, paths, on_done, eof=False))
+            await finished
+            size = B.bundle_size(entries)
+            P.send_frame(self.t, P.END, req_id, P.END_INFO.pack(size, size))
+            _, body = await done
+            results.update(B.decode_results(body))
+            self.metrics.record_bytes(size)
+            self.metrics.record_delay((time.time()-start_time)*1000)
+            print(f"[Client] MPUT of {len(entries)} files ({size} bytes) complete")
+        return results
+
+    async def get_files(self, patterns, local_dir):
+        """Download the server files matching names or glob patterns into
+        local_dir as one MGET bundle. Returns {name: "ok" or why that file
+        failed}; a pattern that matched nothing maps to "no match"."""
+        start_time = time.time()
+        os.makedirs(local_dir, exist_ok=True)
+        session = self.stream(0)
+        unpacker, early = None, []
+        last = time.monotonic()
+
+        def target(name):
+            name = os.path.basename(name)
+            if not name or name.startswith("."):
+                raise ValueError("bad file name")
+            return os.path.join(local_dir, name)
+
+        def on_data(pos, chunk):
+            nonlocal last
+            if unpacker is None:        # DATA that came in the same batch as BUNDLE
+                early.append((pos, bytes(chunk)))
+                return
+            try:
+                ok = unpacker.feed(pos, chunk)
+            except ValueError as e:
+                raise P.ProtocolError(str(e))
+            if not ok:
+                session.pause_reading()
+            now = time.monotonic()
+            self.metrics.record_bytes(len(chunk))
+            self.metrics.record_chunk_delay((now - last) * 1000)
+            last = now
+
+        req_id, index = self.request(P.MGET, "\n".join(patterns).encode(), on_data, session)
+        _, body = await index
+        eof = self.expect(req_id)
+        entries = B.decode_index(body)
+        unpacker = B.BundleUnpacker(entries, target)
+        unpacker.on_drain = session.resume_reading
+        try:
+            try:
+                for pos, chunk in early:
+                    on_data(pos, chunk)
+            except P.ProtocolError as e:
+                self.pending.pop(req_id, None)
+                raise FTPError(str(e))
+            await eof
+        finally:
+            session.resume_reading()
+            results = await unpacker.finish()
+        names = list(results)
+        for pattern in patterns:
+            if not B.match_names([pattern], names):
+                results[pattern] = "no match"
         self.metrics.record_delay((time.time()-start_time)*1000)
-        print(f"[Client] GET complete, {len(self.recv_data)} bytes")
+        print(f"[Client] MGET of {len(entries)} files ({B.bundle_size(entries)} bytes) complete")
+        return results
 
-async def main():
-    client = FTPClient()
+async def main(compress=False, dedup=False):
+    client = FTPClient(compress=compress)
     await client.start()
+    print("[Client] Files:", await client.list_files())
     await client.get_file("example.txt", "downloaded_example.txt", resume=True)
-    await client.put_file("upload_me.txt", "uploaded_example.txt", resume=True)
+    await client.put_file("upload_me.txt", "uploaded_example.txt", resume=True, dedup=dedup)
     print(client.metrics.report())
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    import argparse
+    parser = argparse.ArgumentParser(description="Mini-FTP client demo")
+    parser.add_argument("--compress", action="store_true",
+                        help="offer per-chunk zlib compression for GET and PUT")
+    parser.add_argument("--dedup", action="store_true",
+                        help="upload by chunk hash, sending only chunks the server's store lacks")
+    args = parser.parse_args()
+    asyncio.run(main(args.compress, args.dedup))
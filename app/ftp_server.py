@@ -1,65 +1,548 @@
-import asyncio, os, zlib, time
-from transport.transport import GBNTransport
-from app.fileops import iter_chunks, save_chunks
-from tools.metrics import Metrics
+import asyncio, os, struct, time, zlib
+from transport.transport import GBNTransport, RECV_CAPACITY
+from transport.batchio import create_batched_endpoint
+from app.fileops import map_file, ChunkWriter, io_pool, load_manifest, store_manifest, \
+    compute_manifest, prepare_part, CHUNK_SIZE
+from app import protocol as P
+from app.chunkstore import ChunkStore, chunk_hash
+from app.compress import CompressingProducer, CompressionStats
+from app.bundle import BundleProducer, BundleUnpacker, build_index, decode_index, encode_index, \
+    encode_results, match_names
+from tools.metrics import Metrics, write_metrics, serve_metrics
 
 SERVER_DIR = "./server_files"
+META_DIR = os.path.join(SERVER_DIR, ".meta")   # cached chunk manifests
+STORE_DIR = os.path.join(SERVER_DIR, ".chunks") # content-addressed chunks for DEDUP uploads
 os.makedirs(SERVER_DIR, exist_ok=True)
 
+PORT = 9000
+STATS_INTERVAL = 10.0
+GC_INTERVAL = 600.0
+COMPRESSION = True      # honour COMPRESS requests (ZDATA) on GET and PUT
+
+store = ChunkStore(STORE_DIR)
+
 metrics = Metrics()
-clients_state = {}
+compression = CompressionStats()   # what this server's GETs compressed
+# Uploads are keyed by (peer address, req_id) rather than by session, so a
+# striped PUT can feed DATA over several sessions (conn_ids) of one client
+uploads = {}        # (addr, req_id) -> put state
+uploading = {}      # target path -> key of the upload assembling it
+bundles = {}        # (addr, req_id) -> MPUT state
+
+def part_path(fpath):
+    """Where an upload to fpath is assembled; kept across disconnects for resume"""
+    dirname, name = os.path.split(fpath)
+    return os.path.join(dirname, "." + name + ".part")
+
+def resolve(name):
+    """Map a client-supplied name into SERVER_DIR, refusing path traversal"""
+    fname = os.path.basename(name.strip())
+    if not fname or fname.startswith("."):
+        return None
+    return os.path.join(SERVER_DIR, fname)
+
+def list_files():
+    return sorted(f for f in os.listdir(SERVER_DIR) if not f.startswith("."))
+
+def handle_frame(client, mtype, req_id, body):
+    """client is the transport Session the frame arrived on"""
+    key = (client.addr, req_id)
+    if mtype not in (P.DATA, P.ZDATA):
+        print("[Server] Request:", P.NAMES.get(mtype, mtype), req_id)
 
-async def handle_command(client, data):
-    cmd = data.decode().strip()
-    print("[Server] Command:", cmd)
+    if mtype == P.LIST:
+        P.send_frame(client, P.LISTING, req_id, "\n".join(list_files()).encode())
 
-    if cmd == "LIST":
-        files = os.listdir(SERVER_DIR)
-        client.send(("\n".join(files)+"\n").encode())
+    elif mtype == P.MANIFEST:
+        fpath = resolve(body.decode())
+        if not fpath or not os.path.isfile(fpath):
+            P.send_frame(client, P.ERROR, req_id, b"file not found")
+            return
+        asyncio.ensure_future(send_manifest(client, req_id, fpath))
 
-    elif cmd.startswith("GET "):
-        fname = cmd[4:].strip()
-        fpath = os.path.join(SERVER_DIR, fname)
-        if not os.path.exists(fpath):
-            client.send(b"ERROR: file not found\n")
+    elif mtype == P.GET:
+        flags, name, tail = P.decode_name(body)
+        fpath = resolve(name)
+        if not fpath or not os.path.isfile(fpath):
+            P.send_frame(client, P.ERROR, req_id, b"file not found")
             return
         start_time = time.time()
-        for chunk, crc in iter_chunks(fpath):
-            client.send(chunk)
-            metrics.record_bytes(len(chunk))
-        metrics.record_delay((time.time()-start_time)*1000)
-
-    elif cmd.startswith("PUT "):
-        fname = cmd[4:].strip()
-        fpath = os.path.join(SERVER_DIR, fname)
-        clients_state[client] = {"fpath": fpath, "chunks": []}
-        client.send(b"READY\n")
-
-    elif cmd.startswith("DATA "):
-        if client not in clients_state:
-            client.send(b"ERROR: unexpected data\n")
+        view = map_file(fpath)
+        ranges = P.decode_ranges(tail) if flags & P.RANGES else None
+        metrics.record_bytes(sum(hi - lo for lo, hi in ranges) if ranges is not None else len(view))
+        done = lambda: metrics.record_delay((time.time()-start_time)*1000)
+        if flags & P.COMPRESS and COMPRESSION:
+            producer = CompressingProducer(client, req_id, view, ranges, done, stats=compression)
+        else:
+            producer = P.FileProducer(req_id, view, ranges, done)
+        client.add_producer(producer)
+
+    elif mtype == P.PUT:
+        flags, name, tail = P.decode_name(body)
+        fpath = resolve(name)
+        if not fpath:
+            P.send_frame(client, P.ERROR, req_id, b"bad file name")
+            return
+        # A new PUT of the same file takes over, e.g. a client resuming
+        # before its old session was reaped
+        previous = uploading.get(fpath)
+        uploading[fpath] = key
+        asyncio.ensure_future(start_put(client, req_id, fpath, flags, tail, previous))
+
+    elif mtype == P.MGET:
+        patterns = [p for p in body.decode(errors="replace").split("\n") if p]
+        names = [n for n in match_names(patterns, list_files())
+                 if os.path.isfile(os.path.join(SERVER_DIR, n))]
+        asyncio.ensure_future(send_bundle(client, req_id, names))
+
+    elif mtype == P.MPUT:
+        try:
+            entries = decode_index(body)
+        except P.ProtocolError as e:
+            P.send_frame(client, P.ERROR, req_id, str(e).encode())
+            return
+        start_bundle(client, req_id, entries)
+
+    elif mtype in (P.DATA, P.ZDATA) and key in bundles:
+        feed_bundle(client, bundles[key], mtype, req_id, body)
+
+    elif mtype == P.END and key in bundles:
+        bundle = bundles[key]
+        bundle["end"] = P.END_INFO.unpack_from(body)[1]
+        maybe_finish_bundle(bundle)
+
+    elif mtype in (P.DATA, P.ZDATA):
+        put = uploads.get(key)
+        if put is None:
+            P.send_frame(client, P.ERROR, req_id, b"unexpected data")
             return
-        payload = data[5:]
-        clients_state[client]["chunks"].append((payload, zlib.crc32(payload) & 0xffffffff))
+        try:
+            offset, payload = P.decode_data(mtype, body)
+            if "needed" in put:
+                ok = store_chunk(put, payload)
+            else:
+                ok = write_chunk(put, offset, payload)
+        except (OSError, ValueError, P.ProtocolError) as e:
+            asyncio.ensure_future(drop_put(key))
+            P.send_frame(client, P.ERROR, req_id, str(e).encode())
+            return
+        if not ok:
+            put["paused"].add(client)      # resumed by the writer's on_drain
+            client.pause_reading()
+        put["received"] += len(payload)
+        now = time.monotonic()
         metrics.record_bytes(len(payload))
+        metrics.record_chunk_delay((now - put["last"]) * 1000)
+        put["last"] = now
+        maybe_finish(put)
 
-    elif cmd == "END":
-        if client not in clients_state:
+    elif mtype == P.END:
+        put = uploads.get(key)
+        if put is None or "end" in put:
+            P.send_frame(client, P.ERROR, req_id, b"no upload in progress")
             return
-        save_chunks(clients_state[client]["fpath"], clients_state[client]["chunks"])
-        client.send(b"OK\n")
-        del clients_state[client]
+        size, sent = P.END_INFO.unpack_from(body)
+        put["end"] = (size, sent)
+        maybe_finish(put)
+
+    else:
+        P.send_frame(client, P.ERROR, req_id, b"Unknown command")
 
+async def send_manifest(client, req_id, fpath):
+    loop = asyncio.get_running_loop()
+    try:
+        crcs = await loop.run_in_executor(io_pool(), load_manifest, fpath, META_DIR)
+        size = os.path.getsize(fpath)
+    except OSError as e:
+        P.send_frame(client, P.ERROR, req_id, str(e).encode())
+        return
+    P.send_frame(client, P.CHUNKS, req_id, P.encode_manifest(size, CHUNK_SIZE, crcs))
+
+def write_chunk(put, offset, payload):
+    crcs = put["crcs"]
+    index, rem = divmod(offset, CHUNK_SIZE)
+    if crcs is not None and not rem and len(payload) <= CHUNK_SIZE:
+        crcs.extend([0] * (index + 1 - len(crcs)))
+        crcs[index] = zlib.crc32(payload)
     else:
-        client.send(b"Unknown command\n")
+        put["crcs"] = None      # unaligned write: rehash on commit
+    return put["writer"].write(offset, payload)
+
+def store_chunk(put, payload):
+    """DEDUP upload: verify a chunk against the announced hashes, add it to
+    the store and place it wherever the file uses it"""
+    h = chunk_hash(payload)
+    indices = put["needed"].pop(h, None)
+    if indices is None:
+        raise ValueError("chunk does not match any announced hash")
+    offsets = [i * CHUNK_SIZE for i in indices]
+    return put["writer"].submit(len(payload), store.put_into, h, payload, put["writer"].fd, offsets,
+                                written=len(payload) * len(offsets))
+
+def maybe_finish(put):
+    """Commit once END has arrived and so has every DATA byte it announced;
+    with striping, END can overtake DATA still travelling on other sessions"""
+    if "end" not in put or put["received"] < put["end"][1]:
+        return
+    uploads.pop(put["key"], None)
+    owner, req_id = put["owner"], put["key"][1]
+    if put.get("needed"):
+        asyncio.ensure_future(release_put(put))
+        P.send_frame(owner, P.ERROR, req_id, f"{len(put['needed'])} chunks never arrived".encode())
+        return
+    asyncio.ensure_future(finish_put(put, put["end"][0]))
+
+def resume_senders(put):
+    # Resuming delivers buffered frames at once, which may pause a session again
+    paused, put["paused"] = put["paused"], set()
+    for session in paused:
+        session.resume_reading()
+
+async def start_put(client, req_id, fpath, flags, tail, previous=None):
+    """Open the file being assembled and tell the client what to send: for
+    DELTA the manifest of the part file (seeded from an earlier attempt or
+    the current file), for DEDUP the chunks the store lacks"""
+    loop = asyncio.get_running_loop()
+    part = part_path(fpath)
+    key = (client.addr, req_id)
+    if previous:
+        await drop_put(previous)
+    put = {"fpath": fpath, "crcs": None, "owner": client, "key": key,
+           "received": 0, "paused": set(), "last": time.monotonic()}
+    try:
+        if flags & P.DEDUP:
+            hashes = put["hashes"] = P.decode_hashes(tail)
+            put["pin"] = await loop.run_in_executor(io_pool(), store.pin, hashes)
+            missing = await loop.run_in_executor(io_pool(), store.missing, hashes)
+            needed = put["needed"] = {hashes[i]: [] for i in missing}   # hash -> chunk indices
+            for i, h in enumerate(hashes):
+                if h in needed:
+                    needed[h].append(i)
+            writer = ChunkWriter(fpath)
+            gone = await loop.run_in_executor(io_pool(), store.fill, writer.fd, hashes, needed)
+            for i in gone:          # collected since missing() looked: ask for them too
+                if hashes[i] not in needed:
+                    missing.append(i)
+                needed.setdefault(hashes[i], []).append(i)
+            reply = P.encode_indices(sorted(missing))
+        else:
+            if flags & P.DELTA:
+                crcs = await loop.run_in_executor(io_pool(), prepare_part, fpath, part, META_DIR)
+            else:
+                if os.path.exists(part):
+                    os.remove(part)
+                crcs = []
+            writer = ChunkWriter(fpath, part_path=part)
+            put["crcs"] = list(crcs)
+            reply = P.encode_manifest(os.path.getsize(part), CHUNK_SIZE, crcs)
+    except OSError as e:
+        if "pin" in put:
+            store.unpin(put.pop("pin"))
+        if uploading.get(fpath) == key:
+            del uploading[fpath]
+        P.send_frame(client, P.ERROR, req_id, str(e).encode())
+        return
+    put["writer"] = writer
+    accepted = flags & P.COMPRESS if COMPRESSION else 0
+    if uploading.get(fpath) != key:
+        await release_put(put)      # taken over while the file was prepared
+        P.send_frame(client, P.ERROR, req_id, b"superseded by another upload")
+        return
+    writer.on_drain = lambda: resume_senders(put)
+    uploads[key] = put
+    P.send_frame(client, P.READY, req_id, P.READY_INFO.pack(accepted), reply)
+
+async def finish_put(put, size):
+    writer, fpath = put["writer"], put["fpath"]
+    client, req_id = put["owner"], put["key"][1]
+    loop = asyncio.get_running_loop()
+    try:
+        await writer.commit(size)
+        name = os.path.basename(fpath)
+        if "hashes" in put:
+            await loop.run_in_executor(io_pool(), store.link, name, put["hashes"])
+        else:
+            await loop.run_in_executor(io_pool(), store.unlink, name)
+        crcs = put["crcs"]
+        nchunks = -(-size // CHUNK_SIZE)
+        if crcs is None or len(crcs) < nchunks:
+            crcs = await loop.run_in_executor(io_pool(), compute_manifest, fpath)
+        await loop.run_in_executor(io_pool(), store_manifest, fpath, META_DIR, crcs[:nchunks])
+    except OSError as e:
+        P.send_frame(client, P.ERROR, req_id, str(e).encode())
+        return
+    finally:
+        if "pin" in put:
+            store.unpin(put.pop("pin"))
+        if uploading.get(fpath) == put["key"]:
+            del uploading[fpath]
+    print(f"[Server] Stored {fpath} ({writer.written} bytes written)")
+    P.send_frame(client, P.OK, req_id)
+
+async def release_put(put):
+    if "pin" in put:
+        store.unpin(put.pop("pin"))
+    resume_senders(put)
+    await put["writer"].abort()
+
+async def drop_put(key):
+    """Stop an upload, leaving a DELTA part file for a later resume"""
+    put = uploads.pop(key, None)
+    if put is None:
+        return
+    if uploading.get(put["fpath"]) == key:
+        del uploading[put["fpath"]]
+    await release_put(put)
+
+def abort_puts(session):
+    """Session closed: drop the uploads it started"""
+    for key, put in list(uploads.items()):
+        if put["owner"] is session:
+            asyncio.ensure_future(drop_put(key))
+    for key, bundle in list(bundles.items()):
+        if bundle["owner"] is session:
+            del bundles[key]
+            bundle["unpacker"].on_drain = None
+            asyncio.ensure_future(bundle["unpacker"].finish())
+
+# -----------------
+# Bundles (MGET/MPUT): many files as one stream, see app/bundle.py
+async def send_bundle(client, req_id, names):
+    loop = asyncio.get_running_loop()
+    start_time = time.time()
+    files = [(n, os.path.join(SERVER_DIR, n)) for n in names]
+    entries, paths, _ = await loop.run_in_executor(io_pool(), build_index, files)
+    P.send_frame(client, P.BUNDLE, req_id, encode_index(entries))
+    size = sum(e[1] for e in entries)
+    metrics.record_bytes(size)
+    done = lambda: metrics.record_delay((time.time()-start_time)*1000)
+    client.add_producer(BundleProducer(req_id, entries, paths, done))
+    print(f"[Server] Sending bundle of {len(entries)} files ({size} bytes)")
+
+def bundle_target(name):
+    fpath = resolve(name)
+    if not fpath:
+        raise ValueError("bad file name")
+    if fpath in uploading:
+        raise ValueError("upload in progress")
+    return fpath
+
+def start_bundle(client, req_id, entries):
+    # Files stored without dedup drop their chunk-store recipe, as after a PUT
+    unpacker = BundleUnpacker(entries, bundle_target,
+                              on_stored=lambda fpath: store.unlink(os.path.basename(fpath)))
+    bundle = {"owner": client, "key": (client.addr, req_id), "unpacker": unpacker,
+              "received": 0, "paused": set(), "last": time.monotonic(), "start": time.time()}
+    unpacker.on_drain = lambda: resume_senders(bundle)
+    bundles[bundle["key"]] = bundle
+    P.send_frame(client, P.READY, req_id, P.READY_INFO.pack(0))
+
+def feed_bundle(client, bundle, mtype, req_id, body):
+    try:
+        offset, payload = P.decode_data(mtype, body)
+        ok = bundle["unpacker"].feed(offset, payload)
+    except (ValueError, P.ProtocolError) as e:
+        bundles.pop(bundle["key"], None)
+        asyncio.ensure_future(bundle["unpacker"].finish())
+        resume_senders(bundle)
+        P.send_frame(client, P.ERROR, req_id, str(e).encode())
+        return
+    if not ok:
+        bundle["paused"].add(client)
+        client.pause_reading()
+    bundle["received"] += len(payload)
+    now = time.monotonic()
+    metrics.record_bytes(len(payload))
+    metrics.record_chunk_delay((now - bundle["last"]) * 1000)
+    bundle["last"] = now
+    maybe_finish_bundle(bundle)
+
+def maybe_finish_bundle(bundle):
+    if "end" not in bundle or bundle["received"] < bundle["end"]:
+        return
+    bundles.pop(bundle["key"], None)
+    asyncio.ensure_future(finish_bundle(bundle))
 
-async def main():
-    t = GBNTransport(local_port=9000)
-    t.on_receive_cb = lambda data: asyncio.create_task(handle_command(t, data))
+async def finish_bundle(bundle):
+    results = await bundle["unpacker"].finish()
+    stored = sum(1 for status in results.values() if status == "ok")
+    metrics.record_delay((time.time() - bundle["start"]) * 1000)
+    print(f"[Server] Stored {stored} of {len(results)} bundled files")
+    P.send_frame(bundle["owner"], P.OK, bundle["key"][1], encode_results(results))
+
+def on_receive(session, decoder, data):
+    try:
+        frames = decoder.feed(data)
+    except P.ProtocolError as e:
+        print(f"[Server] Dropping session {session.key}: {e}")
+        session.endpoint.close_session(session)
+        return
+    for mtype, req_id, body in frames:
+        # A bad body (short struct, invalid UTF-8 name, ...) fails its own
+        # request only: raising here would drop the rest of the datagram batch
+        try:
+            handle_frame(session, mtype, req_id, body)
+        except (ValueError, struct.error) as e:
+            print(f"[Server] Malformed {P.NAMES.get(mtype, mtype)} from {session.key}: {e}")
+            P.send_frame(session, P.ERROR, req_id, f"malformed request: {e}".encode())
+
+def accept_session(session):
+    print(f"[Server] New session {session.addr} conn_id={session.conn_id}")
+    decoder = P.FrameDecoder()
+    session.on_receive_cb = lambda data: on_receive(session, decoder, data)
+    session.on_close_cb = lambda: abort_puts(session)
+
+async def report_sessions(t, conn=None, worker_id=None, metrics_file=None):
+    """Print session stats every STATS_INTERVAL, or as a pre-fork worker
+    send them with a metrics snapshot to the parent over conn"""
+    while True:
+        await asyncio.sleep(STATS_INTERVAL)
+        st = t.stats()
+        if conn is not None:
+            conn.send({"worker": worker_id, "sessions": st["sessions"],
+                       "memory_bytes": st["memory_bytes"], "metrics": metrics.snapshot()})
+            continue
+        if metrics_file:
+            write_metrics(metrics, metrics_file)
+        if st["sessions"]:
+            print(f"[Server] sessions={st['sessions']} memory={st['memory_bytes']}B")
+            if compression.compressed:
+                print(f"[Server] GET compression: {compression.report()}")
+            top = sorted(st["per_session"].items(), key=lambda kv: -kv[1]["memory_bytes"])[:5]
+            for (addr, cid), info in top:
+                print(f"[Server]   {addr[0]}:{addr[1]} conn_id={cid} {info['memory_bytes']}B "
+                      f"cwnd={info['cwnd']} in_flight={info['bytes_in_flight']}")
+
+async def collect_chunks():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(GC_INTERVAL)
+        freed, nbytes = await loop.run_in_executor(io_pool(), store.gc)
+        if freed:
+            print(f"[Server] Chunk GC freed {freed} chunks ({nbytes}B)")
+
+async def main(port=PORT, reuse_port=False, conn=None, worker_id=None,
+               metrics_port=None, metrics_file=None, rate=None, client_rate=None, fec=False,
+               recv_capacity=RECV_CAPACITY):
+    t = GBNTransport(local_port=port, rate=rate, client_rate=client_rate, fec=fec,
+                     recv_capacity=recv_capacity)
+    t.on_session_cb = accept_session
+    metrics.attach(t)
     loop = asyncio.get_running_loop()
-    await loop.create_datagram_endpoint(lambda: t, local_addr=('0.0.0.0', 9000))
-    print("[Server] Running...")
-    await asyncio.Future()
+    await create_batched_endpoint(loop, lambda: t, ('0.0.0.0', port), reuse_port=reuse_port)
+    print("[Server] Running..." if worker_id is None else f"[Server] Worker {worker_id} running (pid {os.getpid()})")
+    exporter = serve_metrics(lambda: metrics, metrics_port, loop=loop) if metrics_port else None
+    tasks = [asyncio.create_task(report_sessions(t, conn, worker_id, metrics_file))]
+    if not worker_id:       # one chunk collector per server
+        tasks.append(asyncio.create_task(collect_chunks()))
+    try:
+        await asyncio.Future()
+    finally:
+        for task in tasks:
+            task.cancel()
+        if exporter:
+            exporter.shutdown()
+
+# -----------------
+# Pre-fork mode: K processes share the port through SO_REUSEPORT. For UDP
+# the kernel picks the socket by hashing the 4-tuple, so every datagram
+# from one client socket -- all of its sessions, striped ones included --
+# lands on the same worker. The hash only changes when the set of sockets
+# does, i.e. when a worker dies and is respawned.
+
+def run_worker(worker_id, port, conn, rate=None, client_rate=None, fec=False, recv_capacity=RECV_CAPACITY):
+    try:
+        asyncio.run(main(port, reuse_port=True, conn=conn, worker_id=worker_id,
+                         rate=rate, client_rate=client_rate, fec=fec, recv_capacity=recv_capacity))
+    except KeyboardInterrupt:
+        pass
+
+def prefork(workers, port=PORT, metrics_port=None, metrics_file=None, rate=None, client_rate=None,
+            fec=False, recv_capacity=RECV_CAPACITY):
+    import multiprocessing
+    from multiprocessing.connection import wait
+    procs = {}      # reader end of the stats pipe -> (worker_id, Process)
+    latest = {}     # worker_id -> last stats message
+    # A client socket always hashes to one worker, so only the total rate is split
+    worker_rate = rate / workers if rate else None
+
+    def spawn(worker_id):
+        reader, writer = multiprocessing.Pipe(duplex=False)
+        proc = multiprocessing.Process(target=run_worker, daemon=True,
+                                       args=(worker_id, port, writer, worker_rate, client_rate, fec,
+                                             recv_capacity))
+        proc.start()
+        writer.close()
+        procs[reader] = (worker_id, proc)
+
+    for i in range(workers):
+        spawn(i)
+    print(f"[Server] Pre-forked {workers} workers on port {port}")
+    # Workers only report every STATS_INTERVAL, so exports lag by up to that
+    merged = lambda: Metrics.merged(m["metrics"] for m in list(latest.values()))
+    exporter = serve_metrics(merged, metrics_port) if metrics_port else None
+    next_report = time.monotonic() + STATS_INTERVAL
+    try:
+        while True:
+            for reader in wait(list(procs), timeout=max(0, next_report - time.monotonic())):
+                try:
+                    msg = reader.recv()
+                except EOFError:
+                    worker_id, proc = procs.pop(reader)
+                    proc.join()
+                    latest.pop(worker_id, None)
+                    print(f"[Server] Worker {worker_id} exited ({proc.exitcode}), respawning")
+                    spawn(worker_id)
+                    continue
+                latest[msg["worker"]] = msg
+            if time.monotonic() >= next_report:
+                next_report += STATS_INTERVAL
+                aggregate = merged()
+                report = aggregate.report()
+                if metrics_file:
+                    write_metrics(aggregate, metrics_file)
+                print(f"[Server] workers={len(latest)}/{workers} "
+                      f"sessions={sum(m['sessions'] for m in latest.values())} "
+                      f"memory={sum(m['memory_bytes'] for m in latest.values())}B "
+                      f"bytes={report['total_bytes']} p95={report['p95_latency_ms']:.1f}ms "
+                      f"chunk_p95={report['p95_chunk_delay_ms']:.1f}ms retx={report['retransmissions']}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if exporter:
+            exporter.shutdown()
+        for _, proc in procs.values():
+            proc.terminate()
+        for _, proc in procs.values():
+            proc.join()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    import argparse
+    parser = argparse.ArgumentParser(description="Mini-FTP server")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes sharing the port via SO_REUSEPORT (0 = one per core)")
+    parser.add_argument("--metrics-port", type=int,
+                        help="serve Prometheus text (JSON for *.json paths) on 127.0.0.1:PORT")
+    parser.add_argument("--metrics-file",
+                        help="rewrite this file every stats interval (JSON if it ends in .json)")
+    parser.add_argument("--rate", type=float,
+                        help="total egress limit in Mbit/s, shared fairly between sessions")
+    parser.add_argument("--client-rate", type=float,
+                        help="egress limit per client host in Mbit/s")
+    parser.add_argument("--fec", action="store_true",
+                        help="send XOR parity so clients rebuild single losses without retransmission")
+    parser.add_argument("--recv-buffer", type=int, default=RECV_CAPACITY >> 10,
+                        help="reassembly buffer per session in KiB, a hard memory limit")
+    args = parser.parse_args()
+    workers = args.workers or os.cpu_count()
+    rate = args.rate and args.rate * 1e6 / 8                    # bytes/s
+    client_rate = args.client_rate and args.client_rate * 1e6 / 8
+    if workers > 1:
+        prefork(workers, args.port, args.metrics_port, args.metrics_file, rate, client_rate, args.fec,
+                args.recv_buffer << 10)
+    else:
+        asyncio.run(main(args.port, metrics_port=args.metrics_port, metrics_file=args.metrics_file,
+                         rate=rate, client_rate=client_rate, fec=args.fec,
+                         recv_capacity=args.recv_buffer << 10))
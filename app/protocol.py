@@ -0,0 +1,237 @@
+import struct, zlib
+
+# Every application message is one length-prefixed frame on the session's
+# byte stream: body length, message type, request id, then the body.
+FRAME_HEADER = struct.Struct("!IBI")
+FRAME_HEADER_SIZE = FRAME_HEADER.size
+MAX_FRAME = 1 << 24
+OFFSET = struct.Struct("!Q")   # prefix of DATA bodies; END and EOF bodies
+NAME = struct.Struct("!BH")    # flags, name length; prefix of GET and PUT bodies
+RANGE = struct.Struct("!QQ")   # [start, end) byte range in a GET body
+END_INFO = struct.Struct("!QQ")   # final file size, DATA bytes sent for the upload
+ZDATA_HEADER = struct.Struct("!QI")   # offset, uncompressed length; prefix of ZDATA bodies
+READY_INFO = struct.Struct("!B")  # flags the server accepted; prefix of READY bodies
+MANIFEST_INFO = struct.Struct("!QI")   # file size, chunk size; then one CRC32 per chunk
+DATA_HEADER = struct.Struct("!IBIQ")   # frame header + OFFSET, packed in one go
+DATA_FRAME_SIZE = 16*1024              # file bytes per DATA frame, same as fileops.CHUNK_SIZE
+
+# Requests (client -> server)
+LIST = 1
+GET = 2          # body: NAME + name, then RANGEs when flagged RANGES
+PUT = 3          # body: NAME + name, then one HASH_SIZE digest per chunk when flagged DEDUP
+DATA = 4         # body: OFFSET + bytes; sent by whichever side carries the file
+END = 5          # closes a PUT; body: END_INFO
+MANIFEST = 6     # body: file name
+ZDATA = 7        # DATA whose bytes are one zlib stream; body: ZDATA_HEADER + compressed bytes
+MPUT = 8         # upload a bundle of files; body: bundle index, then DATA at bundle offsets and END
+MGET = 9         # body: newline separated names or glob patterns
+# Replies (server -> client), carrying the request id they answer
+READY = 16       # PUT accepted, send DATA; body: READY_INFO, then the manifest of what
+                 # the server holds, or for DEDUP the "!I" indices of the chunks it lacks
+OK = 17          # body: optional text; for MPUT one "name\tstatus" line per file
+EOF = 18         # GET finished; body: OFFSET holding the file size
+ERROR = 19       # body: message
+LISTING = 20     # body: newline separated names
+CHUNKS = 21      # body: manifest
+BUNDLE = 22      # MGET matched these files; body: bundle index, followed by DATA and EOF
+
+# NAME flags
+RANGES = 0x01    # GET: send only the listed byte ranges
+DELTA = 0x01     # PUT: build on the server's partial or previous copy
+DEDUP = 0x02     # PUT: chunk hashes first, then only chunks the server's store lacks
+COMPRESS = 0x04  # GET: client accepts ZDATA; PUT: client would like to send ZDATA
+                 # (the server echoes it in READY_INFO when it agrees)
+HASH_SIZE = 32   # sha256 digest
+
+NAMES = {LIST: "LIST", GET: "GET", PUT: "PUT", DATA: "DATA", END: "END", MANIFEST: "MANIFEST",
+         ZDATA: "ZDATA", MPUT: "MPUT", MGET: "MGET",
+         READY: "READY", OK: "OK", EOF: "EOF", ERROR: "ERROR", LISTING: "LISTING",
+         CHUNKS: "CHUNKS", BUNDLE: "BUNDLE"}
+
+class ProtocolError(Exception):
+    pass
+
+def encode_frame(mtype, req_id, body=b""):
+    return FRAME_HEADER.pack(len(body), mtype, req_id) + body
+
+def send_frame(session, mtype, req_id, *parts):
+    """Send a frame whose body is the concatenation of parts, without joining
+    them; the pieces are queued first and sent together"""
+    bufs = [FRAME_HEADER.pack(sum(len(p) for p in parts), mtype, req_id)]
+    bufs += [p for p in parts if len(p)]
+    for b in bufs[:-1]:
+        session.send(b, flush=False)
+    session.send(bufs[-1])
+
+def send_data(session, req_id, offset, chunk):
+    send_frame(session, DATA, req_id, OFFSET.pack(offset), chunk)
+
+def decode_data(mtype, body):
+    """(offset, payload) of a DATA or ZDATA frame, decompressing the latter"""
+    if mtype == DATA:
+        offset, = OFFSET.unpack_from(body)
+        return offset, memoryview(body)[OFFSET.size:]
+    offset, length = ZDATA_HEADER.unpack_from(body)
+    if length > MAX_FRAME:
+        raise ProtocolError(f"compressed chunk of {length} bytes exceeds limit")
+    d = zlib.decompressobj()
+    try:
+        payload = d.decompress(memoryview(body)[ZDATA_HEADER.size:], length)
+    except zlib.error as e:
+        raise ProtocolError(f"bad compressed chunk: {e}")
+    if len(payload) != length or not d.eof:
+        raise ProtocolError("compressed chunk length mismatch")
+    return offset, memoryview(payload)
+
+def encode_name(name, flags=0, tail=b""):
+    raw = name.encode()
+    return NAME.pack(flags, len(raw)) + raw + tail
+
+def decode_name(body):
+    """Returns (flags, name, rest of the body) from a GET/PUT body"""
+    flags, n = NAME.unpack_from(body)
+    pos = NAME.size + n
+    return flags, bytes(body[NAME.size:pos]).decode(), body[pos:]
+
+def encode_ranges(ranges):
+    return b"".join(RANGE.pack(*r) for r in ranges)
+
+def decode_ranges(raw):
+    return [RANGE.unpack_from(raw, off) for off in range(0, len(raw) - RANGE.size + 1, RANGE.size)]
+
+def encode_hashes(hashes):
+    return b"".join(hashes)
+
+def decode_hashes(raw):
+    return [bytes(raw[i:i + HASH_SIZE]) for i in range(0, len(raw) - HASH_SIZE + 1, HASH_SIZE)]
+
+def encode_indices(indices):
+    return struct.pack(f"!{len(indices)}I", *indices)
+
+def decode_indices(raw):
+    return list(struct.unpack(f"!{len(raw) // 4}I", raw[:len(raw) // 4 * 4]))
+
+def encode_manifest(size, chunk_size, crcs):
+    return MANIFEST_INFO.pack(size, chunk_size) + struct.pack(f"!{len(crcs)}I", *crcs)
+
+def decode_manifest(body):
+    """Returns (size, chunk_size, [crc32 per chunk])"""
+    size, chunk_size = MANIFEST_INFO.unpack_from(body)
+    n = (len(body) - MANIFEST_INFO.size) // 4
+    return size, chunk_size, list(struct.unpack_from(f"!{n}I", body, MANIFEST_INFO.size))
+
+
+class FrameDecoder:
+    """Reassembles frames from arbitrarily split transport deliveries"""
+    def __init__(self):
+        self.buf = bytearray()
+
+    def reset(self):
+        """Drop any partial frame, e.g. after a ProtocolError"""
+        self.buf = bytearray()
+
+    def feed(self, data):
+        """Returns the [(mtype, req_id, body bytes)] completed by data.
+
+        data may be a view the transport reuses afterwards: frames are cut
+        straight out of it, copying each body once, and only an incomplete
+        tail is kept."""
+        buf = self.buf
+        if buf:
+            buf += data
+            data = buf
+        mv = memoryview(data)
+        frames = []
+        pos = 0
+        try:
+            while len(mv) - pos >= FRAME_HEADER_SIZE:
+                length, mtype, req_id = FRAME_HEADER.unpack_from(mv, pos)
+                if length > MAX_FRAME:
+                    raise ProtocolError(f"frame of {length} bytes exceeds limit")
+                end = pos + FRAME_HEADER_SIZE + length
+                if end > len(mv):
+                    break
+                frames.append((mtype, req_id, bytes(mv[pos + FRAME_HEADER_SIZE:end])))
+                pos = end
+            if data is not buf:
+                self.buf = bytearray(mv[pos:])
+        finally:
+            # buf cannot be resized while a view of it is alive
+            mv.release()
+        if data is buf:
+            del buf[:pos]
+        return frames
+
+
+class RangeQueue:
+    """Byte ranges still to be sent, shared by the producers of a striped transfer"""
+    def __init__(self, ranges):
+        self.ranges = [(lo, hi) for lo, hi in reversed(ranges) if lo < hi]   # popped from the end
+
+    def __bool__(self):
+        return bool(self.ranges)
+
+    def __len__(self):
+        return sum(hi - lo for lo, hi in self.ranges)
+
+    def take(self, n):
+        """Next piece of at most n bytes as (start, end), or None when empty"""
+        if not self.ranges:
+            return None
+        pos, end = self.ranges[-1]
+        stop = min(end, pos + n)
+        if stop < end:
+            self.ranges[-1] = (stop, end)
+        else:
+            self.ranges.pop()
+        return pos, stop
+
+
+class FileProducer:
+    """Pull-based file source for Session.add_producer.
+
+    Emits DATA frames for the requested byte ranges (the whole file by
+    default) sliced straight out of view -- normally an mmap of the file,
+    so nothing is copied into Python buffers -- then, with eof, the EOF
+    frame. ranges may be a RangeQueue shared with producers on other
+    sessions. on_done is called once the ranges are used up.
+    """
+    def __init__(self, req_id, view, ranges=None, on_done=None, eof=True):
+        self.req_id = req_id
+        self.view = view
+        self.size = len(view)
+        if ranges is None:
+            ranges = [(0, self.size)]
+        if not isinstance(ranges, RangeQueue):
+            ranges = RangeQueue([(lo, min(hi, self.size)) for lo, hi in ranges])
+        self.queue = ranges
+        self.on_done = on_done
+        self.eof = eof
+        self.finished = False
+
+    def cancel(self):
+        """Stop without sending the rest (or EOF); the session drops it on the next pull"""
+        self.finished = True
+        self.view = None
+
+    def pull(self, budget):
+        if self.finished:
+            return None
+        bufs = []
+        view, queue = self.view, self.queue
+        while budget > 0:
+            piece = queue.take(DATA_FRAME_SIZE)
+            if piece is None:
+                break
+            pos, end = piece
+            bufs.append(DATA_HEADER.pack(OFFSET.size + end - pos, DATA, self.req_id, pos))
+            bufs.append(view[pos:end])
+            budget -= DATA_HEADER.size + end - pos
+        if not queue and budget > 0:
+            if self.eof:
+                bufs.append(encode_frame(EOF, self.req_id, OFFSET.pack(self.size)))
+            self.finished = True
+            self.view = None
+            if self.on_done:
+                self.on_done()
+        return bufs
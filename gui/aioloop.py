@@ -0,0 +1,36 @@
+import asyncio, threading
+
+# -----------------
+# The GUI owns the main thread, so the client's event loop runs in a thread
+# of its own: sockets are serviced the moment they are readable, exactly as
+# in the headless client, instead of in bursts between UI timer ticks. The
+# GUI only talks to it through submit()/call(), and whatever the loop wants
+# shown goes back through Qt signals (queued across threads by Qt itself).
+
+class LoopThread:
+    """asyncio event loop running forever in a daemon thread"""
+    def __init__(self, name="asyncio"):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.close()
+
+    def submit(self, coro):
+        """Schedule coro on the loop; returns a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call(self, fn, *args):
+        """Run fn(*args) on the loop soon; safe from any thread"""
+        self.loop.call_soon_threadsafe(fn, *args)
+
+    def stop(self, timeout=2.0):
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
@@ -1,7 +1,8 @@
-import sys, asyncio, time
+import sys, time
 from PySide6.QtWidgets import QApplication, QWidget, QVBoxLayout, QLabel, QPushButton, QFileDialog, QProgressBar
-from PySide6.QtCore import QTimer, Qt
+from PySide6.QtCore import QObject, Signal
 from app.ftp_client import FTPClient
+from gui.aioloop import LoopThread
 
 # Minimal widget instead of importing from widgets.py (simplified)
 class FileTransferWidget(QWidget):
@@ -41,12 +42,18 @@ class FileTransferWidget(QWidget):
         self.label_status.setText(text)
 
 # ------------------------
+class _Bridge(QObject):
+    """Signals emitted on the network thread and delivered on the UI thread"""
+    progress = Signal()
+    finished = Signal(str, object)   # status text, metrics report
+
 class MainWindow(QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Mini-FTP GUI")
-        self.client = FTPClient(loss_rate=0.05)
-        self.loop = asyncio.get_event_loop()
+        # Network I/O, file reads and CRC work all run on this thread's loop
+        self.net = LoopThread("ftp-client")
+        self.client = self.net.submit(self.start_client()).result()
 
         self.transfer_widget = FileTransferWidget()
         self.label_metrics = QLabel("Metrics: N/A")
@@ -60,64 +67,107 @@ class MainWindow(QWidget):
         self.transfer_widget.btn_put.clicked.connect(self.start_put)
         self.transfer_widget.btn_get.clicked.connect(self.start_get)
 
-        # Timer to integrate asyncio with PySide6
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.loop_iteration)
-        self.timer.start(50)  # 20Hz
+        self.bridge = _Bridge()
+        self.bridge.progress.connect(self.show_progress)
+        self.bridge.finished.connect(self.finish_transfer)
+        self.busy = False
+        self._latest = None            # last progress report, written on the network thread
+        self._progress_queued = False
+
+    async def start_client(self):
+        client = FTPClient(loss_rate=0.05)
+        await client.start()
+        client.on_progress = self.on_progress
+        return client
 
-    def loop_iteration(self):
-        self.loop.call_soon(self.loop.stop)
-        self.loop.run_forever()
+    # ------------------------
+    # Progress: the client reports at most every PROGRESS_INTERVAL, and
+    # reports arriving while a repaint is still queued only replace its data
+    def on_progress(self, name, done, total, rate):
+        self._latest = (name, done, total, rate)
+        if not self._progress_queued:
+            self._progress_queued = True
+            self.bridge.progress.emit()
+
+    def show_progress(self):
+        self._progress_queued = False
+        name, done, total, rate = self._latest
+        if total:
+            self.transfer_widget.update_progress(int(1000 * done / total), 1000)
+            text = f"{name}: {done / 1e6:.1f} / {total / 1e6:.1f} MB at {rate / 1e6:.2f} MB/s"
+        else:
+            self.transfer_widget.update_progress(0, 0)      # busy indicator
+            text = f"{name}: {done / 1e6:.1f} MB at {rate / 1e6:.2f} MB/s"
+        self.transfer_widget.update_status(text)
 
     # ------------------------
+    def run_transfer(self, coro, label):
+        if self.busy:
+            coro.close()
+            self.transfer_widget.update_status("A transfer is already running")
+            return
+        self.busy = True
+        self.transfer_widget.update_status(f"Starting {label}...")
+        self.transfer_widget.update_progress(0)
+        self.net.submit(coro).add_done_callback(self.transfer_done)
+
+    def transfer_done(self, future):
+        # Network thread: read the metrics here, where the transport lives
+        try:
+            text = future.result()
+        except Exception as e:
+            text = f"Transfer failed: {e}"
+        self.bridge.finished.emit(text, self.client.metrics.report())
+
+    def finish_transfer(self, text, report):
+        self.busy = False
+        self.transfer_widget.update_status(text)
+        self.update_metrics(report)
+
     def start_put(self):
         if not self.transfer_widget.selected_file:
             self.transfer_widget.update_status("No file selected for PUT")
             return
-        self.transfer_widget.update_status("Starting PUT...")
-        self.loop.create_task(self.put_task())
+        self.run_transfer(self.put_task(), "PUT")
 
     async def put_task(self):
-        await self.client.start()
         start_time = time.time()
         await self.client.put_file(
             self.transfer_widget.selected_file,
             self.transfer_widget.remote_name,
             resume=True
         )
-        duration = time.time() - start_time
-        self.transfer_widget.update_status(f"PUT complete in {duration:.2f}s")
-        self.update_metrics()
+        return f"PUT complete in {time.time() - start_time:.2f}s"
 
-    # ------------------------
     def start_get(self):
         if not self.transfer_widget.remote_name:
             self.transfer_widget.update_status("No file selected for GET")
             return
-        self.transfer_widget.update_status("Starting GET...")
-        self.loop.create_task(self.get_task())
+        self.run_transfer(self.get_task(), "GET")
 
     async def get_task(self):
-        await self.client.start()
         start_time = time.time()
         await self.client.get_file(
             self.transfer_widget.remote_name,
             self.transfer_widget.remote_name,
             resume=True
         )
-        duration = time.time() - start_time
-        self.transfer_widget.update_status(f"GET complete in {duration:.2f}s")
-        self.update_metrics()
+        return f"GET complete in {time.time() - start_time:.2f}s"
 
     # ------------------------
-    def update_metrics(self):
-        m = self.client.metrics.report()
+    def update_metrics(self, m):
         text = (f"Bytes sent: {m['total_bytes']}, "
                 f"Retransmissions: {m['retransmissions']}, "
                 f"Avg latency: {m['avg_latency_ms']:.2f}ms, "
-                f"p95 latency: {m['p95_latency_ms']:.2f}ms")
+                f"p95 latency: {m['p95_latency_ms']:.2f}ms, "
+                f"p95 chunk delay: {m['p95_chunk_delay_ms']:.2f}ms")
         self.label_metrics.setText(text)
 
+    def closeEvent(self, event):
+        self.net.call(self.client.close)
+        self.net.stop()
+        super().closeEvent(event)
+
 # ------------------------
 if __name__ == "__main__":
     app = QApplication(sys.argv)
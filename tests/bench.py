@@ -0,0 +1,341 @@
+"""Transport/FTP benchmark suite with regression baselines.
+
+Every case runs PUT then GET of a seeded random file against an
+in-process server, from `clients` concurrent clients, each behind a
+seeded netem path with the case's loss and one-way delay in both
+directions. Cases sweep one parameter at a time around a base case
+(`--grid` runs the full cross product instead). Each case is repeated
+and the median of each metric is kept.
+
+    python -m tests.bench                      # quick suite, compare to baselines
+    python -m tests.bench --suite full --out results.json
+    python -m tests.bench --update-baselines   # accept the current numbers
+
+Exit status is 1 when a case fails, times out or regresses past the
+tolerance of tests/baselines.json. Every run executes in a fresh
+interpreter holding both client and server, so its CPU time and peak
+RSS (the process high-water mark) belong to that run alone.
+"""
+import argparse, asyncio, contextlib, filecmp, itertools, json, os, platform, random, socket, \
+    statistics, sys, tempfile, time
+
+try:
+    import resource
+except ImportError:      # not on Windows
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES = os.path.join(ROOT, "tests", "baselines.json")
+CASE_TIMEOUT = 120.0
+STARTUP_TIMEOUT = 30.0   # on top of CASE_TIMEOUT, for the run's interpreter to start and finish
+
+KB, MB = 1024, 1024 * 1024
+BASE = {"size": 1 * MB, "loss": 0.02, "delay_ms": 0, "window": None, "clients": 1, "fec": False}
+SUITES = {
+    "quick": {
+        "size": [1 * KB, 64 * KB, 1 * MB, 5 * MB],
+        "loss": [0.0, 0.02, 0.08],
+        "delay_ms": [0, 20],
+        "window": [None, 32],
+        "clients": [1, 4],
+        "fec": [False, True],
+    },
+    "full": {
+        "size": [1 * KB, 64 * KB, 1 * MB, 5 * MB, 25 * MB],
+        "loss": [0.0, 0.01, 0.02, 0.05, 0.1],
+        "delay_ms": [0, 10, 50],
+        "window": [16, 64, None],
+        "clients": [1, 4, 8],
+        "fec": [False, True],
+    },
+}
+
+# Metric -> (direction, default relative tolerance, absolute slack)
+CHECKS = {
+    "completion_s": ("lower", 0.5, 0.25),
+    "goodput_MBps": ("higher", 0.5, 0.0),
+    "retx_per_kb": ("lower", 1.0, 0.05),
+    "p95_chunk_ms": ("lower", 1.0, 5.0),
+    "cpu_s": ("lower", 0.5, 0.25),
+    "peak_rss_mb": ("lower", 0.25, 32.0),
+}
+
+# -----------------
+def case_id(case):
+    window = case["window"] or "cc"
+    return (f"{case['size']}B-loss{case['loss']}-delay{case['delay_ms']}ms"
+            f"-win{window}-c{case['clients']}" + ("-fec" if case.get("fec") else ""))
+
+def make_cases(suite, grid=False):
+    sweep = SUITES[suite]
+    if grid:
+        keys = list(sweep)
+        return [dict(zip(keys, values)) for values in itertools.product(*(sweep[k] for k in keys))]
+    cases, seen = [], set()
+    for key, values in sweep.items():
+        for value in values:
+            case = dict(BASE, **{key: value})
+            if case_id(case) not in seen:
+                seen.add(case_id(case))
+                cases.append(case)
+    return cases
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / MB if sys.platform == "darwin" else rss / KB    # bytes on macOS, KB elsewhere
+
+def source_file(workdir, size):
+    path = os.path.join(workdir, f"src-{size}.bin")
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            f.write(random.Random(size).randbytes(size))
+    return path
+
+# -----------------
+class Bench:
+    def __init__(self, workdir, seed=1, quiet=True):
+        self.workdir = workdir
+        self.seed = seed
+        self.quiet = quiet
+
+    async def start(self):
+        # Imported here: the server module creates ./server_files on import
+        from app import ftp_server
+        from transport.transport import GBNTransport
+        from transport.batchio import create_batched_endpoint
+        self.ftp_server = ftp_server
+        self.port = free_port()
+        self.server = GBNTransport(local_port=self.port)
+        self.server.on_session_cb = ftp_server.accept_session
+        await create_batched_endpoint(asyncio.get_running_loop(), lambda: self.server,
+                                      ("127.0.0.1", self.port))
+
+    async def run_once(self, case, run):
+        from app.ftp_client import FTPClient
+        from tools.metrics import Metrics, Histogram
+        size, clients = case["size"], case["clients"]
+        src = source_file(self.workdir, size)
+        profile = {"loss": case["loss"], "delay_ms": case["delay_ms"]}
+
+        self.ftp_server.metrics = Metrics()        # per-case server chunk delays
+        self.server.window_size = case["window"]   # sessions opened from now on
+        self.server.fec = case.get("fec", False)
+        before = self.server.counters()
+        conns = [FTPClient(("127.0.0.1", self.port), compress=False, window_size=case["window"],
+                           fec=case.get("fec", False),
+                           netem={"up": profile, "down": profile},
+                           seed=self.seed * 1000 + run * 100 + i)
+                 for i in range(clients)]
+        for c in conns:
+            await c.start()
+
+        async def transfer(i, c):
+            name = f"{case_id(case)}-{run}-{i}.bin"
+            dst = os.path.join(self.workdir, "got-" + name)
+            t0 = time.perf_counter()
+            await c.put_file(src, name, dedup=False)
+            t1 = time.perf_counter()
+            await c.get_file(name, dst)
+            t2 = time.perf_counter()
+            ok = filecmp.cmp(src, dst, shallow=False)
+            os.remove(dst)
+            return t1 - t0, t2 - t1, ok
+
+        cpu0, t0 = time.process_time(), time.perf_counter()
+        try:
+            timings = await asyncio.wait_for(
+                asyncio.gather(*(transfer(i, c) for i, c in enumerate(conns))), CASE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return {"ok": False, "timeout": True}
+        finally:
+            for c in conns:
+                c.close()
+            for session in list(self.server.sessions.values()):
+                self.server.close_session(session)
+        elapsed, cpu = time.perf_counter() - t0, time.process_time() - cpu0
+
+        after = self.server.counters()
+        retx = sum(c.t.retransmissions for c in conns) + after.get("retransmissions", 0) - before.get("retransmissions", 0)
+        moved = 2 * size * clients
+        chunks = Histogram()
+        chunks.merge(self.ftp_server.metrics.chunk_delays)
+        for c in conns:
+            chunks.merge(c.metrics.chunk_delays)
+        return {
+            "ok": all(ok for _, _, ok in timings),
+            "completion_s": elapsed,
+            "put_s": statistics.mean(t for t, _, _ in timings),
+            "get_s": statistics.mean(t for _, t, _ in timings),
+            "goodput_MBps": moved / elapsed / MB,
+            "retransmissions": retx,
+            "retx_per_kb": retx / (moved / KB),
+            "p95_chunk_ms": chunks.percentile(95),
+            "cpu_s": cpu,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+    async def run_quiet(self, case, run):
+        if not self.quiet:
+            return await self.run_once(case, run)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            return await self.run_once(case, run)
+
+    async def run_isolated(self, case, run):
+        """run_once in a new interpreter (see run_child), so that peak RSS is
+        not the high-water mark of every case before it"""
+        cmd = [sys.executable, "-m", "tests.bench", "--child", json.dumps(case), "--run", str(run),
+               "--seed", str(self.seed), "--workdir", self.workdir]
+        if not self.quiet:
+            cmd.append("--verbose")
+        proc = await asyncio.create_subprocess_exec(*cmd, cwd=ROOT, stdout=asyncio.subprocess.PIPE)
+        try:
+            out, _ = await asyncio.wait_for(proc.communicate(), CASE_TIMEOUT + STARTUP_TIMEOUT)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            return {"ok": False, "timeout": True}
+        lines = out.decode().splitlines()
+        if not self.quiet:
+            print("\n".join(lines[:-1]))
+        if proc.returncode or not lines:
+            return {"ok": False}
+        return json.loads(lines[-1])
+
+    async def run_case(self, case, repeat):
+        runs = [await self.run_isolated(case, run) for run in range(repeat)]
+        result = {"id": case_id(case), **case, "repeat": repeat,
+                  "ok": all(r["ok"] for r in runs), "timeout": any(r.get("timeout") for r in runs)}
+        done = [r for r in runs if "completion_s" in r]
+        for name in done[0] if done else ():
+            if name != "ok":
+                values = [r[name] for r in done if r[name] is not None]
+                result[name] = statistics.median(values) if values else None
+        return result
+
+# -----------------
+def compare(results, baselines, tolerance=None):
+    """Regressions of results against baselines, as readable strings"""
+    limits = baselines.get("tolerance", {})
+    known = baselines.get("cases", {})
+    problems = []
+    for r in results:
+        if not r["ok"]:
+            problems.append(f"{r['id']}: {'timed out' if r['timeout'] else 'integrity check failed'}")
+            continue
+        base = known.get(r["id"])
+        if base is None:
+            continue
+        for name, (direction, rel, slack) in CHECKS.items():
+            if r.get(name) is None or base.get(name) is None:
+                continue
+            rel = tolerance if tolerance is not None else limits.get(name, rel)
+            if direction == "lower":
+                bad = r[name] > base[name] * (1 + rel) + slack
+            else:
+                bad = r[name] < base[name] * (1 - rel) - slack
+            if bad:
+                problems.append(f"{r['id']}: {name} {r[name]:.3f} vs baseline {base[name]:.3f} "
+                                f"({direction} is better, tolerance {rel:.0%})")
+    return problems
+
+def load_baselines(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_baselines(path, results, old):
+    cases = dict(old.get("cases", {}))
+    for r in results:
+        if r["ok"]:
+            cases[r["id"]] = {name: r[name] for name in CHECKS if r.get(name) is not None}
+    data = {"tolerance": old.get("tolerance", {name: rel for name, (_, rel, _) in CHECKS.items()}),
+            "machine": machine(), "cases": cases}
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+def machine():
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count()}
+
+async def run_child(args):
+    """--child: one run of one case; prints its result as the last line"""
+    bench = Bench(args.workdir, args.seed, quiet=not args.verbose)
+    await bench.start()
+    return await bench.run_quiet(json.loads(args.child), args.run)
+
+async def run(args):
+    cases = make_cases(args.suite, args.grid)
+    if args.match:
+        cases = [c for c in cases if args.match in case_id(c)]
+    bench = Bench(args.workdir, args.seed, quiet=not args.verbose)
+    results = []
+    for case in cases:
+        r = await bench.run_case(case, args.repeat)
+        results.append(r)
+        if r.get("completion_s") is None:
+            print(f"{r['id']:45s} FAILED" + (" (timeout)" if r["timeout"] else ""))
+        else:
+            print(f"{r['id']:45s} {'ok ' if r['ok'] else 'BAD'} {r['completion_s']:7.2f}s "
+                  f"{r['goodput_MBps']:7.2f}MB/s retx/KB={r['retx_per_kb']:.3f} "
+                  f"p95chunk={r['p95_chunk_ms']:.1f}ms cpu={r['cpu_s']:.2f}s")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Mini-FTP transport benchmark")
+    parser.add_argument("--suite", choices=sorted(SUITES), default="quick")
+    parser.add_argument("--grid", action="store_true", help="full cross product of the sweep")
+    parser.add_argument("--match", help="only cases whose id contains this string")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="write results as JSON here")
+    parser.add_argument("--baselines", default=BASELINES)
+    parser.add_argument("--tolerance", type=float, help="override every relative tolerance")
+    parser.add_argument("--update-baselines", action="store_true")
+    parser.add_argument("--verbose", action="store_true", help="keep transport/server output")
+    parser.add_argument("--child", help=argparse.SUPPRESS)     # JSON case, run by run_isolated
+    parser.add_argument("--run", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.baselines = os.path.abspath(args.baselines)
+    args.out = args.out and os.path.abspath(args.out)
+
+    sys.path.insert(0, ROOT)
+    if args.child:
+        os.chdir(args.workdir)
+        print(json.dumps(asyncio.run(run_child(args))))
+        return 0
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="miniftp-bench-") as workdir:
+        args.workdir = workdir
+        os.chdir(workdir)       # server_files/ lands in the scratch directory
+        try:
+            results = asyncio.run(run(args))
+        finally:
+            os.chdir(cwd)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"machine": machine(), "suite": args.suite, "seed": args.seed,
+                       "results": results}, f, indent=2)
+    baselines = load_baselines(args.baselines)
+    if args.update_baselines:
+        save_baselines(args.baselines, results, baselines)
+        print(f"Baselines updated: {args.baselines}")
+        return 0
+    problems = compare(results, baselines, args.tolerance)
+    for p in problems:
+        print("REGRESSION", p)
+    print(f"{len(results)} cases, {len(problems)} problems")
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
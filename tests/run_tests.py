@@ -1,5 +1,4 @@
 import asyncio, json, os, time
-from transport.lossy_shim import LossySocket
 from app.ftp_client import FTPClient
 from app.ftp_server import main as start_server
 
@@ -13,7 +12,8 @@ async def run_profile(profile_name, profile_config):
 
     await asyncio.sleep(1)  # let server start
 
-    client = FTPClient(loss_rate=profile_config['loss_rate'])
+    # Seeded per-direction netem profiles, so a failing run can be replayed
+    client = FTPClient(netem=profile_config, seed=profile_config.get("seed"))
     await client.start()
 
     # Create a test file to upload
@@ -38,6 +38,7 @@ async def run_profile(profile_name, profile_config):
     print(f"PUT duration: {put_duration:.2f}s")
     print(f"GET duration: {get_duration:.2f}s")
     print(f"Metrics: {metrics}")
+    print(f"Emulated path: {client.lossy.stats()}")
 
     # Verify integrity
     with open(test_file, "rb") as f1, open(download_file, "rb") as f2:
@@ -48,6 +49,24 @@ async def run_profile(profile_name, profile_config):
         else:
             print("[FAIL] File mismatch!")
 
+    # Small files as MPUT/MGET bundles
+    bundle_dir = os.path.join(TEST_FILES_DIR, f"bundle_{profile_name}")
+    os.makedirs(bundle_dir, exist_ok=True)
+    for i in range(50):
+        with open(os.path.join(bundle_dir, f"small_{profile_name}_{i}.bin"), "wb") as f:
+            f.write(os.urandom(i * 97))
+    start_time = time.time()
+    put_results = await client.put_files([bundle_dir])
+    got_dir = os.path.join(TEST_FILES_DIR, f"bundle_{profile_name}_got")
+    get_results = await client.get_files([f"small_{profile_name}_*"], got_dir)
+    print(f"MPUT+MGET of 50 files: {time.time() - start_time:.2f}s")
+    same = all(open(os.path.join(bundle_dir, n), "rb").read() == open(os.path.join(got_dir, n), "rb").read()
+               for n in os.listdir(bundle_dir))
+    if same and set(put_results.values()) == {"ok"} and set(get_results.values()) == {"ok"}:
+        print("[PASS] Bundle integrity verified")
+    else:
+        print(f"[FAIL] Bundle mismatch! {put_results} {get_results}")
+
     # Cancel server
     server_task.cancel()
     try:
@@ -0,0 +1,21 @@
+import asyncio
+from transport.header import decode
+from transport.timers import TimerWheel
+
+
+class Endpoint:
+    """Just enough of GBNTransport to drive a Session by hand: what it sends
+    is recorded (decoded), never delivered. Create it inside the loop."""
+    scheduler = None
+    on_rtt_cb = None
+
+    def __init__(self):
+        self.loop = asyncio.get_event_loop()
+        self.timers = TimerWheel(self.loop)
+        self.sent = []
+
+    def send_raw(self, packet, addr=None):
+        self.sent.append(decode(packet))
+
+    def queue_ack(self, session):
+        session.send_ack()
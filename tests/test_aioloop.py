@@ -0,0 +1,37 @@
+import asyncio, threading
+from gui.aioloop import LoopThread
+from app.ftp_client import _Progress, PROGRESS_INTERVAL
+from transport.netem import run_virtual
+
+
+def test_loop_thread_runs_coroutines_off_the_caller():
+    lt = LoopThread()
+    try:
+        async def where():
+            await asyncio.sleep(0.01)
+            return threading.current_thread()
+        assert lt.submit(where()).result(5) is lt.thread
+        called = threading.Event()
+        lt.call(called.set)
+        assert called.wait(5)
+    finally:
+        lt.stop()
+    assert not lt.thread.is_alive()
+    assert lt.loop.is_closed()
+
+
+def test_progress_reports_while_running_and_at_the_end():
+    calls = []
+    async def main():
+        loop = asyncio.get_running_loop()
+        done = [0]
+        with _Progress(loop, lambda *a: calls.append(a), "f", 1000, lambda: done[0]):
+            for _ in range(5):
+                done[0] += 200
+                await asyncio.sleep(PROGRESS_INTERVAL)
+    run_virtual(main())
+    assert len(calls) >= 5
+    assert [c[1] for c in calls] == sorted(c[1] for c in calls)
+    name, done, total, rate = calls[-1]
+    assert (name, done, total) == ("f", 1000, 1000)
+    assert abs(rate - 1000 / (5 * PROGRESS_INTERVAL)) < 1e-6
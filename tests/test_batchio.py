@@ -0,0 +1,67 @@
+import asyncio
+import pytest
+from transport import batchio
+from transport.batchio import MMsgIO, create_batched_endpoint
+
+
+class _Collector(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.transport = None
+        self.batches = []
+        self.got = asyncio.Event()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagrams_received(self, batch):
+        self.batches.append(batch)
+        if sum(len(b) for b in self.batches) >= 200:
+            self.got.set()
+
+
+async def exchange():
+    loop = asyncio.get_running_loop()
+    tx, _ = await create_batched_endpoint(loop, asyncio.DatagramProtocol, ("127.0.0.1", 0))
+    rx_transport, rx = await create_batched_endpoint(loop, _Collector, ("127.0.0.1", 0))
+    assert rx.transport is rx_transport        # connected once the endpoint is returned
+    dest = rx_transport.get_extra_info("sockname")
+    shared = bytearray(200 * 8)
+    view = memoryview(shared)
+    sent = []
+    for i in range(200):
+        data = bytes([i]) * 8
+        kind = i % 3
+        if kind == 0:
+            tx.sendto(data, dest)                          # bytes
+        elif kind == 1:
+            view[i * 8:i * 8 + 8] = data
+            tx.sendto(view[i * 8:i * 8 + 8], dest)         # view of a writable buffer
+        else:
+            tx.sendto(memoryview(b"x" + data)[1:], dest)   # read-only view: copied
+        sent.append(data)
+    await asyncio.wait_for(rx.got.wait(), 5)
+    syscalls = tx.syscalls
+    tx.close()
+    rx_transport.close()
+    received = [data for batch in rx.batches for data, _ in batch]
+    return sent, received, syscalls
+
+
+@pytest.mark.parametrize("mmsg", [True, False])
+def test_batched_send_and_receive(monkeypatch, mmsg):
+    if mmsg and not batchio.HAVE_MMSG:
+        pytest.skip("no sendmmsg/recvmmsg here")
+    monkeypatch.setattr(batchio, "HAVE_MMSG", mmsg)
+    sent, received, syscalls = asyncio.run(exchange())
+    assert received == sent
+    # one sendmmsg per BATCH_SIZE datagrams, or the sendto loop without it
+    assert syscalls == (-(-200 // batchio.BATCH_SIZE) if mmsg else 200)
+
+
+@pytest.mark.skipif(not batchio.HAVE_MMSG, reason="no sendmmsg/recvmmsg here")
+def test_address_cache_is_bounded(monkeypatch):
+    monkeypatch.setattr(batchio, "ADDR_CACHE_SIZE", 8)
+    io = MMsgIO(-1)
+    for port in range(1, 100):
+        io._sockaddr(("127.0.0.1", port))
+        assert len(io._addr_cache) <= 8
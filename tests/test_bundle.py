@@ -0,0 +1,82 @@
+import asyncio, os
+import pytest
+from app import protocol as P
+from app.bundle import BundleProducer, BundleUnpacker, build_index, encode_index, decode_index, \
+    bundle_size, SMALL_FILE
+
+
+def make_files(root):
+    contents = {"a.txt": b"alpha", "empty": b"", "b.bin": os.urandom(3 * P.DATA_FRAME_SIZE + 7),
+                "large.bin": os.urandom(SMALL_FILE + 1000)}
+    src = root / "src"
+    src.mkdir()
+    for name, data in contents.items():
+        (src / name).write_bytes(data)
+    files = [(name, str(src / name)) for name in contents] + [("gone", str(src / "gone"))]
+    return contents, files
+
+
+def test_index_round_trip_and_validation(tmp_path):
+    contents, files = make_files(tmp_path)
+    entries, paths, errors = build_index(files)
+    assert list(errors) == ["gone"]
+    assert [e[0] for e in entries] == list(contents)
+    assert bundle_size(entries) == sum(len(d) for d in contents.values())
+    assert decode_index(encode_index(entries)) == entries
+    gap = [(n, size, offset + 1, crc) for n, size, offset, crc in entries]
+    for body in (encode_index(gap), encode_index(entries)[:-3]):
+        with pytest.raises(P.ProtocolError):
+            decode_index(body)
+
+
+def transfer(entries, paths, target, corrupt_at=None):
+    """Send the bundle through BundleProducer frames into a BundleUnpacker"""
+    async def main():
+        producer = BundleProducer(1, entries, paths)
+        unpacker = BundleUnpacker(entries, target)
+        stream = bytearray()
+        while True:
+            bufs = producer.pull(64 << 10)
+            if bufs is None:
+                break
+            stream += b"".join(bufs)
+        for mtype, _, body in P.FrameDecoder().feed(stream):
+            if mtype == P.DATA:
+                offset, data = P.decode_data(mtype, body)
+                if corrupt_at is not None and offset <= corrupt_at < offset + len(data):
+                    data = bytearray(data)
+                    data[corrupt_at - offset] ^= 1
+                unpacker.feed(offset, data)
+            else:
+                assert (mtype, body) == (P.EOF, P.OFFSET.pack(bundle_size(entries)))
+        return await unpacker.finish()
+    return asyncio.run(main())
+
+
+def test_bundle_unpacks_every_file(tmp_path):
+    contents, files = make_files(tmp_path)
+    entries, paths, _ = build_index(files)
+    out = tmp_path / "out"
+    out.mkdir()
+    results = transfer(entries, paths, lambda name: str(out / name))
+    assert results == dict.fromkeys(contents, "ok")
+    for name, data in contents.items():
+        assert (out / name).read_bytes() == data
+    assert not [n for n in os.listdir(out) if n.endswith(".part")]
+
+
+def test_bad_file_fails_alone(tmp_path):
+    contents, files = make_files(tmp_path)
+    entries, paths, _ = build_index(files)
+    out = tmp_path / "out"
+    out.mkdir()
+    def target(name):
+        if name == "a.txt":
+            raise ValueError("refused")
+        return str(out / name)
+    b_offset = next(offset for name, _, offset, _ in entries if name == "b.bin")
+    results = transfer(entries, paths, target, corrupt_at=b_offset + 100)
+    assert results == {"a.txt": "refused", "empty": "ok", "b.bin": "checksum mismatch",
+                       "large.bin": "ok"}
+    assert sorted(os.listdir(out)) == ["empty", "large.bin"]
+    assert (out / "large.bin").read_bytes() == contents["large.bin"]
@@ -0,0 +1,116 @@
+import os, subprocess, sys
+from app import fileops
+from app.chunkstore import ChunkStore, chunk_hash
+
+CHUNK = 4096
+
+
+def chunks_of(data):
+    return [data[i:i + CHUNK] for i in range(0, len(data), CHUNK)]
+
+
+def assemble(store, path, data, stored):
+    """Build path from data's chunks the way a DEDUP PUT does: the chunks
+    in stored are already in the store, the rest arrive with the upload"""
+    parts = chunks_of(data)
+    hashes = [chunk_hash(p) for p in parts]
+    fd = os.open(path, os.O_RDWR | os.O_CREAT)
+    try:
+        needed = {}
+        for i, (h, p) in enumerate(zip(hashes, parts)):
+            if p not in stored:
+                needed.setdefault(h, (p, []))[1].append(i * CHUNK)
+        store.fill(fd, hashes, needed, CHUNK)
+        for h, (p, offsets) in needed.items():
+            store.put_into(h, p, fd, offsets)
+    finally:
+        os.close(fd)
+    store.link(os.path.basename(path), hashes)
+    return hashes
+
+
+def test_file_assembled_from_store_and_upload(tmp_path):
+    store = ChunkStore(str(tmp_path / "store"))
+    a = os.urandom(5 * CHUNK + 100)
+    first = chunks_of(a)
+    assemble(store, tmp_path / "a", a, stored=())
+    assert (tmp_path / "a").read_bytes() == a
+
+    # Repeated and shared chunks, a changed one and a new partial tail
+    b = first[2] + first[0] + first[0] + os.urandom(CHUNK) + first[4] + b"tail"
+    assemble(store, tmp_path / "b", b, stored=set(first))
+    assert (tmp_path / "b").read_bytes() == b
+    assert store.refs[chunk_hash(first[0])] == 3
+
+
+def test_copies_when_reflinks_fail(tmp_path, monkeypatch):
+    monkeypatch.setattr(fileops, "_reflinks", False)
+    store = ChunkStore(str(tmp_path / "store"))
+    a = os.urandom(3 * CHUNK + 1)
+    assemble(store, tmp_path / "a", a, stored=())
+    b = a[CHUNK:] + a[:CHUNK]
+    assemble(store, tmp_path / "b", b, stored=set(chunks_of(a)))
+    assert (tmp_path / "b").read_bytes() == b
+
+
+def test_gc_keeps_referenced_and_pinned_chunks(tmp_path):
+    store = ChunkStore(str(tmp_path / "store"))
+    kept, pinned, garbage = (os.urandom(100) for _ in range(3))
+    for data in (kept, pinned, garbage):
+        store.put(chunk_hash(data), data)
+    store.link("f", [chunk_hash(kept)])
+    pin = store.pin([chunk_hash(pinned)])
+    assert store.gc(grace=-1) == (1, 100)
+    assert store.has(chunk_hash(kept)) and store.has(chunk_hash(pinned))
+    assert not store.has(chunk_hash(garbage))
+    store.unpin(pin)
+    assert store.gc(grace=-1) == (1, 100)
+    assert not store.has(chunk_hash(pinned))
+
+
+PIN_AND_WAIT = """
+import sys
+from app.chunkstore import ChunkStore
+store = ChunkStore(sys.argv[1])
+store.pin([bytes.fromhex(sys.argv[2])])
+print("pinned", flush=True)
+sys.stdin.read()
+"""
+
+def test_gc_sees_pins_of_other_processes(tmp_path):
+    root = str(tmp_path / "store")
+    store = ChunkStore(root)
+    data = os.urandom(100)
+    h = chunk_hash(data)
+    store.put(h, data)
+    worker = subprocess.Popen([sys.executable, "-c", PIN_AND_WAIT, root, h.hex()],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        assert worker.stdout.readline() == b"pinned\n"
+        assert store.gc(grace=-1) == (0, 0)
+        assert store.has(h)
+    finally:
+        worker.kill()
+        worker.wait()
+    # The worker died holding the pin: its pin file is stale and dropped
+    assert store.gc(grace=-1) == (1, 100)
+    assert not os.listdir(store.pins)
+
+
+def test_fill_reports_chunks_collected_by_another_process(tmp_path):
+    ours = ChunkStore(str(tmp_path / "store"))
+    theirs = ChunkStore(str(tmp_path / "store"))   # another worker on the same store
+    parts = [os.urandom(CHUNK) for _ in range(3)]
+    hashes = [chunk_hash(p) for p in parts]
+    for h, p in zip(hashes, parts):
+        ours.put(h, p)
+    assert ours.missing(hashes) == []
+    assert theirs.gc(grace=-1) == (3, 3 * CHUNK)
+    assert ours.missing(hashes) == []              # stale index entries
+    fd = os.open(tmp_path / "f", os.O_RDWR | os.O_CREAT)
+    try:
+        assert ours.fill(fd, hashes + hashes[:1], skip={hashes[1]}, chunk_size=CHUNK) == [0, 2, 3]
+    finally:
+        os.close(fd)
+    assert ours.missing(hashes[::2]) == [0, 1]     # and forgotten by the index
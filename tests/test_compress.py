@@ -0,0 +1,65 @@
+import asyncio, os, zlib
+import pytest
+from app import protocol as P
+from app.compress import CompressingProducer, CompressionStats, worth_compressing
+
+
+class _Session:
+    """What CompressingProducer uses of a Session: the loop, and try_send()
+    to hear that a compressed chunk is ready"""
+    def __init__(self):
+        self.endpoint = self
+        self.loop = asyncio.get_running_loop()
+        self.ready = asyncio.Event()
+
+    def try_send(self):
+        self.ready.set()
+
+
+def test_probe_skips_random_and_tiny_chunks():
+    assert worth_compressing(b"hello world " * 200)
+    assert not worth_compressing(os.urandom(4096))
+    assert not worth_compressing(b"a" * 100)
+
+
+def test_compressed_round_trip():
+    text = b"".join(b"line %d of a log file\n" % i for i in range(3000))
+    data = text[:2 * P.DATA_FRAME_SIZE] + os.urandom(P.DATA_FRAME_SIZE) + text[:1000]
+    stats = CompressionStats()
+
+    async def main():
+        session = _Session()
+        producer = CompressingProducer(session, 5, memoryview(data), stats=stats)
+        bufs = []
+        while True:
+            session.ready.clear()
+            out = producer.pull(64 << 10)
+            if out is None:
+                return P.FrameDecoder().feed(b"".join(bufs))
+            if not out:
+                await asyncio.wait_for(session.ready.wait(), 10)
+            bufs += out
+
+    frames = asyncio.run(main())
+    got = bytearray(len(data))
+    kinds = []
+    for mtype, req_id, body in frames[:-1]:
+        pos, payload = P.decode_data(mtype, body)
+        got[pos:pos + len(payload)] = payload
+        kinds.append(mtype)
+    assert got == data
+    assert kinds == [P.ZDATA, P.ZDATA, P.DATA, P.ZDATA]
+    assert frames[-1] == (P.EOF, 5, P.OFFSET.pack(len(data)))
+    assert stats.raw_bytes == len(data) and stats.wire_bytes < len(data)
+    assert (stats.compressed, stats.skipped) == (3, 1)
+
+
+def test_decode_rejects_bad_compressed_chunks():
+    payload = b"x" * 1000
+    good = P.ZDATA_HEADER.pack(0, len(payload)) + zlib.compress(payload)
+    assert bytes(P.decode_data(P.ZDATA, good)[1]) == payload
+    for body in (P.ZDATA_HEADER.pack(0, 999) + zlib.compress(payload),      # longer than announced
+                 P.ZDATA_HEADER.pack(0, 1000) + b"not zlib",
+                 P.ZDATA_HEADER.pack(0, P.MAX_FRAME + 1) + zlib.compress(payload)):
+        with pytest.raises(P.ProtocolError):
+            P.decode_data(P.ZDATA, body)
@@ -0,0 +1,74 @@
+import pytest
+from transport.congestion import Reno, Vegas, make_controller, INITIAL_WINDOW, MIN_WINDOW
+
+MSS = 1000
+
+
+def test_reno_slow_start_then_halving():
+    cc = Reno(MSS)
+    assert cc.cwnd == INITIAL_WINDOW * MSS and cc.in_slow_start
+    cc.on_ack(4 * MSS)                       # byte counting: one coalesced ACK for 4 segments
+    assert cc.cwnd == 14 * MSS
+    cc.on_loss(bytes_in_flight=14 * MSS)
+    assert cc.ssthresh == cc.cwnd == 7 * MSS and not cc.in_slow_start
+
+
+def test_reno_congestion_avoidance_adds_one_segment_per_window():
+    cc = Reno(MSS)
+    cc.on_loss(20 * MSS)
+    start = cc.cwnd
+    for _ in range(start // MSS):            # one window of per-segment ACKs
+        cc.on_ack(MSS)
+    assert start + MSS * 0.9 <= cc.cwnd <= start + MSS
+
+
+def test_reno_timeout_and_clamps():
+    cc = Reno(MSS, max_window=30 * MSS)
+    cc.on_ack(100 * MSS)
+    assert cc.cwnd == 30 * MSS               # max_window
+    cc.on_timeout(bytes_in_flight=30 * MSS)
+    assert cc.cwnd == MSS and cc.ssthresh == 15 * MSS and cc.in_slow_start
+    cc.on_loss(bytes_in_flight=MSS)
+    assert cc.cwnd == cc.ssthresh == MIN_WINDOW * MSS
+
+
+def vegas_after_loss(cwnd_segments=20):
+    cc = Vegas(MSS)
+    cc.on_ack(MSS, rtt=0.100)                # base RTT
+    cc.on_loss(2 * cwnd_segments * MSS)
+    assert cc.cwnd == cwnd_segments * MSS and not cc.in_slow_start
+    return cc
+
+
+def one_round(cc, rtt):
+    for _ in range(cc.cwnd // MSS):
+        cc.on_ack(MSS, rtt)
+
+
+@pytest.mark.parametrize("rtt, change", [
+    (0.100, +1),        # nothing queued (< alpha): grow
+    (0.1125, 0),        # 20 * (1 - 0.100/0.1125) = 2.2 segments queued: hold
+    (0.150, -1),        # 6.7 segments queued (> beta): back off
+])
+def test_vegas_steers_queue_between_alpha_and_beta(rtt, change):
+    cc = vegas_after_loss()
+    start = cc.cwnd
+    one_round(cc, rtt)
+    assert cc.cwnd == start + change * MSS
+    assert cc.base_rtt == 0.100
+
+
+def test_vegas_falls_back_to_reno_on_loss_and_timeout():
+    cc = vegas_after_loss()
+    cc.on_timeout(bytes_in_flight=20 * MSS)
+    assert cc.cwnd == MSS and cc.in_slow_start
+    cc.on_ack(3 * MSS, rtt=0.2)              # slow start again, by bytes
+    assert cc.cwnd == 4 * MSS
+
+
+def test_make_controller():
+    assert isinstance(make_controller("reno", MSS), Reno)
+    assert isinstance(make_controller(Vegas, MSS, 50 * MSS), Vegas)
+    assert make_controller(lambda mss, max_window: Reno(mss, max_window), MSS).mss == MSS
+    with pytest.raises(KeyError):
+        make_controller("cubic", MSS)
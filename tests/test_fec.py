@@ -0,0 +1,97 @@
+import asyncio, os
+import pytest
+from transport.fec import FecEncoder, FecDecoder
+from transport.netem import MemoryNetwork, run_virtual
+from transport.session import Session, MSS
+from transport.transport import GBNTransport
+from tests.support import Endpoint
+
+
+def group(k=4):
+    """k segments (the last one short) and the parity the encoder sends for them"""
+    enc = FecEncoder(MSS, k=k)
+    segs, seq, parity = [], 1000, None
+    for i in range(k):
+        payload = os.urandom(MSS if i < k - 1 else 300)
+        segs.append((seq, payload))
+        parity = enc.add(seq, payload)
+        seq += len(payload)
+    assert parity is not None and parity[0] == 1000
+    return segs, parity
+
+
+def receiver():
+    session = Session(Endpoint(), ("127.0.0.1", 9000), 1)
+    session.expected_seq = session.deliver_seq = 1000
+    session.fec_decoder = FecDecoder(MSS)   # as once the stream's first parity has arrived
+    got = bytearray()
+    session.on_receive_cb = got.extend
+    return session, got
+
+
+@pytest.mark.parametrize("parity_first", [False, True])
+@pytest.mark.parametrize("lost", range(4))
+def test_single_loss_rebuilt(lost, parity_first):
+    async def main():
+        segs, (start, parity) = group()
+        session, got = receiver()
+        if parity_first:
+            session.on_parity(start, 64, parity)
+        for i, (seq, payload) in enumerate(segs):
+            if i != lost:
+                session.on_data(seq, 64, payload)
+        if not parity_first:
+            session.on_parity(start, 64, parity)
+        dec = session.fec_decoder
+        assert bytes(got) == b"".join(p for _, p in segs)
+        assert (dec.recovered, dec.repaired) == (1, 1)
+
+        session.on_data(segs[lost][0], 64, segs[lost][1])
+        assert (dec.late, dec.repaired) == (1, 0)      # only reordered after all
+        assert bytes(got) == b"".join(p for _, p in segs)
+        session.close()
+    run_virtual(main())
+
+
+def test_two_losses_wait_for_one_of_them():
+    async def main():
+        segs, (start, parity) = group()
+        session, got = receiver()
+        session.on_parity(start, 64, parity)
+        session.on_data(segs[0][0], 64, segs[0][1])
+        session.on_data(segs[3][0], 64, segs[3][1])
+        assert session.fec_decoder.recovered == 0
+        session.on_data(segs[2][0], 64, segs[2][1])     # retransmitted: segment 1 is rebuilt
+        assert session.fec_decoder.recovered == 1
+        assert bytes(got) == b"".join(p for _, p in segs)
+        session.close()
+    run_virtual(main())
+
+
+def test_random_loss_repaired_over_network():
+    async def main():
+        net = MemoryNetwork(seed=3)
+        a, b = ("10.0.0.1", 1), ("10.0.0.2", 2)
+        net.set_profile(a, b, {"loss": 0.02, "delay_ms": 10})
+        net.set_profile(b, a, {"delay_ms": 10})
+        rx = GBNTransport(2, fec=True)
+        net.endpoint(rx, b)
+        tx = GBNTransport(1, b, fec=True)
+        net.endpoint(tx, a)
+        await asyncio.sleep(0)
+        data = os.urandom(400 * MSS)
+        got = bytearray()
+        done = asyncio.Event()
+        def on_session(session):
+            def on_receive(chunk):
+                got.extend(chunk)
+                if len(got) >= len(data):
+                    done.set()
+            session.on_receive_cb = on_receive
+        rx.on_session_cb = on_session
+        tx.send(data)
+        await asyncio.wait_for(done.wait(), 60)
+        return bytes(got) == data, tx.counters(), rx.counters()
+    ok, sent, received = run_virtual(main())
+    assert ok
+    assert received["fec_recovered"] > 0 and sent["fec_parity_sent"] > 0
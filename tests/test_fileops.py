@@ -0,0 +1,115 @@
+import asyncio, os, zlib
+import pytest
+from app.fileops import ChunkWriter, CHUNK_SIZE, compute_manifest, load_manifest, \
+    missing_chunks, chunk_ranges, prepare_part
+
+
+def test_writer_commits_atomically(tmp_path):
+    path = str(tmp_path / "out.bin")
+    async def main():
+        writer = ChunkWriter(path)
+        writer.write(1000, b"b" * 1000)      # out of order
+        writer.write(0, b"a" * 1000)
+        assert not os.path.exists(path)
+        await writer.commit(1500)
+        return writer
+    writer = asyncio.run(main())
+    with open(path, "rb") as f:
+        assert f.read() == b"a" * 1000 + b"b" * 500
+    assert writer.written == 2000
+    assert not os.path.exists(writer.tmp_path)
+
+
+def test_writer_backpressure(tmp_path):
+    async def main():
+        writer = ChunkWriter(str(tmp_path / "out.bin"), limit=1000)
+        drained = asyncio.Event()
+        writer.on_drain = drained.set
+        assert writer.write(0, b"x" * 800)
+        assert not writer.write(800, b"x" * 800)
+        assert not writer.write(1600, b"x" * 100)    # stays congested until drained
+        await asyncio.wait_for(drained.wait(), 10)
+        assert writer.write(1700, b"x" * 100)
+        await writer.commit()
+    asyncio.run(main())
+    assert os.path.getsize(tmp_path / "out.bin") == 1800
+
+
+def test_abort_removes_temporary_but_keeps_part_file(tmp_path):
+    path, part = str(tmp_path / "out.bin"), str(tmp_path / "out.bin.part")
+    async def main():
+        temp = ChunkWriter(path)
+        temp.write(0, b"data")
+        await temp.abort()
+        await temp.abort()
+        resumable = ChunkWriter(path, part_path=part)
+        resumable.write(0, b"data")
+        await resumable.abort()
+        return temp.tmp_path
+    tmp = asyncio.run(main())
+    assert not os.path.exists(tmp) and not os.path.exists(path)
+    with open(part, "rb") as f:
+        assert f.read() == b"data"
+
+
+def test_commit_reports_write_errors(tmp_path):
+    async def main():
+        writer = ChunkWriter(str(tmp_path / "out.bin"))
+        writer.write(-1, b"data")            # pwrite fails
+        with pytest.raises(OSError):
+            await writer.commit()
+        with pytest.raises(OSError):
+            writer.write(0, b"data")
+        return writer
+    writer = asyncio.run(main())
+    assert writer.fd is None
+    assert os.listdir(tmp_path) == []
+
+
+# -----------------
+# Chunk manifests
+def test_manifest_cached_until_file_changes(tmp_path):
+    path, meta = str(tmp_path / "f.bin"), str(tmp_path / "meta")
+    with open(path, "wb") as f:
+        f.write(os.urandom(2 * CHUNK_SIZE + 10))
+    crcs = load_manifest(path, meta)
+    assert crcs == compute_manifest(path) and len(crcs) == 3
+    assert os.path.exists(os.path.join(meta, "f.bin.crc"))
+    # A valid cache is read back, not recomputed
+    with open(os.path.join(meta, "f.bin.crc"), "r+b") as f:
+        f.seek(-4, os.SEEK_END)
+        f.write(b"\0\0\0\0")
+    assert load_manifest(path, meta) == crcs[:2] + [0]
+    with open(path, "ab") as f:
+        f.write(b"more")
+    assert load_manifest(path, meta) == compute_manifest(path)
+
+
+def test_missing_chunks_and_ranges():
+    want = [1, 2, 3, 4, 5]
+    assert missing_chunks(want, [1, 9, 3]) == [1, 3, 4]
+    assert missing_chunks(want, want) == []
+    size = 4 * CHUNK_SIZE + 100
+    assert chunk_ranges([1, 3, 4], CHUNK_SIZE, size) == \
+        [(CHUNK_SIZE, 2 * CHUNK_SIZE), (3 * CHUNK_SIZE, size)]
+
+
+def crcs_of(data):
+    return [zlib.crc32(data[i:i + CHUNK_SIZE]) for i in range(0, len(data), CHUNK_SIZE)]
+
+
+def test_resume_sends_only_changed_chunks(tmp_path):
+    path, part, meta = (str(tmp_path / n) for n in ("f.bin", "f.bin.part", "meta"))
+    old = os.urandom(4 * CHUNK_SIZE)
+    with open(path, "wb") as f:
+        f.write(old)
+    new = bytearray(old)
+    new[CHUNK_SIZE + 5] ^= 1
+    new += b"tail"
+    have = prepare_part(path, part, meta)       # copy of the current file
+    assert missing_chunks(crcs_of(new), have) == [1, 4]
+    # An interrupted upload's part file is resumed as it is
+    with open(part, "r+b") as f:
+        f.seek(CHUNK_SIZE)
+        f.write(new[CHUNK_SIZE:2 * CHUNK_SIZE])
+    assert missing_chunks(crcs_of(new), prepare_part(path, part, meta)) == [4]
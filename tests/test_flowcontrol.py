@@ -0,0 +1,54 @@
+import asyncio
+import pytest
+from transport.netem import MemoryNetwork, run_virtual
+from transport.transport import GBNTransport
+
+RECV_CAPACITY = 64 << 10
+
+
+async def paused_receiver(lose_update):
+    """Send 1 MiB to a receiver that stops reading for 3 s, then resumes
+    (optionally losing the window update it sends when it does)"""
+    net = MemoryNetwork(seed=1)
+    a, b = ("10.0.0.1", 1), ("10.0.0.2", 2)
+    net.set_profile(a, b, {"delay_ms": 20})
+    net.set_profile(b, a, {"delay_ms": 20})
+    rx = GBNTransport(2, recv_capacity=RECV_CAPACITY)
+    net.endpoint(rx, b)
+    tx = GBNTransport(1, b)
+    net.endpoint(tx, a)
+    await asyncio.sleep(0)
+
+    data = bytes(range(256)) * 4096
+    got = bytearray()
+    done = asyncio.Event()
+    sessions = []
+    def on_session(session):
+        def on_receive(chunk):
+            got.extend(chunk)
+            if len(got) >= len(data):
+                done.set()
+        session.on_receive_cb = on_receive
+        session.pause_reading()
+        sessions.append(session)
+    rx.on_session_cb = on_session
+
+    tx.send(data)
+    await asyncio.sleep(3)
+    assert tx.default_session.bytes_in_flight <= RECV_CAPACITY
+    session = sessions[0]
+    if lose_update:
+        session.send_ack = lambda window_update=False: None
+    session.resume_reading()
+    session.__dict__.pop("send_ack", None)
+    await asyncio.wait_for(done.wait(), 60)
+    return bytes(got) == data, tx.counters()
+
+
+@pytest.mark.parametrize("lose_update", [False, True])
+def test_zero_window_is_probed_not_timed_out(lose_update):
+    ok, counters = run_virtual(paused_receiver(lose_update))
+    assert ok
+    assert counters["window_probes"] > 0
+    assert counters["timeouts"] == 0
+    assert counters["fast_retransmits"] == 0
@@ -0,0 +1,39 @@
+import os
+import pytest
+from transport import header as H
+
+
+SEGMENTS = [(i * 1000, os.urandom(n)) for i, n in enumerate([1200, 0, 1, 700, 1200])]
+
+
+def test_encode_batch_round_trip():
+    packets = H.encode_batch(1, 0x10, 7, 99, 4096, SEGMENTS)
+    assert len(packets) == len(SEGMENTS)
+    for pkt, (seq, payload) in zip(packets, SEGMENTS):
+        fields, body = H.decode(pkt)
+        assert fields[:H.CHECKSUM_FIELD] == (1, 0x10, 7, seq, 99, 4096, len(payload))
+        assert bytes(body) == payload
+        # Same bytes as the single-packet encoders
+        assert bytes(pkt) == bytes(H.make_packet(1, 0x10, 7, seq, 99, 4096, payload))
+        buf = bytearray(b"\xff" * (len(pkt) + 3))
+        assert H.encode_into(buf, 3, 1, 0x10, 7, seq, 99, 4096, payload) == len(pkt)
+        assert buf[3:] == pkt
+        # and the checksum the compatibility helpers compute
+        assert fields[H.CHECKSUM_FIELD] == H.compute_checksum(
+            H.pack_header(1, 0x10, 7, seq, 99, 4096, len(payload)), payload)
+
+
+@pytest.mark.parametrize("pos", [0, 5, H.CHECKSUM_OFFSET, H.HEADER_SIZE, H.HEADER_SIZE + 599])
+def test_decode_rejects_corruption(pos):
+    pkt = H.make_packet(1, 0, 1, 5, 0, 100, os.urandom(600))
+    pkt[pos] ^= 0x01
+    with pytest.raises(ValueError):
+        H.decode(pkt)
+
+
+def test_decode_rejects_short_and_truncated():
+    pkt = H.make_packet(1, 0, 1, 5, 0, 100, b"payload")
+    with pytest.raises(ValueError, match="Short"):
+        H.decode(pkt[:H.HEADER_SIZE - 1])
+    with pytest.raises(ValueError, match="Length"):
+        H.decode(pkt[:-1])
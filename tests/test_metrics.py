@@ -0,0 +1,57 @@
+import random
+import pytest
+from tools.metrics import Histogram, bucket_index, bucket_value, BUCKETS, UNIT
+
+
+def exact_percentile(values, q):
+    ordered = sorted(values)
+    return ordered[max(1, -(-len(ordered) * q // 100)) - 1]
+
+
+def test_buckets_are_monotonic_and_within_three_percent():
+    last = -1
+    for v in [0, 1, 63, 64, 65, 1000, 12345, 10 ** 6, 2 ** 36 - 1]:
+        i = bucket_index(v)
+        assert last <= i < BUCKETS
+        assert bucket_value(i) == pytest.approx(v, rel=0.03, abs=0.5)
+        last = i
+
+
+@pytest.mark.parametrize("q", [50, 90, 95, 99, 100])
+def test_percentiles_match_exact_ones(q):
+    r = random.Random(q)
+    values = [r.lognormvariate(1.0, 1.5) for _ in range(20000)]
+    h = Histogram()
+    for v in values:
+        h.record(v)
+    assert h.count == len(values)
+    assert h.percentile(q) == pytest.approx(exact_percentile(values, q), rel=0.03, abs=1 / UNIT)
+    assert h.min <= h.percentile(q) <= h.max
+
+
+def test_merge_and_snapshot():
+    r = random.Random(7)
+    a_values = [r.uniform(0, 5) for _ in range(5000)]
+    b_values = [r.uniform(50, 500) for _ in range(1000)]
+    a, b, whole = Histogram(), Histogram(), Histogram()
+    for v in a_values:
+        a.record(v)
+        whole.record(v)
+    for v in b_values:
+        b.record(v)
+        whole.record(v)
+    a.merge(Histogram.from_snapshot(b.snapshot()))
+    assert (a.count, a.min, a.max) == (whole.count, whole.min, whole.max)
+    assert a.total == pytest.approx(whole.total)
+    assert a.summary() == pytest.approx(whole.summary())
+    assert a.percentile(95) == pytest.approx(exact_percentile(a_values + b_values, 95), rel=0.03)
+
+
+def test_empty_and_weighted():
+    h = Histogram()
+    assert h.percentile(99) == 0 and h.mean == 0
+    h.record(2.0, n=99)
+    h.record(1000.0)
+    assert h.percentile(99) == pytest.approx(2.0, rel=0.03)
+    assert h.percentile(100) == 1000.0
+    assert h.mean == pytest.approx((2.0 * 99 + 1000.0) / 100)
@@ -0,0 +1,59 @@
+import asyncio
+from transport.netem import MemoryNetwork, run_virtual
+from transport.pacing import TokenBucket, Pacer, PACING_GAIN_CA
+from transport.transport import GBNTransport
+
+MSS = 1200
+
+
+def test_token_bucket_refills_to_depth():
+    bucket = TokenBucket(1000, 500)
+    bucket.spend(800)
+    assert bucket.refill(0.0) == -300
+    assert bucket.wait(200, 0.0) == 0.5
+    assert bucket.refill(0.4) == 100
+    assert bucket.refill(10.0) == 500
+
+
+def test_pacer_follows_cwnd_over_srtt():
+    pacer = Pacer(MSS)
+    assert pacer.allowance(0.0) is None           # no RTT sample yet
+    pacer.update(100 * MSS, 0.1, False, MSS, 1.0)
+    assert pacer.rate == PACING_GAIN_CA * 100 * MSS / 0.1
+    assert pacer.allowance(1.0) == pacer.depth == max(4 * MSS, pacer.rate * 0.002)
+
+
+async def shares(rate, weights, client_rate=None, seconds=3.0):
+    """Bytes each receiver got from one rate-limited sender, after seconds"""
+    net = MemoryNetwork({"delay_ms": 5}, seed=1)
+    tx = GBNTransport(1, rate=rate, client_rate=client_rate)
+    net.endpoint(tx, ("10.0.0.1", 1))
+    receivers = []
+    for i, weight in enumerate(weights):
+        addr = (f"10.0.1.{i + 1}", 2)
+        rx = GBNTransport(2)
+        net.endpoint(rx, addr)
+        buf = bytearray()
+        rx.on_session_cb = lambda s, buf=buf: setattr(s, "on_receive_cb", buf.extend)
+        receivers.append((addr, weight, buf))
+    await asyncio.sleep(0)
+    for addr, weight, _ in receivers:
+        session = tx.open_session(addr)
+        session.weight = weight
+        session.send(bytes(20 << 20))
+    await asyncio.sleep(seconds)
+    return [len(buf) for _, _, buf in receivers]
+
+
+def test_rate_shared_by_weight():
+    rate = 1 << 20
+    a, b = run_virtual(shares(rate, [1.0, 3.0]))
+    assert 2.7 < b / a < 3.3
+    assert 0.9 * 3 * rate < a + b <= 3 * rate + (64 << 10)
+
+
+def test_client_rate_caps_each_host():
+    rate = 1 << 20
+    a, b = run_virtual(shares(4 * rate, [1.0, 1.0], client_rate=rate))
+    for n in (a, b):
+        assert 0.9 * 3 * rate < n <= 3 * rate + (64 << 10)
@@ -0,0 +1,102 @@
+import os
+import pytest
+from app import protocol as P
+from app.fileops import map_file
+from transport.netem import run_virtual
+from transport.session import Session, MSS
+from tests.support import Endpoint
+
+
+def frame(mtype, req_id, body):
+    return P.FRAME_HEADER.pack(len(body), mtype, req_id) + body
+
+
+def test_decoder_reassembles_split_frames():
+    data = frame(P.DATA, 1, b"abc") + frame(P.END, 1, b"")
+    decoder = P.FrameDecoder()
+    frames = []
+    for i in range(len(data)):
+        frames += decoder.feed(data[i:i + 1])
+    assert frames == [(P.DATA, 1, b"abc"), (P.END, 1, b"")]
+    assert not decoder.buf
+
+
+def test_decoder_usable_after_protocol_error():
+    decoder = P.FrameDecoder()
+    good = frame(P.DATA, 2, b"xyz")
+    assert decoder.feed(good[:3]) == []
+    with pytest.raises(P.ProtocolError) as failed:
+        decoder.feed(good[3:] + P.FRAME_HEADER.pack(P.MAX_FRAME + 1, P.DATA, 3))
+    # Still out of sync, but the failed feed's traceback (kept alive here)
+    # holds no export of buf that would make the next feed raise BufferError
+    assert failed.value
+    with pytest.raises(P.ProtocolError):
+        decoder.feed(b"\0")
+    decoder.reset()
+    assert decoder.feed(good + good[:4]) == [(P.DATA, 2, b"xyz")]
+    assert decoder.feed(good[4:]) == [(P.DATA, 2, b"xyz")]
+
+
+def test_send_frame_fills_segments():
+    async def main():
+        ep = Endpoint()
+        session = Session(ep, ("127.0.0.1", 9000), 1, pacing=False)
+        P.send_frame(session, P.OK, 1, b"a", b"bc", b"", b"d" * 100)
+        P.send_data(session, 2, 0, bytes(2 * MSS))
+        session.close()
+        return [bytes(payload) for _, payload in ep.sent]
+    packets = run_virtual(main())
+    # One datagram per frame, not one per part; then full segments
+    header = P.FRAME_HEADER_SIZE + P.OFFSET.size
+    assert [len(p) for p in packets] == [P.FRAME_HEADER_SIZE + 103, MSS, MSS, header]
+    assert b"".join(packets) == (P.encode_frame(P.OK, 1, b"abc" + b"d" * 100)
+                                 + P.encode_frame(P.DATA, 2, P.OFFSET.pack(0) + bytes(2 * MSS)))
+
+
+def produce(producer, budget):
+    """Pull producer dry; returns its frames and the buffers it emitted"""
+    bufs = []
+    while True:
+        out = producer.pull(budget)
+        if out is None:
+            break
+        bufs += out
+    return P.FrameDecoder().feed(b"".join(bufs)), bufs
+
+
+def test_file_producer_slices_the_mapping(tmp_path):
+    path = tmp_path / "f.bin"
+    data = os.urandom(3 * P.DATA_FRAME_SIZE + 100)
+    path.write_bytes(data)
+    view = map_file(str(path))
+    done = []
+    producer = P.FileProducer(7, view, on_done=lambda: done.append(1))
+    frames, bufs = produce(producer, 20000)
+    # File bytes go out as views of the mmap, never copied
+    assert sum(1 for b in bufs if isinstance(b, memoryview) and b.obj is view.obj) == 4
+    got = bytearray(len(data))
+    for mtype, req_id, body in frames[:-1]:
+        assert (mtype, req_id) == (P.DATA, 7)
+        pos, = P.OFFSET.unpack_from(body)
+        got[pos:pos + len(body) - P.OFFSET.size] = body[P.OFFSET.size:]
+    assert got == data
+    assert frames[-1] == (P.EOF, 7, P.OFFSET.pack(len(data)))
+    assert done == [1] and producer.view is None
+
+
+def test_file_producer_sends_only_requested_ranges(tmp_path):
+    path = tmp_path / "f.bin"
+    data = os.urandom(50000)
+    path.write_bytes(data)
+    producer = P.FileProducer(1, map_file(str(path)), [(100, 200), (40000, 60000)], eof=False)
+    frames, _ = produce(producer, 5000)
+    pieces = {P.OFFSET.unpack_from(body)[0]: body[P.OFFSET.size:] for _, _, body in frames}
+    assert pieces == {100: data[100:200], 40000: data[40000:]}     # clipped to the file
+    assert all(mtype == P.DATA for mtype, _, _ in frames)
+
+
+def test_cancelled_producer_stops():
+    producer = P.FileProducer(1, memoryview(b"x" * 100000))
+    assert producer.pull(1000)
+    producer.cancel()
+    assert producer.pull(1000) is None
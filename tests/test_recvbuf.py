@@ -0,0 +1,98 @@
+import random
+import pytest
+from transport import recvbuf
+from transport.recvbuf import ReorderRing
+from transport.session import Session, MSS
+
+
+class _Endpoint:
+    """Just enough of GBNTransport for a Session that only receives"""
+    scheduler = None
+
+    def queue_ack(self, session):
+        pass
+
+    def send_raw(self, packet, addr=None):
+        pass
+
+
+# -----------------
+# ReorderRing on its own
+def test_ring_grows_by_doubling_up_to_capacity(monkeypatch):
+    monkeypatch.setattr(recvbuf, "RING_MIN", 1000)
+    ring = ReorderRing(5000)
+    assert ring.allocated == 0
+    ring.write(0, b"a" * 10, 0)
+    assert ring.allocated == 1000
+    ring.write(1500, b"b" * 10, 0)
+    assert ring.allocated == 2000
+    ring.write(4000, b"c" * 1000, 0)
+    assert ring.allocated == 5000
+    assert ring.read(0, 10) == b"a" * 10
+    assert ring.read(1500, 10) == b"b" * 10
+    assert ring.read(4000, 1000) == b"c" * 1000
+    with pytest.raises(ValueError):
+        ring.write(4990, b"d" * 20, 0)
+
+
+def test_ring_growth_keeps_wrapped_bytes(monkeypatch):
+    monkeypatch.setattr(recvbuf, "RING_MIN", 1000)
+    ring = ReorderRing(4000)
+    ring.write(900, bytes(range(200)), 900)    # wraps the 1000-byte ring
+    ring.write(2500, b"x" * 100, 900)          # grows it: the wrapped bytes must move
+    assert ring.allocated == 2000
+    assert ring.read(900, 200) == bytes(range(200))
+    assert ring.read(2500, 100) == b"x" * 100
+
+
+def test_ring_view_stops_at_wrap_point(monkeypatch):
+    monkeypatch.setattr(recvbuf, "RING_MIN", 1000)
+    ring = ReorderRing(1000)
+    ring.write(1950, bytes(range(100)), 1950)
+    first = ring.view(1950, 2050)
+    assert bytes(first) == bytes(range(50))
+    assert bytes(ring.view(2000, 2050)) == bytes(range(50, 100))
+
+
+# -----------------
+# Session.accept over the ring: random order, loss, duplicates and a
+# receiver that pauses, against a sender that keeps within the window
+@pytest.mark.parametrize("seed", range(60))
+def test_accept_delivers_stream_in_order(monkeypatch, seed):
+    r = random.Random(seed)
+    capacity = r.choice([8 * MSS, 50000, 200000])
+    monkeypatch.setattr(recvbuf, "RING_MIN", r.choice([1000, 4096, 65536]))
+    session = Session(_Endpoint(), ("127.0.0.1", 9000), 1, recv_capacity=capacity)
+    data = r.randbytes(r.randrange(1, 400000))
+    segments = []
+    pos = 0
+    while pos < len(data):
+        n = r.choice([MSS, MSS, MSS, r.randrange(1, MSS + 1)])
+        segments.append((pos, data[pos:pos + n]))
+        pos += n
+
+    got = bytearray()
+    def on_receive(chunk):
+        got.extend(chunk)
+        if r.random() < 0.05:
+            session.pause_reading()
+    session.on_receive_cb = on_receive
+
+    pending = segments
+    while len(got) < len(data):
+        window = [seg for seg in pending if seg[0] < session.expected_seq + capacity]
+        r.shuffle(window)
+        for seq, payload in window[:r.randrange(1, 40)]:
+            if r.random() < 0.2:
+                continue                                        # lost
+            session.accept(seq, memoryview(bytearray(payload)))    # buffer reused by the caller
+            if r.random() < 0.1:
+                session.accept(seq, payload)                    # duplicate
+            assert session.recv_ring.allocated <= capacity
+            assert session.recv_buffered <= capacity
+        pending = [seg for seg in pending if seg[0] + len(seg[1]) > session.expected_seq]
+        if session.paused and r.random() < 0.5:
+            session.resume_reading()
+
+    assert bytes(got) == data
+    assert session.recv_buffered == 0 and not session.recv_ranges
@@ -0,0 +1,126 @@
+import asyncio
+import pytest
+from transport.netem import run_virtual
+from transport.rtt import RTOEstimator, CLOCK_G
+from transport.session import Session, MSS
+from transport.timers import Timer, TimerWheel
+from tests.support import Endpoint
+
+
+# -----------------
+# RFC 6298 estimator
+def test_first_and_later_samples():
+    rto = RTOEstimator(min_rto=0.0)
+    rto.sample(0.1)
+    assert rto.srtt == pytest.approx(0.1) and rto.rttvar == pytest.approx(0.05)
+    assert rto.rto == pytest.approx(0.1 + 4 * 0.05)
+    rto.sample(0.2)
+    assert rto.rttvar == pytest.approx(0.75 * 0.05 + 0.25 * 0.1)
+    assert rto.srtt == pytest.approx(0.875 * 0.1 + 0.125 * 0.2)
+    assert rto.rto == pytest.approx(rto.srtt + 4 * rto.rttvar)
+    assert rto.samples == 2
+
+
+def test_rto_clamped_and_granularity():
+    rto = RTOEstimator(min_rto=0.005, max_rto=1.0)
+    for _ in range(50):
+        rto.sample(0.0001)
+    assert rto.rto == 0.005
+    rto = RTOEstimator(min_rto=0.0)
+    for _ in range(50):
+        rto.sample(0.002)           # no variance left: G keeps the RTO above SRTT
+    assert rto.rto == pytest.approx(0.002 + CLOCK_G, rel=0.05)
+
+
+def test_backoff_doubles_until_next_sample():
+    rto = RTOEstimator(initial=0.5, max_rto=3.0)
+    rto.backoff()
+    rto.backoff()
+    assert rto.rto == 2.0 and rto.backoffs == 2
+    rto.backoff()
+    assert rto.rto == 3.0
+    rto.sample(0.01)
+    assert rto.backoffs == 0 and rto.rto < 0.5
+    base = rto.rto
+    rto.backoff()
+    rto.reset_backoff()
+    assert rto.rto == base and rto.backoffs == 0
+
+
+# -----------------
+# Timer wheel
+def test_timer_wheel_order_and_cancel():
+    async def main():
+        loop = asyncio.get_running_loop()
+        wheel = TimerWheel(loop)
+        fired = []
+        timers = {name: Timer(lambda name=name: fired.append((name, round(loop.time(), 3))))
+                  for name in "abcd"}
+        wheel.schedule(timers["c"], 0.030)
+        wheel.schedule(timers["a"], 0.010)
+        wheel.schedule(timers["b"], 0.020)
+        wheel.schedule(timers["d"], 0.015)
+        wheel.cancel(timers["d"])
+        wheel.schedule(timers["b"], 0.005)      # re-armed earlier
+        assert len(wheel) == 3
+        await asyncio.sleep(0.1)
+        assert not any(t.armed for t in timers.values())
+        return fired
+    fired = run_virtual(main())
+    assert [name for name, _ in fired] == ["b", "a", "c"]
+    assert [t for _, t in fired] == pytest.approx([0.006, 0.011, 0.031], abs=0.0015)
+
+
+# -----------------
+# Karn's rule in Session.handle_ack
+def test_no_rtt_sample_from_ack_over_repaired_hole():
+    async def main():
+        ep = Endpoint()
+        s = Session(ep, ("127.0.0.1", 9000), 1, pacing=False)
+        s.send(bytes(5 * MSS))
+        assert len(s.inflight) == 5
+        await asyncio.sleep(0.001)
+        s.handle_ack(MSS)                                # segment 0: a clean 1 ms sample
+        assert s.rto.samples == 1
+        await asyncio.sleep(0.003)                      # within the 5 ms RTO
+        s.handle_ack(MSS, None, [(2 * MSS, 5 * MSS)])    # segment 1 lost, 2-4 SACKed
+        assert s.retransmissions == 1 and s.timeouts == 0
+        await asyncio.sleep(0.001)
+        s.handle_ack(5 * MSS)       # released by the resend: not a 5 ms RTT of segment 4
+        assert s.rto.samples == 1
+        assert s.rto.srtt == pytest.approx(0.001)
+
+        s.send(bytes(MSS))          # sent after the retransmission: valid again
+        await asyncio.sleep(0.001)
+        s.handle_ack(6 * MSS)
+        assert s.rto.samples == 2
+        assert s.rto.srtt == pytest.approx(0.001)
+        s.close()
+    run_virtual(main())
+
+
+def test_no_rtt_sample_for_retransmitted_segment():
+    async def main():
+        ep = Endpoint()
+        s = Session(ep, ("127.0.0.1", 9000), 1, pacing=False)
+        s.send(bytes(MSS))
+        await asyncio.sleep(s.rto.rto + 0.01)           # timeout: resent
+        assert s.timeouts == 1 and s.retransmissions == 1
+        s.handle_ack(MSS)
+        assert s.rto.samples == 0
+        s.close()
+    run_virtual(main())
+
+
+def test_ack_of_retransmission_ends_backoff():
+    async def main():
+        ep = Endpoint()
+        s = Session(ep, ("127.0.0.1", 9000), 1, pacing=False)
+        s.send(bytes(MSS))              # e.g. a lone reply, lost twice
+        await asyncio.sleep(0.5 + 1.0 + 0.01)
+        assert s.timeouts == 2 and s.rto.rto == 2.0
+        s.handle_ack(MSS)
+        # No sample (Karn), but the next loss must not wait 2 s, then 4 s
+        assert s.rto.samples == 0 and s.rto.rto == 0.5
+        s.close()
+    run_virtual(main())
@@ -0,0 +1,57 @@
+import asyncio
+from transport.netem import run_virtual
+from transport.sendbuf import SendQueue
+from transport.session import Session, MSS
+from tests.support import Endpoint
+
+
+def test_take_returns_views_of_the_callers_buffer():
+    data = bytearray(range(256)) * 10
+    q = SendQueue()
+    q.append(data)
+    first = q.take(1000)
+    assert first.obj is data
+    assert len(q) == len(data) - 1000
+    data[0] = 255           # not copied: the caller must not do this
+    assert first[0] == 255
+
+
+def test_take_joins_only_straddling_segments():
+    q = SendQueue()
+    a, b, c = b"a" * 700, b"b" * 700, b"c" * 700
+    for part in (a, b, c):
+        q.append(part)
+    q.append(b"")           # ignored
+    assert bytes(q.take(1000)) == b"a" * 700 + b"b" * 300
+    rest = q.take(400)
+    assert bytes(rest) == b"b" * 400 and rest.obj is b
+    assert q.take(1000).obj is c       # short at the end
+    assert len(q) == 0 and not q.chunks
+
+
+def test_append_casts_multibyte_views():
+    q = SendQueue()
+    q.append(memoryview(bytearray(8)).cast("I"))
+    assert len(q) == 8
+    assert len(q.take(8)) == 8
+
+
+def test_ack_pops_only_the_acked_segments():
+    async def main():
+        ep = Endpoint()
+        session = Session(ep, ("10.0.0.2", 1), 7, pacing=False)
+        data = bytes(range(256)) * (10 * MSS // 256)
+        session.send(data)
+        sent = len(session.inflight)
+        assert sent > 4
+        # In flight segments still point into the data handed to send()
+        assert all(seg.payload.obj is data for seg in session.inflight)
+        session.handle_ack(3 * MSS, 0xffff)
+        assert session.send_base == 3 * MSS
+        assert [seg.seq for seg in session.inflight][:2] == [3 * MSS, 4 * MSS]
+        assert min(session.segments) == 3 * MSS
+        assert len(session.segments) == len(session.inflight)
+        session.handle_ack(session.next_seq, 0xffff)
+        assert not session.inflight and not session.segments
+        ep.timers.close()
+    run_virtual(main())
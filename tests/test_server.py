@@ -0,0 +1,37 @@
+import asyncio
+from app import protocol as P
+from transport.header import FLAGS
+from transport.netem import run_virtual
+from transport.session import Session, ACK_FLAG
+from tests.support import Endpoint
+
+
+def replies(ep):
+    stream = b"".join(bytes(payload) for fields, payload in ep.sent if not fields[FLAGS] & ACK_FLAG)
+    return P.FrameDecoder().feed(stream)
+
+
+def test_malformed_requests_fail_alone(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    from app import ftp_server
+    (tmp_path / "server_files").mkdir(exist_ok=True)
+    (tmp_path / "server_files" / "a.txt").write_bytes(b"a")
+
+    async def main():
+        ep = Endpoint()
+        session = Session(ep, ("127.0.0.1", 9000), 1, pacing=False)
+        ftp_server.accept_session(session)
+        batch = (P.encode_frame(P.MANIFEST, 1, b"\xff\xfe")                   # not UTF-8
+                 + P.encode_frame(P.GET, 2, b"\x00")                          # short NAME
+                 + P.encode_frame(P.PUT, 3, P.NAME.pack(0, 1) + b"\xff")
+                 + P.encode_frame(P.LIST, 4))
+        session.on_receive_cb(memoryview(batch))
+        await asyncio.sleep(0)
+        session.close()
+        return replies(ep)
+
+    frames = run_virtual(main())
+    assert [(mtype, req_id) for mtype, req_id, _ in frames] == \
+        [(P.ERROR, 1), (P.ERROR, 2), (P.ERROR, 3), (P.LISTING, 4)]
+    assert frames[0][2].startswith(b"malformed request")
+    assert frames[3][2] == b"a.txt"
@@ -0,0 +1,65 @@
+import asyncio, os, socket
+from app import protocol as P
+
+
+def test_range_queue_cuts_pieces_in_order():
+    queue = P.RangeQueue([(0, 10), (20, 20), (30, 35)])
+    assert len(queue) == 15
+    assert [queue.take(4) for _ in range(5)] == [(0, 4), (4, 8), (8, 10), (30, 34), (34, 35)]
+    assert not queue and queue.take(4) is None
+
+
+def test_producers_sharing_a_queue_split_the_file():
+    data = os.urandom(10 * P.DATA_FRAME_SIZE)
+    queue = P.RangeQueue([(0, len(data))])
+    producers = [P.FileProducer(i, memoryview(data), queue) for i in range(3)]
+    got = {}
+    while not all(p.finished for p in producers):
+        for p in producers:
+            if not p.finished:
+                for mtype, req_id, body in P.FrameDecoder().feed(b"".join(p.pull(2 * P.DATA_FRAME_SIZE))):
+                    if mtype == P.DATA:
+                        pos, = P.OFFSET.unpack_from(body)
+                        got[pos] = (req_id, body[P.OFFSET.size:])
+    assert b"".join(got[pos][1] for pos in sorted(got)) == data
+    assert {req_id for req_id, _ in got.values()} == {0, 1, 2}
+
+
+# -----------------
+# Striped transfers end to end, over loopback
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def striped_round_trip(src, dst, streams):
+    from app import ftp_server
+    from app.ftp_client import FTPClient
+    from transport.transport import GBNTransport
+    from transport.batchio import create_batched_endpoint
+    port = free_port()
+    server = GBNTransport(port)
+    server.on_session_cb = ftp_server.accept_session
+    endpoint, _ = await create_batched_endpoint(asyncio.get_running_loop(), lambda: server,
+                                                ("127.0.0.1", port))
+    client = FTPClient(("127.0.0.1", port), streams=streams, netem={"loss": 0.0})
+    await client.start()
+    try:
+        await client.put_file(src, "big.bin")
+        await client.get_file("big.bin", dst)
+        return len(client.sessions), len({s.key for s in server.sessions.values()})
+    finally:
+        client.close()
+        endpoint.close()
+
+
+def test_striped_put_and_get(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("server_files", exist_ok=True)
+    data = os.urandom(3 << 20)
+    (tmp_path / "src.bin").write_bytes(data)
+    client_sessions, server_sessions = asyncio.run(striped_round_trip("src.bin", "dst.bin", 3))
+    assert client_sessions == 3 and server_sessions == 3
+    assert (tmp_path / "server_files" / "big.bin").read_bytes() == data
+    assert (tmp_path / "dst.bin").read_bytes() == data
@@ -0,0 +1,76 @@
+import asyncio, os
+from transport.netem import MemoryNetwork, run_virtual
+from transport.transport import GBNTransport
+
+SERVER = ("10.0.0.1", 9000)
+
+
+def network(*clients):
+    net = MemoryNetwork(seed=5)
+    for addr in clients:
+        net.set_profile(addr, SERVER, {"delay_ms": 5, "loss": 0.01})
+        net.set_profile(SERVER, addr, {"delay_ms": 5})
+    server = GBNTransport(SERVER[1])
+    net.endpoint(server, SERVER)
+    received = {}           # session key -> bytearray
+    opened = []
+    def on_session(session):
+        opened.append(session)
+        buf = received[session.key] = bytearray()
+        session.on_receive_cb = buf.extend
+    server.on_session_cb = on_session
+    return net, server, received, opened
+
+
+async def wait_for(cond, timeout=30):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not cond():
+        assert loop.time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_sessions_demultiplexed_by_address_and_conn_id():
+    async def main():
+        a, b = ("10.0.0.2", 5000), ("10.0.0.3", 5000)
+        net, server, received, opened = network(a, b)
+        ca = GBNTransport(a[1], SERVER)
+        net.endpoint(ca, a)
+        cb = GBNTransport(b[1], SERVER)
+        net.endpoint(cb, b)
+        await asyncio.sleep(0)
+        second = ca.open_session(SERVER)
+        # Same conn_id from another host is another session
+        same = cb.open_session(SERVER, conn_id=ca.default_session.conn_id)
+        sent = {}           # the server's key for each session -> what it sent
+        for addr, session in ((a, ca.default_session), (a, second), (b, same)):
+            sent[(addr, session.conn_id)] = data = os.urandom(50000)
+            session.send(data)
+        await wait_for(lambda: len(received) == 3 and
+                       all(len(buf) == 50000 for buf in received.values()))
+        assert len(server.sessions) == 3
+        assert received == sent
+        assert all(not s.active for s in opened)
+    run_virtual(main())
+
+
+def test_forgotten_session_is_reset_and_reopened():
+    async def main():
+        a = ("10.0.0.2", 5000)
+        net, server, received, opened = network(a)
+        client = GBNTransport(a[1], SERVER)
+        net.endpoint(client, a)
+        await asyncio.sleep(0)
+        session = client.default_session
+        first, second = os.urandom(20000), os.urandom(30000)
+        session.send(first)
+        await wait_for(lambda: len(received.get((a, session.conn_id), b"")) == len(first))
+        old_id = session.conn_id
+        await wait_for(lambda: session.synced)
+        server.close_session(opened[0])      # e.g. reaped while idle
+        session.send(second)                 # mid-stream data: answered with RST
+        await wait_for(lambda: len(opened) == 2 and len(received[opened[1].key]) == len(second))
+        assert session.conn_id != old_id
+        assert received[opened[1].key] == second
+        assert list(server.sessions) == [opened[1].key]
+    run_virtual(main())
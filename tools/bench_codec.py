@@ -0,0 +1,98 @@
+"""Packet codec microbenchmark: packets/sec of the original header.py
+codec versus the Struct/pack_into/incremental-CRC codec.
+
+    python -m tools.bench_codec [payload_bytes] [packets]
+"""
+import os, struct, sys, time, zlib
+from transport import header
+
+# -----------------
+# The codec as it was before the Struct rewrite, kept here for comparison
+LEGACY_FMT = "!BBHIIHHI"
+
+def legacy_pack_header(ver, flags, conn_id, seq, ack, win, length, checksum=0):
+    return struct.pack(LEGACY_FMT, ver, flags, conn_id, seq, ack, win, length, checksum)
+
+def legacy_make_packet(ver, flags, conn_id, seq, ack, win, payload):
+    length = len(payload)
+    h0 = legacy_pack_header(ver, flags, conn_id, seq, ack, win, length, 0)
+    chk = zlib.crc32(h0 + payload) & 0xffffffff
+    return legacy_pack_header(ver, flags, conn_id, seq, ack, win, length, chk) + payload
+
+def legacy_unpack_packet(packet):
+    hdr, payload = packet[:20], packet[20:]
+    ver, flags, conn_id, seq, ack, win, length, chk = struct.unpack(LEGACY_FMT, hdr)
+    h0 = legacy_pack_header(ver, flags, conn_id, seq, ack, win, length, 0)
+    if zlib.crc32(h0 + payload) & 0xffffffff != chk:
+        raise ValueError("Checksum mismatch")
+    return dict(ver=ver, flags=flags, conn_id=conn_id, seq=seq, ack=ack,
+                win=win, length=length, checksum=chk), payload
+
+# -----------------
+def rate(fn, n, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return n / best
+
+def main(payload_size=1200, n=100_000, window=64):
+    data = os.urandom(payload_size * window)
+    payloads = [memoryview(data)[i*payload_size:(i+1)*payload_size] for i in range(window)]
+    legacy_payloads = [bytes(p) for p in payloads]
+    rounds = n // window
+
+    def legacy_encode():
+        for r in range(rounds):
+            for i, p in enumerate(legacy_payloads):
+                legacy_make_packet(1, 0, 1, i * payload_size, 0, 4096, p)
+
+    def new_encode():
+        for r in range(rounds):
+            for i, p in enumerate(payloads):
+                header.make_packet(1, 0, 1, i * payload_size, 0, 4096, p)
+
+    def into_encode():
+        buf = bytearray((header.HEADER_SIZE + payload_size) * window)
+        for r in range(rounds):
+            offset = 0
+            for i, p in enumerate(payloads):
+                offset += header.encode_into(buf, offset, 1, 0, 1, i * payload_size, 0, 4096, p)
+
+    def batch_encode():
+        segs = [(i * payload_size, p) for i, p in enumerate(payloads)]
+        for r in range(rounds):
+            header.encode_batch(1, 0, 1, 0, 4096, segs)
+
+    legacy_pkts = [legacy_make_packet(1, 0, 1, i, 0, 4096, p) for i, p in enumerate(legacy_payloads)]
+    new_pkts = [bytes(header.make_packet(1, 0, 1, i, 0, 4096, p)) for i, p in enumerate(payloads)]
+    assert legacy_pkts == new_pkts, "codecs disagree on the wire format"
+
+    def legacy_decode():
+        for r in range(rounds):
+            for pkt in legacy_pkts:
+                legacy_unpack_packet(pkt)
+
+    def new_decode():
+        for r in range(rounds):
+            for pkt in new_pkts:
+                header.decode(pkt)
+
+    total = rounds * window
+    results = {
+        "encode legacy": rate(legacy_encode, total),
+        "encode new": rate(new_encode, total),
+        "encode_into": rate(into_encode, total),
+        "encode batch": rate(batch_encode, total),
+        "decode legacy": rate(legacy_decode, total),
+        "decode new": rate(new_decode, total),
+    }
+    print(f"payload={payload_size}B packets={total}")
+    for name, pps in results.items():
+        print(f"  {name:<14} {pps:>12,.0f} pkt/s")
+    return results
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    main(*args)
@@ -1,14 +1,131 @@
-import statistics
-import time
+import json, os, tempfile, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
+try:
+    import numpy as np
+except ImportError:      # optional: plain lists work the same, just slower to merge
+    np = None
+
+# -----------------
+# Log-bucketed histogram (HDR style). Values are recorded in microseconds
+# with SUB_BITS bits of precision: values below 2 * 2**SUB_BITS get a
+# bucket each, above that every power of two is split into 2**SUB_BITS
+# buckets, i.e. at most ~3% relative error from 1 µs up to MAX_BITS.
+SUB_BITS = 5
+SUB_COUNT = 1 << SUB_BITS
+MAX_BITS = 36            # 2**36 µs, about 19 hours; larger values are clamped
+BUCKETS = (MAX_BITS - SUB_BITS + 1) * SUB_COUNT
+UNIT = 1000              # histogram units per millisecond
+
+def bucket_index(v):
+    if v < 2 * SUB_COUNT:
+        return v
+    shift = v.bit_length() - SUB_BITS - 1
+    return shift * SUB_COUNT + (v >> shift)
+
+def bucket_value(i):
+    """Midpoint of bucket i, in histogram units"""
+    shift = max(0, i // SUB_COUNT - 1)
+    return ((i - shift * SUB_COUNT) << shift) + ((1 << shift) - 1) / 2
+
+
+class Histogram:
+    """Fixed-memory latency histogram of millisecond values. record() is
+    O(1) and percentiles walk the BUCKETS counters, however many values
+    were recorded."""
+    def __init__(self):
+        self.counts = np.zeros(BUCKETS, np.int64) if np is not None else [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, value_ms, n=1):
+        v = min(max(0, int(value_ms * UNIT)), (1 << MAX_BITS) - 1)
+        self.counts[bucket_index(v)] += n
+        self.count += n
+        self.total += value_ms * n
+        if self.min is None or value_ms < self.min:
+            self.min = value_ms
+        if self.max is None or value_ms > self.max:
+            self.max = value_ms
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, q):
+        """Value at or below which q percent of the recordings fall"""
+        if not self.count:
+            return 0
+        rank = max(1, -(-self.count * q // 100))
+        if np is not None:
+            i = int(np.searchsorted(np.cumsum(self.counts), rank))
+        else:
+            seen = 0
+            for i, c in enumerate(self.counts):
+                seen += c
+                if seen >= rank:
+                    break
+        # Never report beyond what was actually seen
+        return min(max(bucket_value(i) / UNIT, self.min), self.max)
+
+    def merge(self, other):
+        if np is not None:
+            self.counts += np.asarray(other.counts, np.int64)
+        else:
+            self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        for v in (other.min, other.max):
+            if v is not None:
+                self.min = v if self.min is None else min(self.min, v)
+                self.max = v if self.max is None else max(self.max, v)
+
+    def snapshot(self):
+        """Picklable/JSON state holding only the non-empty buckets"""
+        return {"buckets": {int(i): int(c) for i, c in enumerate(self.counts) if c},
+                "count": self.count, "total": self.total, "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_snapshot(cls, snap):
+        h = cls()
+        for i, c in snap["buckets"].items():
+            h.counts[int(i)] = c
+        h.count, h.total, h.min, h.max = snap["count"], snap["total"], snap["min"], snap["max"]
+        return h
+
+    def summary(self):
+        return {"count": self.count, "mean": self.mean, "p50": self.percentile(50),
+                "p95": self.percentile(95), "p99": self.percentile(99), "max": self.max or 0}
+
+
+# -----------------
 class Metrics:
+    """Transfer latencies, per-chunk delivery delays and RTTs as histograms,
+    plus the packet counters of every attached transport endpoint."""
     def __init__(self):
-        self.delays = []
+        self.delays = Histogram()          # per transfer
+        self.chunk_delays = Histogram()    # gap before each chunk was delivered
+        self.rtt = Histogram()
         self.bytes_sent = 0
-        self.retransmissions = 0
+        self.retransmissions = 0           # recorded by hand, on top of the transports'
+        self.transports = []
+        self.started = time.monotonic()
+        self.merged_counters = {}          # transport counters of merged snapshots
+        self.merged_sessions = []
+        self.merged_uptime = None
+
+    def attach(self, transport):
+        """Take packet counters, cwnd and RTT samples from a GBNTransport"""
+        transport.on_rtt_cb = lambda rtt: self.rtt.record(rtt * 1000)
+        self.transports.append(transport)
 
     def record_delay(self, delay_ms):
-        self.delays.append(delay_ms)
+        self.delays.record(delay_ms)
+
+    def record_chunk_delay(self, delay_ms):
+        self.chunk_delays.record(delay_ms)
 
     def record_bytes(self, n):
         self.bytes_sent += n
@@ -16,14 +133,145 @@ class Metrics:
     def record_retransmission(self, n=1):
         self.retransmissions += n
 
+    # -----------------
+    def counters(self):
+        totals = dict(self.merged_counters)
+        for t in self.transports:
+            for name, value in t.counters().items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def sessions(self):
+        out = list(self.merged_sessions)
+        for t in self.transports:
+            for (addr, cid), s in t.sessions.items():
+                out.append({"peer": f"{addr[0]}:{addr[1]}", "conn_id": cid,
+                            "cwnd": s.cwnd, **s.counters()})
+        return out
+
+    def uptime(self):
+        return self.merged_uptime if self.merged_uptime is not None else time.monotonic() - self.started
+
+    def snapshot(self):
+        """Picklable state, e.g. to send from a worker process"""
+        return {"delays": self.delays.snapshot(), "chunk_delays": self.chunk_delays.snapshot(),
+                "rtt": self.rtt.snapshot(), "bytes_sent": self.bytes_sent,
+                "retransmissions": self.retransmissions, "uptime": self.uptime(),
+                "counters": self.counters(), "sessions": self.sessions()}
+
+    @classmethod
+    def merged(cls, snapshots):
+        """Metrics combining several snapshots (one per worker)"""
+        m = cls()
+        m.merged_uptime = 0
+        for snap in snapshots:
+            for name in ("delays", "chunk_delays", "rtt"):
+                getattr(m, name).merge(Histogram.from_snapshot(snap[name]))
+            m.bytes_sent += snap["bytes_sent"]
+            m.retransmissions += snap["retransmissions"]
+            for name, value in snap["counters"].items():
+                m.merged_counters[name] = m.merged_counters.get(name, 0) + value
+            m.merged_sessions.extend(snap["sessions"])
+            m.merged_uptime = max(m.merged_uptime, snap["uptime"])
+        return m
+
     def report(self):
-        if not self.delays:
-            p95 = 0
-        else:
-            p95 = statistics.quantiles(self.delays, n=100)[94]
+        counters = self.counters()
+        sessions = self.sessions()
+        uptime = self.uptime()
         return {
             "total_bytes": self.bytes_sent,
-            "retransmissions": self.retransmissions,
-            "avg_latency_ms": statistics.mean(self.delays) if self.delays else 0,
-            "p95_latency_ms": p95
+            "retransmissions": self.retransmissions + counters.get("retransmissions", 0),
+            "avg_latency_ms": self.delays.mean,
+            "p95_latency_ms": self.delays.percentile(95),
+            "avg_chunk_delay_ms": self.chunk_delays.mean,
+            "p95_chunk_delay_ms": self.chunk_delays.percentile(95),
+            "avg_rtt_ms": self.rtt.mean,
+            "p95_rtt_ms": self.rtt.percentile(95),
+            "packets_sent": counters.get("packets_sent", 0),
+            "packets_received": counters.get("packets_received", 0),
+            "fast_retransmits": counters.get("fast_retransmits", 0),
+            "timeouts": counters.get("timeouts", 0),
+            "window_probes": counters.get("window_probes", 0),
+            "fec_recovered": counters.get("fec_recovered", 0),
+            "fec_parity_sent": counters.get("fec_parity_sent", 0),
+            "checksum_drops": counters.get("checksum_drops", 0),
+            "send_errors": counters.get("send_errors", 0),
+            "rtt_samples": counters.get("rtt_samples", 0),
+            "sessions": len(sessions),
+            "cwnd_bytes": sum(s["cwnd"] for s in sessions),
+            "goodput_Bps": counters.get("bytes_delivered", 0) / uptime if uptime else 0,
         }
+
+    # -----------------
+    # Export
+    def to_json(self):
+        return json.dumps({"report": self.report(), "delays_ms": self.delays.summary(),
+                           "chunk_delays_ms": self.chunk_delays.summary(),
+                           "rtt_ms": self.rtt.summary(), "sessions": self.sessions()})
+
+    def to_prometheus(self, prefix="miniftp"):
+        lines = []
+        report = self.report()
+        for name, value in report.items():
+            if name.startswith(("avg_", "p95_")):
+                continue      # exported as summaries below
+            kind = "gauge" if name in ("sessions", "cwnd_bytes", "goodput_Bps") else "counter"
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            lines.append(f"{prefix}_{name} {value}")
+        for name, hist in (("transfer_ms", self.delays), ("chunk_delay_ms", self.chunk_delays),
+                           ("rtt_ms", self.rtt)):
+            lines.append(f"# TYPE {prefix}_{name} summary")
+            for q in (50, 95, 99):
+                lines.append(f'{prefix}_{name}{{quantile="{q / 100}"}} {hist.percentile(q)}')
+            lines.append(f"{prefix}_{name}_sum {hist.total}")
+            lines.append(f"{prefix}_{name}_count {hist.count}")
+        for s in self.sessions():
+            labels = f'peer="{s["peer"]}",conn_id="{s["conn_id"]}"'
+            for name in ("cwnd", "packets_sent", "packets_received", "retransmissions", "timeouts"):
+                lines.append(f"{prefix}_session_{name}{{{labels}}} {s[name]}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, fmt):
+        return self.to_json() if fmt == "json" else self.to_prometheus()
+
+
+def write_metrics(metrics, path):
+    """Atomically (re)write path with JSON if it ends in .json, else Prometheus text"""
+    data = metrics.export("json" if path.endswith(".json") else "prom")
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".metrics")
+    with os.fdopen(fd, "w") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+def serve_metrics(source, port, host="127.0.0.1", loop=None):
+    """Serve source() (a Metrics) over HTTP from a daemon thread: JSON for
+    paths ending in .json, Prometheus text otherwise. With loop, source runs
+    on that event loop's thread so it reads live transport state safely.
+    Returns the HTTP server; shutdown() stops it."""
+    def collect(fmt):
+        if loop is None:
+            return source().export(fmt)
+        import asyncio
+        async def on_loop():
+            return source().export(fmt)
+        return asyncio.run_coroutine_threadsafe(on_loop(), loop).result(timeout=5)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            fmt = "json" if self.path.endswith(".json") else "prom"
+            body = collect(fmt).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json" if fmt == "json"
+                             else "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,305 @@
+import asyncio, ctypes, ctypes.util, errno, socket, struct, sys
+
+BATCH_SIZE = 64          # datagrams per sendmmsg/recvmmsg call
+RECV_BUF_SIZE = 4096     # per-datagram receive buffer; our packets are MSS + header
+SOCK_BUF_BYTES = 4 << 20
+ADDR_CACHE_SIZE = 1024   # peers whose sockaddr is kept; the caches are cleared when full
+
+# -----------------
+# sendmmsg/recvmmsg through ctypes (Linux only)
+
+class _iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+class _msghdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(_iovec)), ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+class _mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _msghdr), ("msg_len", ctypes.c_uint)]
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr), ctypes.c_uint, ctypes.c_int]
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_mmsghdr), ctypes.c_uint,
+                                  ctypes.c_int, ctypes.c_void_p]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+_libc = _load_libc()
+HAVE_MMSG = _libc is not None
+_MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0x40)
+_SOCKADDR_IN = struct.Struct("=H2s4s8x")   # family (host order), port, addr (network order)
+_SOCKADDR_STORAGE = 128
+
+
+class MMsgIO:
+    """Preallocated mmsghdr arrays for batched IPv4 send/receive on one socket"""
+    def __init__(self, fd, batch=BATCH_SIZE):
+        self.fd = fd
+        self.batch = batch
+        self._addr_cache = {}      # (host, port) -> sockaddr_in buffer
+
+        self.send_msgs = (_mmsghdr * batch)()
+        self.send_iov = (_iovec * batch)()
+        for i in range(batch):
+            self.send_msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.send_iov[i])
+            self.send_msgs[i].msg_hdr.msg_iovlen = 1
+
+        self.recv_msgs = (_mmsghdr * batch)()
+        self.recv_iov = (_iovec * batch)()
+        self.recv_bufs = [ctypes.create_string_buffer(RECV_BUF_SIZE) for _ in range(batch)]
+        self.recv_names = [ctypes.create_string_buffer(_SOCKADDR_STORAGE) for _ in range(batch)]
+        self._peer_cache = {}      # raw sockaddr bytes -> (host, port)
+        self._recv_addrs = [ctypes.addressof(b) for b in self.recv_bufs]
+        self._name_addrs = [ctypes.addressof(b) for b in self.recv_names]
+        for i in range(batch):
+            self.recv_iov[i].iov_base = ctypes.addressof(self.recv_bufs[i])
+            self.recv_iov[i].iov_len = RECV_BUF_SIZE
+            hdr = self.recv_msgs[i].msg_hdr
+            hdr.msg_iov = ctypes.pointer(self.recv_iov[i])
+            hdr.msg_iovlen = 1
+            hdr.msg_name = ctypes.addressof(self.recv_names[i])
+
+    def _sockaddr(self, addr):
+        """sockaddr_in of a numeric IPv4 (host, port); callers resolve names first"""
+        buf = self._addr_cache.get(addr)
+        if buf is None:
+            host, port = addr[0], addr[1]
+            raw = _SOCKADDR_IN.pack(socket.AF_INET, struct.pack("!H", port), socket.inet_aton(host))
+            if len(self._addr_cache) >= ADDR_CACHE_SIZE:
+                self._addr_cache.clear()
+            buf = self._addr_cache[addr] = ctypes.create_string_buffer(raw, len(raw))
+        return buf
+
+    def send(self, items):
+        """Send up to batch (data, addr) pairs; returns how many went out.
+
+        Raises BlockingIOError if none could be sent, OSError on other errors.
+        """
+        n = min(len(items), self.batch)
+        keep = []    # the buffers (and their exports) must outlive the syscall
+        for i in range(n):
+            data, addr = items[i]
+            if not isinstance(data, bytes):
+                # Point the iovec into a writable buffer in place; only
+                # read-only views of other objects are copied
+                try:
+                    ref = (ctypes.c_char * len(data)).from_buffer(data)
+                except TypeError:
+                    data = bytes(data)
+                else:
+                    keep.append(ref)
+                    self.send_iov[i].iov_base = ctypes.addressof(ref)
+            if isinstance(data, bytes):
+                keep.append(data)
+                self.send_iov[i].iov_base = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p)
+            self.send_iov[i].iov_len = len(data)
+            name = self._sockaddr(addr)
+            hdr = self.send_msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(name)
+            hdr.msg_namelen = len(name)
+        sent = _libc.sendmmsg(self.fd, self.send_msgs, n, 0)
+        if sent < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise BlockingIOError(err, "sendmmsg would block")
+            raise OSError(err, "sendmmsg: " + errno.errorcode.get(err, str(err)))
+        return sent
+
+    def recv(self):
+        """Drain up to batch datagrams as [(bytes, addr)]; [] when nothing is queued"""
+        for i in range(self.batch):
+            self.recv_msgs[i].msg_hdr.msg_namelen = _SOCKADDR_STORAGE
+        n = _libc.recvmmsg(self.fd, self.recv_msgs, self.batch, _MSG_DONTWAIT, None)
+        if n < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []
+            raise OSError(err, "recvmmsg: " + errno.errorcode.get(err, str(err)))
+        out = []
+        string_at = ctypes.string_at
+        for i in range(n):
+            raw = string_at(self._name_addrs[i], _SOCKADDR_IN.size)
+            addr = self._peer_cache.get(raw)
+            if addr is None:
+                _, port, host = _SOCKADDR_IN.unpack(raw)
+                if len(self._peer_cache) >= ADDR_CACHE_SIZE:
+                    self._peer_cache.clear()
+                addr = self._peer_cache[raw] = (socket.inet_ntoa(host), struct.unpack("!H", port)[0])
+            out.append((string_at(self._recv_addrs[i], self.recv_msgs[i].msg_len), addr))
+        return out
+
+
+# -----------------
+class BatchedDatagramTransport(asyncio.DatagramTransport):
+    """Datagram transport that batches syscalls per event-loop iteration.
+
+    sendto() only queues; everything queued during one loop iteration is
+    flushed by a single call_soon callback (sendmmsg on Linux, a sendto
+    loop elsewhere). Each read wakeup drains up to BATCH_SIZE datagrams and
+    hands them to protocol.datagrams_received() when the protocol has it.
+    waiter, if given, is resolved once connection_made() has been called.
+    """
+    def __init__(self, loop, sock, protocol, batch=BATCH_SIZE, waiter=None):
+        super().__init__(extra={"socket": sock, "sockname": sock.getsockname()})
+        self._loop = loop
+        self._sock = sock
+        self._fd = sock.fileno()
+        self._protocol = protocol
+        self._batch = batch
+        self._queue = []
+        self._flush_scheduled = False
+        self._writer_armed = False
+        self._closing = False
+        self._mmsg = MMsgIO(self._fd, batch) if HAVE_MMSG and sock.family == socket.AF_INET else None
+        self.syscalls = 0
+        loop.add_reader(self._fd, self._read_ready)
+        loop.call_soon(protocol.connection_made, self)
+        if waiter is not None:
+            loop.call_soon(_set_result_unless_cancelled, waiter, None)
+
+    # -----------------
+    def sendto(self, data, addr=None):
+        if self._closing:
+            return
+        self._queue.append((data, addr))
+        if not self._flush_scheduled and not self._writer_armed:
+            self._flush_scheduled = True
+            self._loop.call_soon(self._flush)
+
+    def get_write_buffer_size(self):
+        return sum(len(d) for d, _ in self._queue)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        queue = self._queue
+        sent = 0
+        try:
+            while sent < len(queue):
+                if self._mmsg is not None:
+                    sent += self._mmsg.send(queue[sent:sent + self._batch])
+                else:
+                    data, addr = queue[sent]
+                    self._sock.sendto(data, addr)
+                    sent += 1
+                self.syscalls += 1
+        except BlockingIOError:
+            # Socket buffer full: resume when it drains instead of dropping
+            if not self._writer_armed:
+                self._writer_armed = True
+                self._loop.add_writer(self._fd, self._on_writable)
+        except OSError as exc:
+            # Skip the datagram that failed, telling the protocol which one it was
+            data, addr = queue[sent]
+            sent += 1
+            handler = getattr(self._protocol, "send_failed", None)
+            if handler is not None:
+                handler(data, addr, exc)
+            else:
+                self._protocol.error_received(exc)
+            if sent < len(queue) and not self._flush_scheduled:
+                self._flush_scheduled = True
+                self._loop.call_soon(self._flush)
+        del queue[:sent]
+
+    def _on_writable(self):
+        self._loop.remove_writer(self._fd)
+        self._writer_armed = False
+        self._flush()
+
+    def _read_ready(self):
+        try:
+            if self._mmsg is not None:
+                batch = self._mmsg.recv()
+                self.syscalls += 1
+            else:
+                batch = []
+                while len(batch) < self._batch:
+                    try:
+                        batch.append(self._sock.recvfrom(RECV_BUF_SIZE))
+                    except BlockingIOError:
+                        break
+                    finally:
+                        self.syscalls += 1
+        except OSError as exc:
+            self._protocol.error_received(exc)
+            return
+        if not batch:
+            return
+        handler = getattr(self._protocol, "datagrams_received", None)
+        if handler is not None:
+            handler(batch)
+        else:
+            for data, addr in batch:
+                self._protocol.datagram_received(data, addr)
+
+    # -----------------
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        self._loop.remove_reader(self._fd)
+        if self._writer_armed:
+            self._loop.remove_writer(self._fd)
+        if self._queue:
+            self._flush()
+        self._sock.close()
+        self._loop.call_soon(self._protocol.connection_lost, None)
+
+    def abort(self):
+        self._queue.clear()
+        self.close()
+
+
+def _set_result_unless_cancelled(fut, result):
+    if not fut.cancelled():
+        fut.set_result(result)
+
+
+async def create_batched_endpoint(loop, protocol_factory, local_addr, batch=BATCH_SIZE,
+                                  reuse_port=False):
+    """Like loop.create_datagram_endpoint, but returns a BatchedDatagramTransport.
+
+    Falls back to the stock asyncio endpoint on loops without add_reader
+    (e.g. the Windows proactor loop). reuse_port sets SO_REUSEPORT so
+    several processes can share local_addr.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.setblocking(False)
+        if reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        for opt in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, opt, SOCK_BUF_BYTES)
+            except OSError:
+                pass
+        sock.bind(local_addr)
+        protocol = protocol_factory()
+        waiter = loop.create_future()
+        try:
+            transport = BatchedDatagramTransport(loop, sock, protocol, batch, waiter)
+        except NotImplementedError:
+            sock.close()
+            return await loop.create_datagram_endpoint(lambda: protocol, local_addr=local_addr,
+                                                       reuse_port=reuse_port or None)
+    except BaseException:
+        sock.close()
+        raise
+    # As with loop.create_datagram_endpoint, the protocol is connected on return
+    try:
+        await waiter
+    except BaseException:
+        transport.close()
+        raise
+    return transport, protocol
@@ -0,0 +1,101 @@
+INITIAL_WINDOW = 10     # segments (RFC 6928)
+MIN_WINDOW = 2          # segments
+MAX_WINDOW = 64 << 20   # bytes
+
+
+class CongestionController:
+    """Congestion window policy for one session; all sizes are in bytes.
+
+    Sessions call on_ack() for every ACK that advances send_base,
+    on_loss() once per window when fast retransmit detects a loss, and
+    on_timeout() when the retransmission timer fires.
+    """
+    name = "base"
+
+    def __init__(self, mss, max_window=MAX_WINDOW):
+        self.mss = mss
+        self.max_window = max_window
+        self.cwnd = INITIAL_WINDOW * mss
+        self.ssthresh = max_window
+
+    @property
+    def in_slow_start(self):
+        return self.cwnd < self.ssthresh
+
+    def on_ack(self, acked_bytes, rtt=None):
+        pass
+
+    def on_loss(self, bytes_in_flight):
+        pass
+
+    def on_timeout(self, bytes_in_flight):
+        pass
+
+    def _clamp(self):
+        self.cwnd = max(MIN_WINDOW * self.mss, min(self.cwnd, self.max_window))
+
+
+class Reno(CongestionController):
+    """Slow start plus additive increase / multiplicative decrease"""
+    name = "reno"
+
+    def on_ack(self, acked_bytes, rtt=None):
+        if self.in_slow_start:
+            # Byte counting without the L=1 cap: receivers coalesce ACKs per
+            # receive batch, so one ACK can cover many segments
+            self.cwnd += acked_bytes
+        else:
+            self.cwnd += max(1, self.mss * acked_bytes // self.cwnd)
+        self._clamp()
+
+    def on_loss(self, bytes_in_flight):
+        self.ssthresh = max(bytes_in_flight // 2, MIN_WINDOW * self.mss)
+        self.cwnd = self.ssthresh
+        self._clamp()
+
+    def on_timeout(self, bytes_in_flight):
+        self.ssthresh = max(bytes_in_flight // 2, MIN_WINDOW * self.mss)
+        self.cwnd = self.mss     # loss window
+
+
+class Vegas(Reno):
+    """Delay-based variant: keeps between alpha and beta segments queued
+    at the bottleneck, judged from the gap between base RTT and current
+    RTT. Loss handling falls back to Reno."""
+    name = "vegas"
+    alpha = 2
+    beta = 4
+
+    def __init__(self, mss, max_window=MAX_WINDOW):
+        super().__init__(mss, max_window)
+        self.base_rtt = None
+        self.last_rtt = None
+        self.acked_in_round = 0
+
+    def on_ack(self, acked_bytes, rtt=None):
+        if rtt is not None:
+            self.last_rtt = rtt
+            self.base_rtt = rtt if self.base_rtt is None else min(self.base_rtt, rtt)
+        if self.in_slow_start or self.last_rtt is None:
+            super().on_ack(acked_bytes, rtt)
+            return
+        # Adjust once per round trip (one cwnd worth of ACKed bytes)
+        self.acked_in_round += acked_bytes
+        if self.acked_in_round < self.cwnd:
+            return
+        self.acked_in_round = 0
+        queued = self.cwnd / self.mss * (1 - self.base_rtt / self.last_rtt)
+        if queued < self.alpha:
+            self.cwnd += self.mss
+        elif queued > self.beta:
+            self.cwnd -= self.mss
+        self._clamp()
+
+
+CONTROLLERS = {cls.name: cls for cls in (Reno, Vegas)}
+
+def make_controller(cc, mss, max_window=MAX_WINDOW):
+    """cc may be a registered name, a CongestionController subclass or a factory"""
+    if isinstance(cc, str):
+        cc = CONTROLLERS[cc]
+    return cc(mss, max_window)
@@ -0,0 +1,224 @@
+import struct
+from bisect import bisect_right
+
+try:
+    import numpy as np
+except ImportError:      # optional: big-int XOR is slower but gives the same bytes
+    np = None
+
+# -----------------
+# XOR parity over groups of K consecutive data segments. The parity packet
+# (FEC_FLAG, seq = first byte of the group) carries the segment lengths
+# and the XOR of the payloads zero-padded to the longest, so a receiver
+# holding all but one segment of the group rebuilds the missing one
+# without waiting for a retransmission.
+PARITY_INFO = struct.Struct("!B")   # number of segments; then one "!H" length each, then the XOR
+K_MIN = 4
+K_MAX = 32
+K_INIT = 16
+TARGET = 0.25          # K ~ TARGET / loss rate: about 3% of groups lose two segments
+LOSS_INTERVAL = 128    # segments sent between loss rate updates
+LOSS_GAIN = 0.25       # EWMA gain of the loss rate
+PENDING_MAX = 32       # parities kept while their group still misses two or more segments
+REBUILT_MAX = 64       # rebuilt seqs remembered to spot originals that were only late
+
+
+class XorAccumulator:
+    """XOR of byte strings, zero-padded to size"""
+    __slots__ = ("acc",)
+
+    def __init__(self, size):
+        self.acc = np.zeros(size, np.uint8) if np is not None else 0
+
+    def add(self, data):
+        if np is not None:
+            self.acc[:len(data)] ^= np.frombuffer(data, np.uint8)
+        else:
+            # Little-endian keeps byte i at bit 8*i, so shorter inputs pad with zeros
+            self.acc ^= int.from_bytes(data, "little")
+
+    def value(self, n):
+        if np is not None:
+            return self.acc[:n].tobytes()
+        return (self.acc & ((1 << 8 * n) - 1)).to_bytes(n, "little")
+
+
+def encode_parity(lengths, xor):
+    return PARITY_INFO.pack(len(lengths)) + struct.pack(f"!{len(lengths)}H", *lengths) + xor
+
+def decode_parity(payload):
+    """(lengths, xor bytes) of a parity payload"""
+    n, = PARITY_INFO.unpack_from(payload)
+    lengths = struct.unpack_from(f"!{n}H", payload, PARITY_INFO.size)
+    return lengths, bytes(payload[PARITY_INFO.size + 2 * n:])
+
+
+class FecEncoder:
+    """Sender side: groups new segments and adapts K to the loss rate.
+
+    Losses are the segments the session had to retransmit plus the ones
+    the peer reports it rebuilt from parity (echoed in its ACKs), so
+    repairs do not hide the loss that K must cover. The peer takes back
+    rebuilds whose original turned up later: those were reordered.
+    """
+    def __init__(self, mss, k=K_INIT):
+        self.mss = mss
+        self.k = k
+        self.loss_rate = None
+        self.start = None          # first seq of the open group
+        self.lengths = []
+        self.acc = None
+        self.starts = []           # groups whose parity was sent and are not ACKed yet
+        self.ends = []
+        self.parity_sent = 0
+        self.peer_repaired = 0     # last repair count the peer reported
+        self._sent = 0
+        self._lost = 0
+
+    def add(self, seq, payload):
+        """Add a new segment; returns a parity payload when the group is full"""
+        if self.start is None:
+            self.start = seq
+            self.lengths = []
+            self.acc = XorAccumulator(self.mss)
+        self.acc.add(payload)
+        self.lengths.append(len(payload))
+        self._sent += 1
+        if len(self.lengths) >= self.k:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """Parity of the open group, if there is one (e.g. at the tail of a burst)"""
+        if self.start is None:
+            return None
+        lengths = self.lengths
+        start, self.start = self.start, None
+        self.starts.append(start)
+        self.ends.append(start + sum(lengths))
+        self.parity_sent += 1
+        return start, encode_parity(lengths, self.acc.value(max(lengths)))
+
+    def protected_end(self, seq):
+        """End of the group seq belongs to, when that group's parity was sent"""
+        i = bisect_right(self.starts, seq) - 1
+        if i >= 0 and self.ends[i] > seq:
+            return self.ends[i]
+        return None
+
+    def on_ack(self, ack):
+        n = bisect_right(self.ends, ack)
+        if n:
+            del self.starts[:n], self.ends[:n]
+
+    def on_peer_repaired(self, count):
+        # Signed 32-bit difference: the count may go down, and ACKs arrive out of order
+        delta = ((count - self.peer_repaired + 0x80000000) & 0xffffffff) - 0x80000000
+        self.peer_repaired = count
+        self._lost += delta
+
+    def on_lost(self, n=1):
+        self._lost += n
+
+    def adapt(self):
+        if self._sent < LOSS_INTERVAL:
+            return
+        rate = min(1.0, self._lost / self._sent)
+        self._sent = self._lost = 0
+        self.loss_rate = rate if self.loss_rate is None else \
+            (1 - LOSS_GAIN) * self.loss_rate + LOSS_GAIN * rate
+        self.k = K_MAX if self.loss_rate <= 0 else \
+            max(K_MIN, min(K_MAX, int(TARGET / self.loss_rate)))
+
+
+class FecDecoder:
+    """Receiver side: keeps the most recently delivered bytes (a group may
+    straddle the delivery point) and parities that cannot be used yet
+    because their group misses two or more segments."""
+    def __init__(self, mss):
+        self.horizon = K_MAX * mss
+        self.tail = bytearray()    # delivered bytes from tail_start on, at least horizon of them
+        self.tail_start = 0
+        self.pending = {}          # group start -> (lengths, xor)
+        self.rebuilt = {}          # recently rebuilt seq -> None, oldest first (an ordered set)
+        self.recovered = 0
+        self.late = 0              # rebuilt segments whose original arrived afterwards
+        self.useless = 0           # parities whose group was already complete
+
+    def on_delivered(self, seq, data):
+        tail, horizon = self.tail, self.horizon
+        if len(data) >= horizon or seq != self.tail_start + len(tail):
+            keep = min(len(data), horizon)
+            self.tail = bytearray(data[len(data) - keep:])
+            self.tail_start = seq + len(data) - keep
+            return
+        tail += data
+        if len(tail) > 2 * horizon:     # trimmed in steps, not per segment
+            excess = len(tail) - horizon
+            del tail[:excess]
+            self.tail_start += excess
+
+    def _lookup(self, session, seq, n):
+        data = session.held(seq, n)
+        if data is None:
+            pos = seq - self.tail_start
+            if pos >= 0 and pos + n <= len(self.tail):
+                data = self.tail[pos:pos + n]
+        return data
+
+    def on_parity(self, session, start, payload):
+        try:
+            lengths, xor = decode_parity(payload)
+        except struct.error:
+            return
+        if start + sum(lengths) <= session.expected_seq:
+            self.useless += 1
+            return
+        if not self._try(session, start, lengths, xor):
+            self.pending[start] = (lengths, xor)
+            while len(self.pending) > PENDING_MAX:
+                del self.pending[next(iter(self.pending))]
+
+    @property
+    def repaired(self):
+        """Rebuilt segments that were really lost, as echoed to the sender"""
+        return self.recovered - self.late
+
+    def on_data(self, session, seq):
+        """A data segment arrived: retry the parity of its group, if one is waiting"""
+        if seq in self.rebuilt:
+            del self.rebuilt[seq]
+            self.late += 1
+        for start, (lengths, xor) in list(self.pending.items()):
+            end = start + sum(lengths)
+            if end <= session.expected_seq:
+                del self.pending[start]
+            elif start <= seq < end and self._try(session, start, lengths, xor):
+                del self.pending[start]
+
+    def _try(self, session, start, lengths, xor):
+        """Rebuild the group's one missing segment; False while two or more are missing"""
+        acc = XorAccumulator(len(xor))
+        acc.add(xor)
+        missing = None
+        pos = start
+        for n in lengths:
+            payload = self._lookup(session, pos, n)
+            if payload is None:
+                if pos < session.expected_seq:
+                    return True        # delivered long ago: nothing left to rebuild here
+                if missing is not None:
+                    return False
+                missing = (pos, n)
+            else:
+                acc.add(payload)
+            pos += n
+        if missing is None:
+            return True
+        seq, n = missing
+        self.recovered += 1
+        self.rebuilt[seq] = None
+        if len(self.rebuilt) > REBUILT_MAX:
+            del self.rebuilt[next(iter(self.rebuilt))]
+        session.accept(seq, acc.value(n))
+        return True
@@ -1,25 +1,103 @@
 import struct, zlib
 
 HEADER_FMT = "!BBHIIHHI"  # 20 bytes: ver, flags, conn_id, seq, ack, win, len, checksum
+HEADER = struct.Struct(HEADER_FMT)
+HEADER_SIZE = HEADER.size
+CHECKSUM_OFFSET = 16      # checksum is the last header field
+_ZERO_CHECKSUM = bytes(4)
+_CHECKSUM = struct.Struct("!I")
+
+# Field positions in the tuple returned by decode()
+VER, FLAGS, CONN_ID, SEQ, ACK, WIN, LENGTH, CHECKSUM_FIELD = range(8)
+FIELDS = ("ver", "flags", "conn_id", "seq", "ack", "win", "length", "checksum")
+
+# The checksum is CRC32 over the header with a zeroed checksum field followed
+# by the payload. Senders build the packet with a zero checksum and CRC it in
+# place; decode() computes it incrementally, crc32(payload, crc32(header)),
+# so neither side concatenates header and payload just to checksum them.
+
+def make_packet(ver, flags, conn_id, seq, ack, win, payload):
+    buf = bytearray(HEADER.pack(ver, flags, conn_id, seq, ack, win, len(payload), 0))
+    buf += payload
+    _CHECKSUM.pack_into(buf, CHECKSUM_OFFSET, zlib.crc32(buf))
+    return buf
+
+def encode_into(buf, offset, ver, flags, conn_id, seq, ack, win, payload):
+    """Write one packet into a preallocated buffer at offset; returns its length.
+
+    The header is packed once with a zero checksum, so header and payload
+    are checksummed in place and only the CRC is patched in afterwards."""
+    n = len(payload)
+    end = offset + HEADER_SIZE + n
+    HEADER.pack_into(buf, offset, ver, flags, conn_id, seq, ack, win, n, 0)
+    mv = memoryview(buf)
+    mv[offset + HEADER_SIZE:end] = payload
+    _CHECKSUM.pack_into(buf, offset + CHECKSUM_OFFSET, zlib.crc32(mv[offset:end]))
+    return HEADER_SIZE + n
+
+def encode_batch(ver, flags, conn_id, ack, win, segments):
+    """Encode a window of [(seq, payload), ...] into one preallocated buffer.
+
+    Returns a memoryview per packet; they share the buffer, which stays
+    alive as long as any of them does. tools/bench_codec.py compares this
+    with encoding packet by packet.
+    """
+    buf = bytearray(sum(HEADER_SIZE + len(payload) for _, payload in segments))
+    mv = memoryview(buf)
+    pack_header, pack_crc, crc32 = HEADER.pack_into, _CHECKSUM.pack_into, zlib.crc32
+    out = []
+    offset = 0
+    for seq, payload in segments:
+        n = len(payload)
+        end = offset + HEADER_SIZE + n
+        pack_header(buf, offset, ver, flags, conn_id, seq, ack, win, n, 0)
+        mv[offset + HEADER_SIZE:end] = payload
+        packet = mv[offset:end]
+        pack_crc(buf, offset + CHECKSUM_OFFSET, crc32(packet))
+        out.append(packet)
+        offset = end
+    return out
+
+def decode(packet):
+    """Verify and split a datagram without copying its payload.
+
+    Returns (fields, payload) where fields is the header tuple (index it
+    with SEQ, ACK, ...) and payload a memoryview into packet. Raises
+    ValueError on a short packet, a length mismatch or a bad checksum.
+    """
+    if len(packet) < HEADER_SIZE:
+        raise ValueError("Short packet")
+    fields = HEADER.unpack_from(packet)
+    payload = memoryview(packet)[HEADER_SIZE:]
+    if fields[LENGTH] != len(payload):
+        raise ValueError("Length mismatch")
+    crc = zlib.crc32(_ZERO_CHECKSUM, zlib.crc32(packet[:CHECKSUM_OFFSET]))
+    if zlib.crc32(payload, crc) != fields[CHECKSUM_FIELD]:
+        raise ValueError("Checksum mismatch")
+    return fields, payload
+
+# -----------------
+# Compatibility helpers for callers of the original dict-based API
 
 def pack_header(ver, flags, conn_id, seq, ack, win, length, checksum=0):
-    return struct.pack(HEADER_FMT, ver, flags, conn_id, seq, ack, win, length, checksum)
+    return HEADER.pack(ver, flags, conn_id, seq, ack, win, length, checksum)
 
 def compute_checksum(header_zeroed: bytes, payload: bytes) -> int:
-    return zlib.crc32(header_zeroed + payload) & 0xffffffff
-
-def make_packet(ver, flags, conn_id, seq, ack, win, payload: bytes):
-    length = len(payload)
-    h0 = pack_header(ver, flags, conn_id, seq, ack, win, length, 0)
-    chk = compute_checksum(h0, payload)
-    return pack_header(ver, flags, conn_id, seq, ack, win, length, chk) + payload
+    return zlib.crc32(payload, zlib.crc32(header_zeroed)) & 0xffffffff
 
 def unpack_packet(packet: bytes):
-    header = packet[:20]
-    payload = packet[20:]
-    ver, flags, conn_id, seq, ack, win, length, chk = struct.unpack(HEADER_FMT, header)
-    h0 = pack_header(ver, flags, conn_id, seq, ack, win, length, 0)
-    if compute_checksum(h0, payload) != chk:
-        raise ValueError("Checksum mismatch")
-    return dict(ver=ver, flags=flags, conn_id=conn_id, seq=seq, ack=ack,
-                win=win, length=length, checksum=chk), payload
+    fields, payload = decode(packet)
+    return dict(zip(FIELDS, fields)), bytes(payload)
+
+# SACK blocks ride in the payload of ACK packets: (start, end) seq pairs, end exclusive
+SACK_BLOCK = struct.Struct("!II")
+SACK_BLOCK_SIZE = SACK_BLOCK.size
+
+def pack_sack(blocks):
+    buf = bytearray(SACK_BLOCK_SIZE * len(blocks))
+    for i, (start, end) in enumerate(blocks):
+        SACK_BLOCK.pack_into(buf, i * SACK_BLOCK_SIZE, start, end)
+    return buf
+
+def unpack_sack(payload):
+    return list(SACK_BLOCK.iter_unpack(payload[:len(payload) - len(payload) % SACK_BLOCK_SIZE]))
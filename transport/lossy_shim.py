@@ -1,14 +1,46 @@
-import random, threading
+from .netem import NetemSocket, Profile
 
-class LossySocket:
-    def __init__(self, sock, loss_rate=0.05, burst=False, max_delay_ms=50):
-        self.sock = sock
-        self.loss_rate = loss_rate
-        self.burst = burst
+class LossySocket(NetemSocket):
+    """Compatibility wrapper: drops and delays outgoing datagrams through a
+    netem Link. burst switches to Gilbert-Elliott loss with the same mean
+    rate; seed makes the run reproducible."""
+    def __init__(self, sock, loss_rate=0.05, burst=False, max_delay_ms=50, seed=None):
+        super().__init__(sock, Profile(), seed=seed)
+        self._burst = burst
+        self._loss_rate = loss_rate
         self.max_delay_ms = max_delay_ms
+        self._configure()
 
-    def sendto(self, data, addr):
-        if random.random() < self.loss_rate:
-            return  # drop packet
-        delay = random.uniform(0, self.max_delay_ms) / 1000
-        threading.Timer(delay, lambda: self.sock.sendto(data, addr)).start()
+    def _configure(self):
+        p = self.up.profile
+        if self._burst and self._loss_rate > 0:
+            burst = Profile.bursty(self._loss_rate)
+            p.loss, p.ge_p, p.ge_r, p.ge_loss = 0.0, burst.ge_p, burst.ge_r, burst.ge_loss
+        else:
+            p.loss, p.ge_p = self._loss_rate, 0.0
+
+    @property
+    def loss_rate(self):
+        return self._loss_rate
+
+    @loss_rate.setter
+    def loss_rate(self, value):
+        self._loss_rate = value
+        self._configure()
+
+    @property
+    def burst(self):
+        return self._burst
+
+    @burst.setter
+    def burst(self, value):
+        self._burst = value
+        self._configure()
+
+    @property
+    def max_delay_ms(self):
+        return self.up.profile.jitter_ms
+
+    @max_delay_ms.setter
+    def max_delay_ms(self, value):
+        self.up.profile.jitter_ms = value
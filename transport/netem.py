@@ -0,0 +1,344 @@
+import asyncio, heapq, random, selectors
+
+# -----------------
+# Network emulator. Every random decision comes from a seeded RNG per link
+# direction and every delivery is a loop timer, so a run with the same seed
+# and the same traffic is reproducible, and nothing spawns threads.
+
+class Profile:
+    """Impairments of one link direction.
+
+    rate_bps/queue_bytes model a drop-tail bottleneck (0 = unlimited).
+    Loss is Bernoulli with probability loss, or Gilbert-Elliott when
+    ge_p > 0: the link moves good->bad with probability ge_p and
+    bad->good with ge_r per packet, losing packets with probability loss
+    in the good state and ge_loss in the bad one. Each packet gets
+    delay_ms plus uniform(0, jitter_ms); with probability reorder it is
+    held reorder_ms longer so later packets overtake it.
+    """
+    FIELDS = ("loss", "ge_p", "ge_r", "ge_loss", "delay_ms", "jitter_ms", "rate_bps",
+              "queue_bytes", "reorder", "reorder_ms", "duplicate", "corrupt")
+
+    def __init__(self, loss=0.0, ge_p=0.0, ge_r=1.0, ge_loss=1.0, delay_ms=0.0, jitter_ms=0.0,
+                 rate_bps=0, queue_bytes=0, reorder=0.0, reorder_ms=10.0, duplicate=0.0, corrupt=0.0):
+        self.loss = loss
+        self.ge_p = ge_p
+        self.ge_r = ge_r
+        self.ge_loss = ge_loss
+        self.delay_ms = delay_ms
+        self.jitter_ms = jitter_ms
+        self.rate_bps = rate_bps
+        self.queue_bytes = queue_bytes
+        self.reorder = reorder
+        self.reorder_ms = reorder_ms
+        self.duplicate = duplicate
+        self.corrupt = corrupt
+
+    @classmethod
+    def bursty(cls, loss_rate, burst_len=4.0, **kw):
+        """Gilbert-Elliott profile losing loss_rate of packets on average
+        in bursts of burst_len packets"""
+        r = 1.0 / burst_len
+        return cls(ge_p=loss_rate * r / (1 - loss_rate), ge_r=r, ge_loss=1.0, **kw)
+
+    @classmethod
+    def from_dict(cls, d):
+        d = dict(d)
+        if "burst_len" in d:
+            return cls.bursty(d.pop("loss", 0.0), d.pop("burst_len"), **d)
+        return cls(**d)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    @property
+    def mean_loss(self):
+        if self.ge_p <= 0:
+            return self.loss
+        bad = self.ge_p / (self.ge_p + self.ge_r)
+        return bad * self.ge_loss + (1 - bad) * self.loss
+
+
+class Link:
+    """One direction of an emulated path. send(data, deliver) eventually
+    calls deliver(data) on the loop unless the packet is lost.
+
+    With record=True the loss decision of every packet is appended to
+    trace (1 = lost); passing such a trace as replay drops exactly those
+    packets again instead of drawing from the loss model.
+    """
+    def __init__(self, profile=None, seed=None, loop=None, record=False, replay=None):
+        self.profile = profile or Profile()
+        self.rng = random.Random(seed)
+        self.loop = loop
+        self.bad = False              # Gilbert-Elliott state
+        self.busy_until = 0.0         # when the bottleneck finishes serialising its queue
+        self.trace = bytearray() if record else None
+        self.replay = iter(replay) if replay is not None else None
+        self.stats = dict.fromkeys(("sent", "delivered", "lost", "queue_drops", "reordered",
+                                    "duplicated", "corrupted"), 0)
+        # Deliveries due at the same time must keep their send order, which
+        # loop timers do not guarantee, so the link keeps its own queue
+        self.pending = []             # heap of (time, order, deliver, data)
+        self._order = 0
+        self._handle = None
+        self._handle_at = None
+
+    def _lost(self):
+        if self.replay is not None:
+            return bool(next(self.replay, 0))
+        p, rng = self.profile, self.rng
+        if p.ge_p > 0:
+            self.bad = rng.random() >= p.ge_r if self.bad else rng.random() < p.ge_p
+            return rng.random() < (p.ge_loss if self.bad else p.loss)
+        return p.loss > 0 and rng.random() < p.loss
+
+    def send(self, data, deliver):
+        p, rng, stats = self.profile, self.rng, self.stats
+        loop = self.loop or asyncio.get_running_loop()
+        stats["sent"] += 1
+        lost = self._lost()
+        if self.trace is not None:
+            self.trace.append(lost)
+        if lost:
+            stats["lost"] += 1
+            return
+        now = loop.time()
+        at = now
+        if p.rate_bps:
+            start = max(now, self.busy_until)
+            if p.queue_bytes and (start - now) * p.rate_bps / 8 + len(data) > p.queue_bytes:
+                stats["queue_drops"] += 1
+                return
+            self.busy_until = at = start + len(data) * 8 / p.rate_bps
+        at += (p.delay_ms + (rng.uniform(0, p.jitter_ms) if p.jitter_ms else 0)) / 1000
+        if p.reorder and rng.random() < p.reorder:
+            stats["reordered"] += 1
+            at += p.reorder_ms / 1000
+        if p.corrupt and rng.random() < p.corrupt:
+            stats["corrupted"] += 1
+            data = bytearray(data)
+            data[rng.randrange(len(data))] ^= 1 << rng.randrange(8)
+            data = bytes(data)
+        self._schedule(loop, at, deliver, data)
+        if p.duplicate and rng.random() < p.duplicate:
+            stats["duplicated"] += 1
+            self._schedule(loop, at + rng.uniform(0, max(p.jitter_ms, 1)) / 1000, deliver, data)
+
+    def _schedule(self, loop, at, deliver, data):
+        self._order += 1
+        heapq.heappush(self.pending, (at, self._order, deliver, data))
+        if self._handle is None or at < self._handle_at:
+            if self._handle is not None:
+                self._handle.cancel()
+            self._handle_at = at
+            self._handle = loop.call_at(at, self._deliver, loop)
+
+    def _deliver(self, loop):
+        due = max(loop.time(), self._handle_at)
+        self._handle = None
+        pending = self.pending
+        while pending and pending[0][0] <= due:
+            _, _, deliver, data = heapq.heappop(pending)
+            self.stats["delivered"] += 1
+            deliver(data)
+        if pending and self._handle is None:
+            self._handle_at = pending[0][0]
+            self._handle = loop.call_at(self._handle_at, self._deliver, loop)
+
+
+def _link(profile, seed, **kw):
+    if isinstance(profile, Link):
+        return profile
+    if isinstance(profile, dict):
+        profile = Profile.from_dict(profile)
+    return Link(profile, seed, **kw)
+
+
+class _Inbox:
+    """Coalesces datagrams delivered in one loop iteration into a single
+    datagrams_received() call, like a batched socket read"""
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.batch = []
+
+    def put(self, data, addr):
+        if not self.batch:
+            asyncio.get_running_loop().call_soon(self._flush)
+        self.batch.append((data, addr))
+
+    def _flush(self):
+        batch, self.batch = self.batch, []
+        handler = getattr(self.protocol, "datagrams_received", None)
+        if handler is not None:
+            handler(batch)
+        else:
+            for data, addr in batch:
+                self.protocol.datagram_received(data, addr)
+
+
+# -----------------
+class NetemSocket:
+    """Emulated path in front of a real datagram endpoint. Use it as a
+    GBNTransport loss_wrapper for the up direction (sendto), and create the
+    endpoint with wrap(protocol) as its protocol so received datagrams take
+    the down direction. Either profile may be a Profile, a dict or a Link;
+    down=None leaves received traffic untouched."""
+    def __init__(self, sock, up=None, down=None, seed=None):
+        seeds = random.Random(seed)
+        self.sock = sock
+        self.up = _link(up, seeds.getrandbits(64))
+        self.down = _link(down, seeds.getrandbits(64)) if down is not None else None
+
+    def sendto(self, data, addr):
+        self.up.send(data, lambda data: self.sock.sendto(data, addr))
+
+    def wrap(self, protocol):
+        return protocol if self.down is None else _DownProtocol(self.down, protocol)
+
+    def stats(self):
+        return {"up": dict(self.up.stats), "down": dict(self.down.stats) if self.down else None}
+
+
+class _DownProtocol(asyncio.DatagramProtocol):
+    def __init__(self, link, protocol):
+        self.link = link
+        self.protocol = protocol
+        self.inbox = _Inbox(protocol)
+
+    def connection_made(self, transport):
+        self.protocol.connection_made(transport)
+
+    def connection_lost(self, exc):
+        self.protocol.connection_lost(exc)
+
+    def error_received(self, exc):
+        self.protocol.error_received(exc)
+
+    def send_failed(self, data, addr, exc):
+        handler = getattr(self.protocol, "send_failed", None)
+        if handler is not None:
+            handler(data, addr, exc)
+        else:
+            self.protocol.error_received(exc)
+
+    def datagram_received(self, data, addr):
+        self.link.send(data, lambda data: self.inbox.put(data, addr))
+
+    def datagrams_received(self, batch):
+        for data, addr in batch:
+            self.datagram_received(data, addr)
+
+
+# -----------------
+class MemoryNetwork:
+    """In-process datagram network: endpoints exchange packets only through
+    emulated links, no sockets, so it also runs on a VirtualTimeLoop.
+    Each (src, dst) direction gets its own Link, built from the profile set
+    for that pair or the default one."""
+    def __init__(self, profile=None, seed=0):
+        self.default = profile
+        self.seeds = random.Random(seed)
+        self.profiles = {}      # (src, dst) -> Profile
+        self.links = {}         # (src, dst) -> Link
+        self.endpoints = {}     # addr -> MemoryTransport
+        self._next_port = 10000
+
+    def set_profile(self, src, dst, profile):
+        self.profiles[(src, dst)] = profile
+        self.links.pop((src, dst), None)
+
+    def endpoint(self, protocol, addr=None):
+        """Bind protocol to addr (allocated when None) and connect it"""
+        if addr is None:
+            addr = ("10.0.0.1", self._next_port)
+            self._next_port += 1
+        transport = self.endpoints[addr] = MemoryTransport(self, protocol, addr)
+        asyncio.get_event_loop().call_soon(protocol.connection_made, transport)
+        return transport
+
+    def route(self, data, src, dst):
+        link = self.links.get((src, dst))
+        if link is None:
+            profile = self.profiles.get((src, dst), self.default)
+            link = self.links[(src, dst)] = _link(profile, self.seeds.getrandbits(64))
+        link.send(bytes(data), lambda data: self._arrive(data, src, dst))
+
+    def _arrive(self, data, src, dst):
+        endpoint = self.endpoints.get(dst)
+        if endpoint is not None:
+            endpoint.inbox.put(data, src)
+
+    def stats(self):
+        return {f"{s[0]}:{s[1]}->{d[0]}:{d[1]}": dict(link.stats) for (s, d), link in self.links.items()}
+
+
+class MemoryTransport(asyncio.DatagramTransport):
+    def __init__(self, network, protocol, addr):
+        super().__init__(extra={"sockname": addr})
+        self.network = network
+        self.protocol = protocol
+        self.addr = addr
+        self.inbox = _Inbox(protocol)
+        self._closing = False
+
+    def sendto(self, data, addr=None):
+        if not self._closing:
+            self.network.route(data, self.addr, addr)
+
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        if not self._closing:
+            self._closing = True
+            self.network.endpoints.pop(self.addr, None)
+            asyncio.get_event_loop().call_soon(self.protocol.connection_lost, None)
+
+    def abort(self):
+        self.close()
+
+
+# -----------------
+# Virtual clock: when nothing is ready, the loop jumps straight to its next
+# timer instead of sleeping, so a multi-minute emulated transfer takes as
+# long as the CPU work. Real file descriptors are still polled, but work
+# handed to executor threads does not hold the clock back; use it with
+# MemoryNetwork and in-memory producers/consumers.
+
+class _VirtualSelector(selectors.DefaultSelector):
+    loop = None
+
+    def select(self, timeout=None):
+        ready = super().select(0)
+        if ready or timeout == 0:
+            return ready
+        if timeout is None:       # no timers at all: wait for real I/O
+            return super().select(None)
+        self.loop.advance(timeout)
+        return []
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    def __init__(self, start=0.0):
+        self._now = start
+        selector = _VirtualSelector()
+        selector.loop = self
+        super().__init__(selector)
+
+    def time(self):
+        return self._now
+
+    def advance(self, seconds):
+        self._now += seconds
+
+
+def run_virtual(coro):
+    """asyncio.run() on a VirtualTimeLoop"""
+    loop = VirtualTimeLoop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(coro)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
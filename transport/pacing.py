@@ -0,0 +1,180 @@
+import heapq
+from .timers import Timer
+
+PACING_GAIN_SS = 2.0     # slow start: let cwnd keep doubling per RTT
+PACING_GAIN_CA = 1.25    # congestion avoidance: a little above cwnd/srtt
+PACE_BURST = 4           # segments a pacer may send back to back
+PACE_HORIZON = 0.002     # ...or this many seconds worth at its rate, whichever is more
+QUANTUM = 8              # segments a session sends per turn of the fair scheduler
+
+
+class TokenBucket:
+    """rate bytes/s refilling up to depth bytes. Tokens may go negative when
+    a caller spends more than it had (e.g. a retransmission)."""
+    __slots__ = ("rate", "depth", "tokens", "stamp")
+
+    def __init__(self, rate, depth, now=0.0):
+        self.rate = rate
+        self.depth = depth
+        self.tokens = depth
+        self.stamp = now
+
+    def refill(self, now):
+        if now > self.stamp:
+            self.tokens = min(self.depth, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+        return self.tokens
+
+    def spend(self, n):
+        self.tokens -= n
+
+    def wait(self, n, now):
+        """Seconds until n tokens are available"""
+        missing = n - self.refill(now)
+        return max(0.0, missing / self.rate) if self.rate else 0.0
+
+
+class Pacer(TokenBucket):
+    """Spreads a session's window over its RTT: the rate follows
+    gain * cwnd / srtt and is left unlimited until the first RTT sample"""
+    __slots__ = ()
+
+    def __init__(self, mss):
+        super().__init__(None, PACE_BURST * mss)
+
+    def update(self, cwnd, srtt, slow_start, mss, now):
+        if not srtt:
+            return
+        if self.rate is None:
+            self.stamp = now        # first sample: start with a full bucket
+        else:
+            self.refill(now)
+        self.rate = (PACING_GAIN_SS if slow_start else PACING_GAIN_CA) * cwnd / srtt
+        self.depth = max(PACE_BURST * mss, self.rate * PACE_HORIZON)
+
+    def allowance(self, now):
+        return None if self.rate is None else self.refill(now)
+
+
+# -----------------
+class FairScheduler:
+    """Shares an endpoint's egress rate among its sessions by weighted fair
+    queuing (start-time fair queuing over bytes sent).
+
+    Sessions with new data to send call ready(); the scheduler then lets
+    the backlogged session with the smallest virtual start tag send up to
+    QUANTUM segments, as long as the total rate (and the session's client
+    cap) has tokens left. A session's tag advances by bytes / weight, so
+    under load every session gets a share proportional to its weight no
+    matter how much data it has queued. Retransmissions are not queued but
+    are charged through charge().
+    """
+    def __init__(self, timers, rate=None, client_rate=None, mss=1200):
+        self.timers = timers
+        self.loop = timers.loop
+        self.mss = mss
+        self.quantum = QUANTUM * mss
+        self.bucket = TokenBucket(rate, max(2 * QUANTUM * mss, rate * PACE_HORIZON)) if rate else None
+        self.client_rate = client_rate
+        self.client_caps = {}    # host -> bytes/s overriding client_rate
+        self.client_weights = {} # host -> weight (sessions default to 1.0)
+        self.caps = {}           # host -> TokenBucket
+        self.vtime = 0.0
+        self.finish = {}         # session -> virtual finish tag of its last turn
+        self.heap = []           # (start tag, order, session) of backlogged sessions
+        self.queued = set()
+        self.parked = []         # sessions waiting for their client cap to refill
+        self.timer = Timer(self._wake)
+        self._order = 0
+        self._running = False
+
+    def set_client_rate(self, host, rate, weight=None):
+        self.client_caps[host] = rate
+        self.caps.pop(host, None)
+        if weight is not None:
+            self.client_weights[host] = weight
+
+    def weight(self, session):
+        return session.weight * self.client_weights.get(session.addr[0], 1.0)
+
+    def forget(self, session):
+        self.finish.pop(session, None)
+        self.queued.discard(session)    # its heap entry is skipped lazily
+
+    def _cap(self, session):
+        host = session.addr[0]
+        rate = self.client_caps.get(host, self.client_rate)
+        if not rate:
+            return None
+        cap = self.caps.get(host)
+        if cap is None:
+            cap = self.caps[host] = TokenBucket(rate, max(2 * self.quantum, rate * PACE_HORIZON),
+                                                self.loop.time())
+        return cap
+
+    def charge(self, session, n):
+        if self.bucket:
+            self.bucket.spend(n)
+        cap = self._cap(session)
+        if cap:
+            cap.spend(n)
+
+    def ready(self, session):
+        self._enqueue(session)
+        if not self._running:
+            self.run()
+
+    def _enqueue(self, session):
+        if session in self.queued:
+            return
+        self.queued.add(session)
+        tag = max(self.vtime, self.finish.get(session, 0.0))
+        self._order += 1
+        heapq.heappush(self.heap, (tag, self._order, session))
+
+    def run(self):
+        self._running = True
+        try:
+            self._run()
+        finally:
+            self._running = False
+
+    def _run(self):
+        now = self.loop.time()
+        wait = None
+        while self.heap:
+            if self.bucket and self.bucket.refill(now) <= 0:
+                wait = self.bucket.wait(self.mss, now)
+                break
+            tag, _, session = heapq.heappop(self.heap)
+            if session not in self.queued:
+                continue
+            self.queued.discard(session)
+            limit = self.quantum
+            if self.bucket:
+                limit = min(limit, self.bucket.tokens)
+            cap = self._cap(session)
+            if cap is not None:
+                if cap.refill(now) <= 0:
+                    self.parked.append(session)
+                    w = cap.wait(self.mss, now)
+                    wait = w if wait is None else min(wait, w)
+                    continue
+                limit = min(limit, cap.tokens)
+            sent = session.send_new(max(int(limit), 1))
+            self.vtime = tag
+            if not sent:
+                continue          # window, pacer or producer bound: it calls ready() again
+            self.charge(session, sent)
+            self.finish[session] = tag + sent / self.weight(session)
+            if session.wants_to_send():
+                self._enqueue(session)
+        if wait is not None:
+            self.timers.schedule(self.timer, wait)
+
+    def _wake(self):
+        parked, self.parked = self.parked, []
+        for session in parked:
+            if session.wants_to_send():
+                self._enqueue(session)
+        self.run()
@@ -0,0 +1,50 @@
+import bisect
+
+
+class RangeSet:
+    """Sorted, merged [start, end) sequence ranges"""
+    def __init__(self):
+        self.ranges = []    # list of [start, end], kept sorted and disjoint
+        self.last = None    # range touched by the most recent add()
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def __bool__(self):
+        return bool(self.ranges)
+
+    def __iter__(self):
+        return iter(self.ranges)
+
+    def add(self, start, end):
+        """Insert [start, end); returns the sub-ranges that were not covered before"""
+        r = self.ranges
+        i = bisect.bisect_left(r, [start, start])
+        if i and r[i-1][1] >= start:
+            i -= 1
+        new = []
+        cur, lo, hi = start, start, end
+        j = i
+        while j < len(r) and r[j][0] <= end:
+            s, e = r[j]
+            if s > cur:
+                new.append((cur, s))
+            cur = max(cur, e)
+            lo, hi = min(lo, s), max(hi, e)
+            j += 1
+        if cur < end:
+            new.append((cur, end))
+        r[i:j] = [[lo, hi]]
+        self.last = r[i]
+        return new
+
+    def trim(self, below):
+        """Forget everything before seq below"""
+        r = self.ranges
+        n = 0
+        while n < len(r) and r[n][1] <= below:
+            n += 1
+        if n:
+            del r[:n]
+        if r and r[0][0] < below:
+            r[0][0] = below
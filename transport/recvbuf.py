@@ -0,0 +1,73 @@
+RING_MIN = 64 << 10     # first allocation; the ring doubles up to its capacity as needed
+
+
+class ReorderRing:
+    """Fixed-capacity receive buffer addressed by sequence number.
+
+    Byte seq lives at seq % len(buf), so segments are stored wherever they
+    land and a contiguous run reads back as one view without joining
+    pieces. The caller keeps every stored byte within capacity of the
+    oldest one it still needs (base); that bounds the memory a session can
+    ever hold, whatever the peer sends. Storage is allocated on first use
+    and grows by doubling, so sessions that never reorder stay small.
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buf = None
+
+    @property
+    def allocated(self):
+        return len(self.buf) if self.buf is not None else 0
+
+    def _reserve(self, base, end):
+        """Make room for bytes up to end, keeping [base, ...) in place"""
+        size = self.allocated
+        if end - base <= size:
+            return
+        new_size = max(size, min(RING_MIN, self.capacity))
+        while new_size < end - base:
+            new_size = min(2 * new_size, self.capacity)
+        new = bytearray(new_size)
+        if self.buf is not None:
+            old, self.buf = self.buf, new
+            for seq, piece in _pieces(old, base, base + size):
+                self._put(seq, piece)
+        self.buf = new
+
+    def write(self, seq, data, base):
+        """Store data at seq; base is the oldest seq still held"""
+        end = seq + len(data)
+        if end - base > self.capacity:
+            raise ValueError("segment beyond the reorder window")
+        self._reserve(base, end)
+        self._put(seq, data)
+
+    def _put(self, seq, data):
+        buf, size = self.buf, len(self.buf)
+        pos = seq % size
+        n = min(len(data), size - pos)
+        buf[pos:pos + n] = data[:n]
+        if n < len(data):
+            buf[:len(data) - n] = data[n:]
+
+    def view(self, seq, end):
+        """Stored bytes from seq: a view up to end or the wrap point, whichever
+        comes first. It is only valid until the ring is written again."""
+        size = len(self.buf)
+        pos = seq % size
+        return memoryview(self.buf)[pos:pos + min(end - seq, size - pos)]
+
+    def read(self, seq, n):
+        """Copy of the n stored bytes from seq"""
+        return b"".join(piece for _, piece in _pieces(self.buf, seq, seq + n))
+
+
+def _pieces(buf, seq, end):
+    """(seq, view) pieces of buf covering [seq, end), split at the wrap point"""
+    size = len(buf)
+    mv = memoryview(buf)
+    while seq < end:
+        pos = seq % size
+        n = min(end - seq, size - pos)
+        yield seq, mv[pos:pos + n]
+        seq += n
@@ -0,0 +1,45 @@
+INITIAL_RTO = 0.5   # seconds, used until the first RTT sample
+MIN_RTO = 0.005
+MAX_RTO = 30.0
+CLOCK_G = 0.001     # timer granularity term (G) from RFC 6298
+
+class RTOEstimator:
+    """Retransmission timeout from smoothed RTT samples (RFC 6298).
+
+    Callers apply Karn's rule by only sampling segments that were never
+    retransmitted; backoff() doubles the RTO after each timeout, until the
+    next valid sample or until reset_backoff() once the retransmission got
+    through (as QUIC resets its PTO backoff on any ACK of new data).
+    """
+    def __init__(self, initial=INITIAL_RTO, min_rto=MIN_RTO, max_rto=MAX_RTO):
+        self.srtt = None
+        self.rttvar = None
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.rto = initial
+        self.base = initial        # the RTO before backoff
+        self.backoffs = 0
+        self.samples = 0
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.samples += 1
+        self.backoffs = 0
+        self.base = min(self.max_rto, max(self.min_rto, self.srtt + max(CLOCK_G, 4 * self.rttvar)))
+        self.rto = self.base
+
+    def backoff(self):
+        self.backoffs += 1
+        self.rto = min(self.max_rto, self.rto * 2)
+
+    def reset_backoff(self):
+        """The path delivers again: without it a session whose only segments
+        were retransmitted (so gave no sample) keeps the backed-off RTO"""
+        if self.backoffs:
+            self.backoffs = 0
+            self.rto = self.base
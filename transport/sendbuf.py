@@ -0,0 +1,61 @@
+from collections import deque
+
+
+class SendQueue:
+    """Application bytes not yet segmented, as a FIFO of memoryviews.
+
+    append() keeps a view of the caller's buffer instead of copying it, so
+    callers must not mutate data after handing it to Session.send().
+    take() returns a view of the head chunk; only a segment that straddles
+    two chunks is joined into a new (at most MSS-byte) buffer.
+    """
+    def __init__(self):
+        self.chunks = deque()
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, data):
+        mv = memoryview(data)
+        if mv.ndim != 1 or mv.itemsize != 1:
+            mv = mv.cast("B")
+        if len(mv):
+            self.chunks.append(mv)
+            self.size += len(mv)
+
+    def take(self, n):
+        head = self.chunks[0]
+        if len(head) > n:
+            self.chunks[0] = head[n:]
+            self.size -= n
+            return head[:n]
+        self.chunks.popleft()
+        self.size -= len(head)
+        if len(head) == n or not self.chunks:
+            return head
+        # Segment spans a chunk boundary: join the pieces
+        parts = [head]
+        need = n - len(head)
+        while need and self.chunks:
+            part = self.take(min(need, len(self.chunks[0])))
+            parts.append(part)
+            need -= len(part)
+        return memoryview(b"".join(parts))
+
+
+class Segment:
+    """One in-flight segment; payload is a view into the sender's data"""
+    __slots__ = ("seq", "payload", "sent", "retransmitted", "sacked", "lost")
+
+    def __init__(self, seq, payload, sent):
+        self.seq = seq
+        self.payload = payload
+        self.sent = sent
+        self.retransmitted = False
+        self.sacked = False
+        self.lost = False
+
+    @property
+    def end(self):
+        return self.seq + len(self.payload)
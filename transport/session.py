@@ -0,0 +1,635 @@
+import time, heapq
+from collections import deque
+from .header import make_packet, encode_batch, pack_sack
+from .rtt import RTOEstimator
+from .timers import Timer
+from .congestion import make_controller, MAX_WINDOW
+from .sendbuf import SendQueue, Segment
+from .recvbuf import ReorderRing
+from .pacing import Pacer
+from .ranges import RangeSet
+from .fec import FecEncoder, FecDecoder
+
+MSS = 1200
+ACK_FLAG = 0x02
+SACK_FLAG = 0x04                # ACK payload carries SACK blocks
+FEC_FLAG = 0x08                 # XOR parity of the data segments from seq on (see fec.py)
+SYN_FLAG = 0x10                 # data of a stream the peer has not ACKed yet: may open a session
+RST_FLAG = 0x20                 # "no such session": the peer dropped its state
+WINDOW_FLAG = 0x40              # ACK that only announces a reopened window: not a dup ACK
+
+WIN_SHIFT = 10                  # the 16-bit win field counts KiB of free buffer
+RECV_CAPACITY = 4 << 20         # default reassembly buffer per session, a hard limit
+INITIAL_PEER_WINDOW = 64 << 10  # assumed until the peer advertises its window
+MAX_SACK_BLOCKS = 8
+DUP_THRESH = 3
+PERSIST_MAX = 60.0              # cap on the backed-off interval between zero-window probes
+
+
+class Session:
+    """Reliable stream state for one (peer address, conn_id) pair"""
+    def __init__(self, endpoint, addr, conn_id, window_size=None, sack_enabled=True,
+                 cc="reno", recv_capacity=RECV_CAPACITY, pacing=True, fec=False, active=True):
+        self.endpoint = endpoint
+        self.addr = addr
+        self.conn_id = conn_id
+        self.active = active       # opened here, not by a peer's first segment
+        self.synced = not active   # the peer has ACKed this stream, so it knows the session
+        self.window_size = window_size   # optional cap in segments
+
+        self.send_base = 0
+        self.next_seq = 0
+        self.send_queue = SendQueue()   # queued, not yet segmented
+        self.producers = deque()        # pulled from as the window opens
+        self.inflight = deque()         # Segments from send_base to next_seq, in seq order
+        self.segments = {}              # seq -> Segment, for SACK lookups
+        self.rto = RTOEstimator()
+        self.timer = Timer(self.timeout)
+        self.cc = make_controller(cc, MSS, window_size * MSS if window_size else MAX_WINDOW)
+        self.peer_rwnd = INITIAL_PEER_WINDOW
+        self.pacer = Pacer(MSS) if pacing else None
+        self.pace_timer = Timer(self.try_send)
+        self.persist_timer = Timer(self.probe_window)   # zero-window probes, not a loss timer
+        self.probes = 0            # probes sent since the window last had room
+        self.weight = 1.0          # share under the endpoint's FairScheduler
+        self.recover = 0           # end of the window in which the last loss was handled
+        self.last_retransmit = None   # loop time of the latest retransmission
+        self.fec = FecEncoder(MSS) if fec else None
+        self.fec_decoder = None    # created by the first parity packet received
+
+        # Selective-repeat scoreboard
+        self.sacked_ranges = RangeSet()
+        self.sacked_bytes = 0
+        self.lost = []             # heap of seqs waiting for retransmission
+        self.lost_bytes = 0
+        self.lost_scan = 0         # recovery has looked for holes up to here
+        self.high_sacked = 0       # highest SACKed seq end
+        self.dup_acks = 0
+
+        self.expected_seq = 0      # cumulative ACK point
+        self.deliver_seq = 0       # next byte handed to on_receive_cb
+        self.paused = False        # delivery held back by the application
+        self.recv_ring = ReorderRing(recv_capacity)   # data received but not delivered
+        self.recv_buffered = 0
+        self.recv_ranges = RangeSet()   # out-of-order data held
+        self.recv_capacity = recv_capacity
+        self.on_receive_cb = None
+        self.on_close_cb = None
+        self.sack_enabled = sack_enabled
+
+        self.retransmissions = 0
+        self.retransmitted_bytes = 0
+        self.fast_retransmits = 0
+        self.timeouts = 0
+        self.window_probes = 0
+        self.packets_sent = 0
+        self.packets_received = 0
+        self.send_errors = 0       # datagrams the socket refused
+        self.delivered_before = 0  # bytes delivered by earlier incarnations (see restart)
+
+        self.app_state = {}        # owned by the application (e.g. FTP PUT state)
+        self.created = time.monotonic()
+        self.last_activity = self.created
+
+    @property
+    def key(self):
+        return (self.addr, self.conn_id)
+
+    def memory_usage(self):
+        """Approximate bytes held by this session's buffers"""
+        return len(self.send_queue) + self.bytes_in_flight + self.recv_ring.allocated
+
+    @property
+    def cwnd(self):
+        return self.cc.cwnd
+
+    @property
+    def bytes_in_flight(self):
+        return self.next_seq - self.send_base
+
+    @property
+    def pipe(self):
+        """Bytes believed to be in the network: in flight minus SACKed and lost"""
+        return self.bytes_in_flight - self.sacked_bytes - self.lost_bytes
+
+    def send_window(self):
+        """Bytes the sender may have in the pipe (the congestion window)"""
+        return self.cc.cwnd
+
+    def peer_room(self):
+        """New bytes the peer can still buffer: its advertised window counts
+        from the cumulative ACK, SACKed data included"""
+        return self.send_base + self.peer_rwnd - self.next_seq
+
+    def _window_closed(self):
+        """The peer's window has no room for the next segment"""
+        return self.peer_room() < (min(MSS, len(self.send_queue)) if self.send_queue else MSS)
+
+    def advertised_window(self):
+        free = max(0, self.recv_capacity - self.recv_buffered)
+        return min(0xffff, free >> WIN_SHIFT)
+
+    def info(self):
+        return {
+            "memory_bytes": self.memory_usage(),
+            "cwnd": self.cwnd,
+            "ssthresh": self.cc.ssthresh,
+            "bytes_in_flight": self.bytes_in_flight,
+            "peer_rwnd": self.peer_rwnd,
+            "srtt_ms": self.rto.srtt * 1000 if self.rto.srtt is not None else None,
+            "rto_ms": self.rto.rto * 1000,
+            "retransmitted_bytes": self.retransmitted_bytes,
+            **self.counters(),
+        }
+
+    def counters(self):
+        """Monotonic counters; the endpoint keeps their totals after close"""
+        return {
+            "packets_sent": self.packets_sent,
+            "packets_received": self.packets_received,
+            "retransmissions": self.retransmissions,
+            "fast_retransmits": self.fast_retransmits,
+            "timeouts": self.timeouts,
+            "window_probes": self.window_probes,
+            "rtt_samples": self.rto.samples,
+            "bytes_delivered": self.delivered_before + self.deliver_seq,
+            "fec_recovered": self.fec_decoder.recovered if self.fec_decoder else 0,
+            "fec_parity_sent": self.fec.parity_sent if self.fec else 0,
+        }
+
+    def idle(self):
+        return self.send_base == self.next_seq and not self.recv_buffered and not self.producers
+
+    # -----------------
+    # Receive side
+    def on_data(self, seq, win, payload):
+        self.last_activity = time.monotonic()
+        self.packets_received += 1
+        self.peer_rwnd = win << WIN_SHIFT
+        if not payload:
+            self.endpoint.queue_ack(self)   # zero-window probe: answer with our window
+            return
+        self.accept(seq, payload)
+        if self.fec_decoder:
+            self.fec_decoder.on_data(self, seq)
+
+    def accept(self, seq, payload):
+        """Store a segment, received or rebuilt from parity, and ACK it"""
+        end = seq + len(payload)
+        # Drop duplicates, and anything beyond the window we advertised
+        if end <= self.expected_seq or end - self.deliver_seq > self.recv_capacity:
+            self.endpoint.queue_ack(self)
+            return
+
+        ranges = self.recv_ranges
+        if seq == self.expected_seq == self.deliver_seq and not self.paused \
+           and not (ranges and ranges.ranges[0][0] < end):
+            # In order with nothing held back: hand the packet's own payload on
+            self.expected_seq = end
+            self._hand_over(payload)
+        else:
+            for lo, hi in ranges.add(max(seq, self.expected_seq), end):
+                self.recv_ring.write(lo, payload[lo - seq:hi - seq], self.deliver_seq)
+                self.recv_buffered += hi - lo
+        if ranges and ranges.ranges[0][0] <= self.expected_seq:
+            self.expected_seq = ranges.ranges[0][1]
+            ranges.trim(self.expected_seq)
+        self._deliver()
+
+        # Cumulative ACK + SACK blocks, coalesced per receive batch
+        self.endpoint.queue_ack(self)
+
+    def held(self, seq, n):
+        """Copy of bytes [seq, seq + n) if they are buffered, else None"""
+        end = seq + n
+        if seq < self.deliver_seq:
+            return None
+        if end <= self.expected_seq or any(lo <= seq and end <= hi for lo, hi in self.recv_ranges):
+            return self.recv_ring.read(seq, n)
+        return None
+
+    def on_parity(self, seq, win, payload):
+        self.last_activity = time.monotonic()
+        self.packets_received += 1
+        self.peer_rwnd = win << WIN_SHIFT
+        if self.fec_decoder is None:
+            self.fec_decoder = FecDecoder(MSS)
+        self.fec_decoder.on_parity(self, seq, payload)
+
+    def _deliver(self):
+        """Hand buffered in-order data on, one view per contiguous run"""
+        while not self.paused and self.deliver_seq < self.expected_seq:
+            chunk = self.recv_ring.view(self.deliver_seq, self.expected_seq)
+            self.recv_buffered -= len(chunk)
+            self._hand_over(chunk)
+
+    def _hand_over(self, chunk):
+        # chunk may be a view into the ring or the datagram: on_receive_cb
+        # must copy what it keeps before returning
+        seq = self.deliver_seq
+        self.deliver_seq += len(chunk)
+        if self.fec_decoder:
+            self.fec_decoder.on_delivered(seq, chunk)
+        if self.on_receive_cb:
+            self.on_receive_cb(chunk)
+
+    def pause_reading(self):
+        """Stop delivering; in-order data is still ACKed but stays buffered,
+        so the advertised window shrinks until resume_reading()"""
+        self.paused = True
+
+    def resume_reading(self):
+        if not self.paused:
+            return
+        self.paused = False
+        self._deliver()
+        self.send_ack(window_update=True)
+
+    def sack_blocks(self):
+        """Up to MAX_SACK_BLOCKS ranges, the most recently updated one first (RFC 2018)"""
+        blocks = self.recv_ranges.ranges[:MAX_SACK_BLOCKS]
+        last = self.recv_ranges.last
+        if last is not None and last[1] > self.expected_seq:
+            blocks = [last] + [b for b in blocks if b is not last][:MAX_SACK_BLOCKS-1]
+        return blocks
+
+    def send_ack(self, window_update=False):
+        flags, payload = ACK_FLAG, b''
+        if window_update:
+            flags |= WINDOW_FLAG
+        if self.sack_enabled and self.recv_ranges:
+            flags |= SACK_FLAG
+            payload = pack_sack(self.sack_blocks())
+        # The seq field of an ACK is free: it echoes how many lost segments
+        # were rebuilt from parity, which the sender counts as losses
+        repaired = self.fec_decoder.repaired & 0xffffffff if self.fec_decoder else 0
+        ack_pkt = make_packet(1, flags, self.conn_id, repaired, self.expected_seq,
+                              self.advertised_window(), payload)
+        self.send_raw(ack_pkt)
+
+    # -----------------
+    # Send side
+    def send_raw(self, packet):
+        self.packets_sent += 1
+        self.endpoint.send_raw(packet, self.addr)
+
+    def send(self, data: bytes, flush=True):
+        """Queue data for delivery; it is referenced, not copied, until ACKed.
+        With flush=False nothing is sent until the next send() or ACK, so
+        pieces queued together go out as full segments."""
+        self.last_activity = time.monotonic()
+        self.send_queue.append(data)
+        if flush:
+            self.try_send()
+
+    def add_producer(self, producer):
+        """Register a pull-based source of data.
+
+        producer.pull(budget) is called only when the window has room and
+        returns a list of bytes-like buffers (about budget bytes, never
+        splitting an application frame) or None once it is exhausted. An
+        empty list means nothing is ready yet; such a producer calls
+        try_send() when it has data again. Several producers on one
+        session are pulled round-robin.
+        """
+        self.last_activity = time.monotonic()
+        self.producers.append(producer)
+        self.try_send()
+
+    def _pull(self, budget):
+        producers = self.producers
+        stalled = 0     # producers in a row that had nothing ready
+        while producers and budget > 0 and stalled < len(producers):
+            producer = producers.popleft()
+            bufs = producer.pull(budget)
+            if bufs is None:
+                continue
+            stalled = 0 if bufs else stalled + 1
+            for b in bufs:
+                self.send_queue.append(b)
+                budget -= len(b)
+            producers.append(producer)
+
+    def _transmit(self, seg):
+        pkt = make_packet(1, 0 if self.synced else SYN_FLAG, self.conn_id, seg.seq, 0, self.advertised_window(), seg.payload)
+        self.send_raw(pkt)
+        seg.sent = self.endpoint.loop.time()
+
+    def wants_to_send(self):
+        """New data is (or may be) waiting and the window has room for it"""
+        if not (self.send_queue or self.producers) or self._window_closed():
+            return False
+        pipe = self.pipe
+        return not pipe or pipe + MSS <= self.send_window()
+
+    def try_send(self):
+        window = self.send_window()
+        scheduler = self.endpoint.scheduler
+        # Holes first (they are inside the peer's window already), then new
+        # data. With nothing in the pipe one segment always fits cwnd.
+        while self.lost:
+            if self.pipe and self.pipe + MSS > window:
+                return
+            seg = self.segments.get(heapq.heappop(self.lost))
+            if seg is None or not seg.lost:
+                continue            # ACKed or SACKed since it was marked
+            seg.lost = False
+            seg.retransmitted = True
+            self.lost_bytes -= len(seg.payload)
+            self._transmit(seg)
+            self.last_retransmit = seg.sent
+            if seg is self.inflight[0]:
+                # The timer guards the oldest segment: give its resend a full
+                # RTO, or it fires just before the repair can be ACKed
+                self.start_timer()
+            self.retransmissions += 1
+            self.retransmitted_bytes += len(seg.payload)
+            if self.fec:
+                self.fec.on_lost()
+            if scheduler:
+                scheduler.charge(self, len(seg.payload))
+
+        # New data goes out when the endpoint's scheduler gives this session
+        # its turn, or right away without one
+        if scheduler is None:
+            self.send_new()
+        elif self.wants_to_send():
+            scheduler.ready(self)
+        if self.inflight and not self.timer.armed:
+            self.start_timer()
+
+        # Nothing in flight means no ACK will come to reopen a closed window
+        # (and the update the peer sends when it frees space can be lost):
+        # probe it, on a timer that leaves cwnd and the RTO alone
+        if not self.inflight and (self.send_queue or self.producers) and self._window_closed():
+            if not self.persist_timer.armed:
+                self.endpoint.timers.schedule(self.persist_timer, self._persist_interval())
+        elif self.persist_timer.armed or self.probes:
+            self.endpoint.timers.cancel(self.persist_timer)
+            self.probes = 0
+
+    def _persist_interval(self):
+        return min(self.rto.rto * (1 << min(self.probes, 16)), PERSIST_MAX)
+
+    def probe_window(self):
+        """Send an empty data segment at next_seq; the peer answers with an
+        ACK carrying its current window"""
+        self.probes += 1
+        self.window_probes += 1
+        self.send_raw(make_packet(1, 0 if self.synced else SYN_FLAG, self.conn_id, self.next_seq, 0,
+                                  self.advertised_window(), b""))
+        self.endpoint.timers.schedule(self.persist_timer, self._persist_interval())
+
+    def send_new(self, limit=None):
+        """Top the queue up from producers, then cut every segment cwnd, the
+        peer's window, the pacer and limit (bytes) allow and encode them in
+        one batch. Returns the number of payload bytes sent."""
+        loop = self.endpoint.loop
+        now = loop.time()
+        window = self.send_window()
+        allowance = None
+        if self.pacer:
+            self.pacer.update(self.cc.cwnd, self.rto.srtt, self.cc.in_slow_start, MSS, now)
+            allowance = self.pacer.allowance(now)
+        paced = allowance
+        if limit is not None:
+            allowance = limit if allowance is None else min(allowance, limit)
+
+        batch = []
+        sent = 0
+        pipe = self.pipe
+        room = self.peer_room()
+        if self.producers and room > 0:
+            budget = min(window - pipe, room) - len(self.send_queue)
+            self._pull(budget if pipe or self.send_queue else max(budget, 1))
+        while self.send_queue:
+            if pipe and pipe + MSS > window:
+                break
+            if room < min(MSS, len(self.send_queue)):
+                break               # the peer's buffer is full: wait for its ACKs
+            if allowance is not None and sent >= allowance:
+                break
+            seg = Segment(self.next_seq, self.send_queue.take(MSS), 0.0)
+            self.inflight.append(seg)
+            self.segments[seg.seq] = seg
+            self.next_seq = seg.end
+            pipe += len(seg.payload)
+            room -= len(seg.payload)
+            sent += len(seg.payload)
+            batch.append(seg)
+        parity = 0
+        if batch:
+            packets = encode_batch(1, 0 if self.synced else SYN_FLAG, self.conn_id, 0, self.advertised_window(),
+                                   [(seg.seq, seg.payload) for seg in batch])
+            for seg, pkt in zip(batch, packets):
+                seg.sent = now
+                self.send_raw(pkt)
+                if self.fec:
+                    parity += self._send_parity(self.fec.add(seg.seq, seg.payload))
+        if self.fec:
+            # Close the group when the data runs out, so the tail is covered too
+            if not self.send_queue and not self.producers:
+                parity += self._send_parity(self.fec.flush())
+            self.fec.adapt()
+        if self.pacer and self.pacer.rate:
+            self.pacer.spend(sent + parity)
+            # Held back by the pacer alone: come back when tokens refill
+            if paced is not None and sent >= paced and self.send_queue and not self.pace_timer.armed \
+               and (not pipe or pipe + MSS <= window) and room >= MSS:
+                self.endpoint.timers.schedule(self.pace_timer, self.pacer.wait(MSS, now))
+        if self.inflight and not self.timer.armed:
+            self.start_timer()
+        return sent
+
+    def _send_parity(self, group):
+        if group is None:
+            return 0
+        start, payload = group
+        self.send_raw(make_packet(1, FEC_FLAG, self.conn_id, start, 0, self.advertised_window(), payload))
+        return len(payload)
+
+    def _repairable(self, seg):
+        """The peer may still rebuild seg from its group's parity: nothing sent
+        after that parity has been SACKed beyond the reordering margin yet"""
+        if self.fec is None:
+            return False
+        end = self.fec.protected_end(seg.seq)
+        return end is not None and self.high_sacked < end + DUP_THRESH * MSS
+
+    def _mark_lost(self, seg):
+        if seg.lost or seg.sacked:
+            return
+        seg.lost = True
+        heapq.heappush(self.lost, seg.seq)
+        self.lost_bytes += len(seg.payload)
+
+    def _apply_sack(self, start, end):
+        """Mark segments inside a SACK block; only ranges not seen before are walked"""
+        start = max(start, self.send_base)
+        if end <= start:
+            return
+        self.high_sacked = max(self.high_sacked, end)
+        for lo, hi in self.sacked_ranges.add(start, end):
+            seg = self.segments.get(lo)
+            while seg is not None and seg.end <= hi:
+                if not seg.sacked:
+                    seg.sacked = True
+                    self.sacked_bytes += len(seg.payload)
+                    if seg.lost:
+                        seg.lost = False
+                        self.lost_bytes -= len(seg.payload)
+                seg = self.segments.get(seg.end)
+
+    def _loss_detected(self):
+        if self.dup_acks >= DUP_THRESH or self.sacked_bytes >= DUP_THRESH * MSS:
+            return True
+        # Early retransmit (RFC 5827): with too few segments out to ever see
+        # DUP_THRESH of them SACKed, a hole is lost once everything after it is
+        first = self.inflight[0]
+        return self.sacked_bytes > 0 and not first.sacked and \
+            self.sacked_bytes >= self.bytes_in_flight - len(first.payload)
+
+    # -----------------
+    def handle_ack(self, ack_num, win=None, sack_blocks=(), repaired=None, window_update=False):
+        self.last_activity = time.monotonic()
+        self.packets_received += 1
+        self.synced = True
+        if win is not None:
+            self.peer_rwnd = win << WIN_SHIFT
+        if self.fec and repaired is not None:
+            self.fec.on_peer_repaired(repaired)
+
+        advanced = ack_num > self.send_base
+        if advanced:
+            # In-flight segments are in seq order: a cumulative ACK pops from the front
+            seg = None
+            clean = True            # no popped segment was resent or SACKed earlier
+            while self.inflight and self.inflight[0].end <= ack_num:
+                seg = self.inflight.popleft()
+                del self.segments[seg.seq]
+                if seg.sacked:
+                    self.sacked_bytes -= len(seg.payload)
+                    clean = False
+                if seg.lost:
+                    seg.lost = False        # its heap entry is skipped lazily
+                    self.lost_bytes -= len(seg.payload)
+                if seg.retransmitted:
+                    clean = False
+            self.rto.reset_backoff()    # new data got through, sample or not
+            rtt = None
+            # Karn's rule: the ACK must be for a segment sent exactly once. An
+            # ACK that jumps over a repaired hole was released by the
+            # retransmission, not by the segments after it, so it gives none;
+            # and neither does one for a segment sent before the last resend.
+            if clean and seg is not None and \
+               (self.last_retransmit is None or seg.sent > self.last_retransmit):
+                rtt = self.endpoint.loop.time() - seg.sent
+                self.rto.sample(rtt)
+                if self.endpoint.on_rtt_cb:
+                    self.endpoint.on_rtt_cb(rtt)
+            acked = ack_num - self.send_base
+            self.send_base = ack_num
+            self.sacked_ranges.trim(ack_num)
+            self.dup_acks = 0
+            if self.fec:
+                self.fec.on_ack(ack_num)
+            if self.send_base >= self.recover:
+                self.cc.on_ack(acked, rtt)     # no window growth during recovery
+        elif ack_num == self.send_base and self.inflight and not window_update:
+            # A window update repeats the ACK number but says nothing about loss
+            self.dup_acks += 1
+
+        for start, end in sack_blocks:
+            self._apply_sack(start, end)
+
+        in_recovery = self.send_base < self.recover
+        if not in_recovery and self.inflight and self._loss_detected() \
+           and not self._repairable(self.inflight[0]):
+            # Fast retransmit: enter recovery once per window
+            print(f"[Transport] Fast retransmit seq {self.send_base}")
+            self.fast_retransmits += 1
+            self.cc.on_loss(self.bytes_in_flight)
+            self.recover = self.next_seq
+            in_recovery = True
+            self._mark_lost(self.inflight[0])
+        if in_recovery:
+            # Every hole below the highest SACKed byte that was not resent yet;
+            # lost_scan remembers how far earlier ACKs already looked.
+            seg = self.segments.get(max(self.lost_scan, self.send_base))
+            while seg is not None and seg.end <= self.high_sacked:
+                if not seg.retransmitted:
+                    if not seg.sacked and self._repairable(seg):
+                        break           # give its parity the chance first
+                    self._mark_lost(seg)
+                self.lost_scan = seg.end
+                seg = self.segments.get(seg.end)
+
+        if self.send_base == self.next_seq:
+            self.stop_timer()
+        elif advanced:
+            self.start_timer()
+        self.try_send()
+
+    def start_timer(self):
+        self.endpoint.timers.schedule(self.timer, self.rto.rto)
+
+    def stop_timer(self):
+        self.endpoint.timers.cancel(self.timer)
+
+    def timeout(self):
+        print(f"[Transport] Timeout (rto={self.rto.rto*1000:.1f}ms)! Retransmitting holes...")
+        self.timeouts += 1
+        self.cc.on_timeout(self.bytes_in_flight)
+        self.recover = self.next_seq
+        self.dup_acks = 0
+        self.rto.backoff()
+        # Resend only what the peer has not SACKed, as the collapsed window allows
+        for seg in self.inflight:
+            self._mark_lost(seg)
+        self.try_send()
+        if self.inflight and not self.timer.armed:
+            self.start_timer()
+
+    def restart(self, conn_id):
+        """The peer no longer knows this session (it answered with RST, e.g.
+        after reaping it while idle): start both streams over from seq 0
+        under conn_id, resending whatever the peer had not acknowledged"""
+        queue = SendQueue()
+        for seg in self.inflight:
+            queue.append(seg.payload)
+        for chunk in self.send_queue.chunks:
+            queue.append(chunk)
+        self.stop_timer()
+        self.endpoint.timers.cancel(self.pace_timer)
+        self.endpoint.timers.cancel(self.persist_timer)
+        self.probes = 0
+        self.conn_id = conn_id
+        self.synced = False
+        self.send_queue = queue
+        self.send_base = self.next_seq = 0
+        self.inflight.clear()
+        self.segments.clear()
+        self.sacked_ranges = RangeSet()
+        self.sacked_bytes = self.lost_bytes = 0
+        self.lost = []
+        self.lost_scan = self.high_sacked = self.dup_acks = self.recover = 0
+        self.peer_rwnd = INITIAL_PEER_WINDOW
+        if self.fec:
+            self.fec = FecEncoder(MSS)
+        self.delivered_before += self.deliver_seq
+        self.expected_seq = self.deliver_seq = 0
+        self.recv_ring = ReorderRing(self.recv_capacity)
+        self.recv_buffered = 0
+        self.recv_ranges = RangeSet()
+        self.fec_decoder = None
+        self.try_send()
+
+    def close(self):
+        self.stop_timer()
+        self.endpoint.timers.cancel(self.pace_timer)
+        self.endpoint.timers.cancel(self.persist_timer)
+        if self.endpoint.scheduler:
+            self.endpoint.scheduler.forget(self)
+        if self.on_close_cb:
+            cb, self.on_close_cb = self.on_close_cb, None
+            cb()
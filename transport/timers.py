@@ -0,0 +1,94 @@
+import heapq
+
+TICK = 0.001  # timer resolution in seconds
+
+
+class Timer:
+    """A re-armable timer owned by a TimerWheel"""
+    __slots__ = ("callback", "tick")
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.tick = None   # bucket this timer is filed under, None when idle
+
+    @property
+    def armed(self):
+        return self.tick is not None
+
+
+class TimerWheel:
+    """All transport timers of one event loop, driven by a single loop.call_at.
+
+    Timers are filed into buckets of TICK resolution. Re-arming a timer on
+    every ACK is O(1) (move between bucket sets); only the earliest bucket
+    is scheduled with the loop, so there is never more than one pending
+    loop callback no matter how many sessions are active.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.buckets = {}   # tick -> set of Timer
+        self.ticks = []     # heap of ticks that have (or had) a bucket
+        self._handle = None
+        self._handle_tick = None
+
+    def __len__(self):
+        return sum(len(b) for b in self.buckets.values())
+
+    def schedule(self, timer, delay):
+        """(Re)arm timer to fire delay seconds from now"""
+        self.cancel(timer)
+        tick = int((self.loop.time() + delay) / TICK) + 1
+        bucket = self.buckets.get(tick)
+        if bucket is None:
+            bucket = self.buckets[tick] = set()
+            heapq.heappush(self.ticks, tick)
+        bucket.add(timer)
+        timer.tick = tick
+        if self._handle_tick is None or tick < self._handle_tick:
+            self._arm(tick)
+
+    def cancel(self, timer):
+        if timer.tick is None:
+            return
+        bucket = self.buckets.get(timer.tick)
+        if bucket is not None:
+            bucket.discard(timer)
+            if not bucket:
+                del self.buckets[timer.tick]   # heap entry is dropped lazily
+        timer.tick = None
+
+    def close(self):
+        if self._handle:
+            self._handle.cancel()
+        self._handle = self._handle_tick = None
+        for bucket in self.buckets.values():
+            for timer in bucket:
+                timer.tick = None
+        self.buckets.clear()
+        self.ticks.clear()
+
+    # -----------------
+    def _arm(self, tick):
+        if self._handle:
+            self._handle.cancel()
+        self._handle_tick = tick
+        self._handle = self.loop.call_at(tick * TICK, self._run)
+
+    def _run(self):
+        self._handle = self._handle_tick = None
+        now_tick = int(self.loop.time() / TICK + 0.5)
+        while self.ticks and self.ticks[0] <= now_tick:
+            tick = heapq.heappop(self.ticks)
+            bucket = self.buckets.pop(tick, None)
+            if not bucket:
+                continue
+            for timer in list(bucket):
+                if timer.tick != tick:      # cancelled or re-armed by an earlier callback
+                    continue
+                timer.tick = None
+                timer.callback()
+        # Skip heap entries whose buckets were emptied by cancel()
+        while self.ticks and self.ticks[0] not in self.buckets:
+            heapq.heappop(self.ticks)
+        if self.ticks and self.ticks[0] != self._handle_tick:
+            self._arm(self.ticks[0])
@@ -1,69 +1,252 @@
-import asyncio, time, threading
-from .header import make_packet, unpack_packet
+import asyncio, random, socket, time
+from .header import decode, make_packet, unpack_sack, FLAGS, CONN_ID, SEQ, ACK, WIN
+from .session import Session, MSS, ACK_FLAG, SACK_FLAG, FEC_FLAG, SYN_FLAG, RST_FLAG, WINDOW_FLAG, RECV_CAPACITY
+from .timers import TimerWheel
+from .pacing import FairScheduler
 
-MSS = 1200
+SESSION_IDLE_TIMEOUT = 120.0   # seconds before an idle session is reaped
+REAP_INTERVAL = 10.0
+ACK_EVERY = 2                  # data segments per ACK inside a receive batch
+
+def resolve(addr):
+    """Numeric IPv4 (host, port) of addr. Replies come from the numeric
+    address, so that is what a session must be keyed on."""
+    info = socket.getaddrinfo(addr[0], addr[1], socket.AF_INET, socket.SOCK_DGRAM)
+    return info[0][4][:2]
 
 class GBNTransport(asyncio.DatagramProtocol):
-    def __init__(self, local_port, remote_addr=None, window_size=5, loss_wrapper=None):
+    """UDP endpoint demultiplexing reliable sessions by (peer address, conn_id).
+
+    A client passes remote_addr and gets a default session it can use through
+    send()/on_receive_cb. A server leaves remote_addr unset and is told about
+    each new peer session through on_session_cb.
+
+    pacing spreads every session's window over its RTT. rate (bytes/s)
+    caps the endpoint's total egress and shares it among sessions by
+    weighted fair queuing; client_rate caps each peer host. fec adds an
+    XOR parity packet per group of data segments (see fec.py); any
+    endpoint uses the parity it receives.
+    """
+    def __init__(self, local_port, remote_addr=None, window_size=None, loss_wrapper=None,
+                 max_sessions=1024, sack_enabled=True, cc="reno", recv_capacity=RECV_CAPACITY,
+                 pacing=True, rate=None, client_rate=None, fec=False):
         self.local_port = local_port
-        self.remote_addr = remote_addr
+        self.remote_addr = resolve(remote_addr) if remote_addr else None
         self.window_size = window_size
         self.loss_wrapper = loss_wrapper
+        self.max_sessions = max_sessions
+        self.sack_enabled = sack_enabled
+        self.cc = cc                     # congestion controller name or class for new sessions
+        self.recv_capacity = recv_capacity
+        self.pacing = pacing
+        self.fec = fec
 
-        self.send_base = 0
-        self.next_seq = 0
-        self.send_buffer = bytearray()
-        self.unacked = {}          # seq -> (packet, timestamp)
-        self.dup_ack_count = {}    # seq -> duplicate ACKs
-        self.timer = None
-        self.timer_interval = 0.5
+        self.sessions = {}         # (addr, conn_id) -> Session
+        self.on_session_cb = None  # called with each new peer-initiated Session
+        self.on_rtt_cb = None      # called with every RTT sample (seconds)
+        self.closed_counters = {}  # counter totals of sessions already closed
+        self.checksum_drops = 0
+        self.send_errors = 0
+        self._next_conn_id = random.randint(1, 0xffff)
 
-        self.expected_seq = 0
-        self.recv_buffer = {}
         self.loop = asyncio.get_event_loop()
+        self.timers = TimerWheel(self.loop)   # retransmission timers of every session
+        self.scheduler = FairScheduler(self.timers, rate, client_rate, MSS) if rate or client_rate else None
         self.transport = None
-        self.on_receive_cb = None
-        self.retransmissions = 0
-        self.sack_enabled = True  # SACK-lite
+        self._reaper = None
+        self._pending_acks = None   # sessions owing an ACK while a receive batch is processed
+
+        self.default_session = self.open_session(self.remote_addr) if remote_addr else None
+
+    # -----------------
+    # Default-session shortcuts (client side)
+    @property
+    def on_receive_cb(self):
+        return self.default_session.on_receive_cb if self.default_session else None
+
+    @on_receive_cb.setter
+    def on_receive_cb(self, cb):
+        self.default_session.on_receive_cb = cb
+
+    @property
+    def retransmissions(self):
+        return sum(s.retransmissions for s in self.sessions.values())
+
+    def send(self, data: bytes, flush=True):
+        self.default_session.send(data, flush)
+
+    def add_producer(self, producer):
+        self.default_session.add_producer(producer)
+
+    # -----------------
+    def allocate_conn_id(self, addr):
+        """Pick a conn_id not currently in use towards addr (0 is reserved)"""
+        for _ in range(0xffff):
+            cid = self._next_conn_id
+            self._next_conn_id = cid % 0xffff + 1
+            if (addr, cid) not in self.sessions:
+                return cid
+        raise RuntimeError("No free conn_id for %r" % (addr,))
+
+    def open_session(self, addr, conn_id=None, active=True):
+        """active is False for a session a peer's first segment opened"""
+        if active:
+            addr = resolve(addr)
+        if conn_id is None:
+            conn_id = self.allocate_conn_id(addr)
+        s = Session(self, addr, conn_id, self.window_size, self.sack_enabled,
+                    self.cc, self.recv_capacity, self.pacing, self.fec, active)
+        self.sessions[s.key] = s
+        return s
+
+    def close_session(self, session):
+        session.close()
+        for name, value in session.counters().items():
+            self.closed_counters[name] = self.closed_counters.get(name, 0) + value
+        self.sessions.pop(session.key, None)
+        if session is self.default_session:
+            self.default_session = None
+
+    def counters(self):
+        """Counter totals over every session this endpoint has had"""
+        totals = dict(self.closed_counters)
+        for s in self.sessions.values():
+            for name, value in s.counters().items():
+                totals[name] = totals.get(name, 0) + value
+        totals["checksum_drops"] = self.checksum_drops
+        totals["send_errors"] = self.send_errors
+        return totals
+
+    def stats(self):
+        per_session = {s.key: s.info() for s in self.sessions.values()}
+        return {
+            "sessions": len(self.sessions),
+            "memory_bytes": sum(i["memory_bytes"] for i in per_session.values()),
+            "per_session": per_session,
+        }
+
+    def _reap_idle(self):
+        now = time.monotonic()
+        for s in list(self.sessions.values()):
+            # Only peer-opened sessions: the application still holds the ones it opened
+            if not s.active and s.idle() and \
+               now - s.last_activity > SESSION_IDLE_TIMEOUT:
+                self.close_session(s)
+        self._reaper = self.loop.call_later(REAP_INTERVAL, self._reap_idle)
 
     # -----------------
     def connection_made(self, transport):
         self.transport = transport
+        self._reaper = self.loop.call_later(REAP_INTERVAL, self._reap_idle)
         print(f"[Transport] Listening on port {self.local_port}")
 
+    def connection_lost(self, exc):
+        if self._reaper:
+            self._reaper.cancel()
+        for s in list(self.sessions.values()):
+            s.close()
+        self.timers.close()
+
+    def error_received(self, exc):
+        print(f"[Transport] Socket error: {exc}")
+
+    def send_failed(self, data, addr, exc):
+        """The socket refused a datagram: it never left, so take it off the
+        session's sent count and report it (the session retransmits it on
+        its timer like any lost segment)"""
+        self.send_errors += 1
+        try:
+            fields, _ = decode(data)
+            session = self.sessions.get((addr, fields[CONN_ID]))
+        except Exception:
+            session = None
+        if session is None or not session.send_errors:    # once per session
+            print(f"[Transport] Send to {addr} failed: {exc}")
+        if session is not None:
+            session.packets_sent -= 1
+            session.send_errors += 1
+
     def datagram_received(self, data, addr):
         try:
-            hdr, payload = unpack_packet(data)
+            fields, payload = decode(data)
         except Exception as e:
+            self.checksum_drops += 1
             print("Bad packet:", e)
             return
 
+        key = (addr, fields[CONN_ID])
+        flags = fields[FLAGS]
+        session = self.sessions.get(key)
+
         # Handle ACK
-        if hdr['flags'] & 0x02:
-            self.handle_ack(hdr['ack'])
+        if flags & ACK_FLAG:
+            if session:
+                blocks = unpack_sack(payload) if flags & SACK_FLAG else ()
+                session.handle_ack(fields[ACK], fields[WIN], blocks, fields[SEQ], bool(flags & WINDOW_FLAG))
+            return
+        if flags & FEC_FLAG:
+            if session:
+                session.on_parity(fields[SEQ], fields[WIN], payload)
             return
+        if flags & RST_FLAG:
+            if session:
+                self.reset_session(session)
+            return
+
+        if session is None:
+            if not flags & SYN_FLAG:
+                # Mid-stream data of a session we do not have (reaped while
+                # idle, or from before a restart): its seqs mean nothing to a
+                # new session, so tell the peer to start over
+                self.send_raw(make_packet(1, RST_FLAG, fields[CONN_ID], 0, 0, 0, b""), addr)
+                return
+            if len(self.sessions) >= self.max_sessions:
+                print(f"[Transport] Session table full, dropping {key}")
+                return
+            session = self.open_session(addr, fields[CONN_ID], active=False)
+            if self.on_session_cb:
+                self.on_session_cb(session)
+        session.on_data(fields[SEQ], fields[WIN], payload)
 
-        seq = hdr['seq']
-        # Drop duplicates
-        if seq < self.expected_seq:
-            ack_pkt = make_packet(1, 0x02, hdr['conn_id'], 0, self.expected_seq, 4096, b'')
-            self.send_raw(ack_pkt, addr)
+    def reset_session(self, session):
+        """The peer answered with RST: reopen a session we opened under a
+        fresh conn_id (stale packets of the old one then miss it), or drop
+        one the peer had opened"""
+        if not session.active:
+            print(f"[Transport] Session {session.key} reset by peer, closing")
+            self.close_session(session)
             return
+        del self.sessions[session.key]
+        conn_id = self.allocate_conn_id(session.addr)
+        print(f"[Transport] Session {session.key} reset by peer, reopening as conn_id {conn_id}")
+        session.restart(conn_id)
+        self.sessions[session.key] = session
 
-        # Buffer out-of-order if SACK
-        if self.sack_enabled and seq != self.expected_seq:
-            self.recv_buffer[seq] = payload
-        else:
-            self.recv_buffer[seq] = payload
-            while self.expected_seq in self.recv_buffer:
-                chunk = self.recv_buffer.pop(self.expected_seq)
-                if self.on_receive_cb:
-                    self.on_receive_cb(chunk)
-                self.expected_seq += len(chunk)
+    def datagrams_received(self, batch):
+        """Process a receive batch, then send one ACK per session that got data"""
+        self._pending_acks = pending = {}
+        try:
+            for data, addr in batch:
+                self.datagram_received(data, addr)
+        finally:
+            self._pending_acks = None
+        for session, unacked in pending.items():
+            if unacked:
+                session.send_ack()
 
-        # Send cumulative ACK + optional SACK
-        ack_pkt = make_packet(1, 0x02, hdr['conn_id'], 0, self.expected_seq, 4096, b'')
-        self.send_raw(ack_pkt, addr)
+    def queue_ack(self, session):
+        """ACK every ACK_EVERY segments within a batch (like TCP delayed ACK), so
+        losing one ACK does not stall a whole window"""
+        pending = self._pending_acks
+        if pending is None:
+            session.send_ack()
+            return
+        n = pending.get(session, 0) + 1
+        if n >= ACK_EVERY:
+            session.send_ack()
+            pending[session] = 0
+        else:
+            pending[session] = n
 
     # -----------------
     def send_raw(self, packet, addr=None):
@@ -71,60 +254,3 @@ class GBNTransport(asyncio.DatagramProtocol):
             self.loss_wrapper.sendto(packet, addr or self.remote_addr)
         else:
             self.transport.sendto(packet, addr or self.remote_addr)
-
-    def send(self, data: bytes):
-        self.send_buffer.extend(data)
-        self.try_send()
-
-    def try_send(self):
-        while (self.next_seq - self.send_base)//MSS < self.window_size and \
-              self.next_seq - self.send_base < len(self.send_buffer):
-            offset = self.next_seq - self.send_base
-            payload = self.send_buffer[offset:offset+MSS]
-            pkt = make_packet(1, 0, 1, self.next_seq, 0, 4096, payload)
-            self.send_raw(pkt)
-            self.unacked[self.next_seq] = (pkt, time.time())
-            self.dup_ack_count[self.next_seq] = 0
-            if not self.timer:
-                self.start_timer()
-            self.next_seq += len(payload)
-
-    # -----------------
-    def handle_ack(self, ack_num):
-        remove_seqs = [seq for seq in self.unacked if seq < ack_num]
-        for seq in remove_seqs:
-            del self.unacked[seq]
-            del self.dup_ack_count[seq]
-        # Fast retransmit on 3 duplicate ACKs
-        for seq in self.unacked:
-            if self.dup_ack_count[seq] >= 3:
-                print(f"[Transport] Fast retransmit seq {seq}")
-                pkt, _ = self.unacked[seq]
-                self.send_raw(pkt)
-                self.retransmissions += 1
-                self.dup_ack_count[seq] = 0
-
-        self.send_base = ack_num
-        if self.send_base == self.next_seq:
-            self.stop_timer()
-        else:
-            self.start_timer()
-        self.try_send()
-
-    def start_timer(self):
-        self.stop_timer()
-        self.timer = threading.Timer(self.timer_interval, self.timeout)
-        self.timer.start()
-
-    def stop_timer(self):
-        if self.timer:
-            self.timer.cancel()
-            self.timer = None
-
-    def timeout(self):
-        print("[Transport] Timeout! Retransmitting...")
-        for seq, (pkt, _) in self.unacked.items():
-            self.send_raw(pkt)
-            self.unacked[seq] = (pkt, time.time())
-            self.retransmissions += 1
-        self.start_timer()